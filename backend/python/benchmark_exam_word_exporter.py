@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Benchmark for Exam Word Exporter body rendering
+Author: Linh Dang Dev
+
+Builds synthetic exams (4 answers per question) and compares the previous
+python-docx add_paragraph/add_run path with the fragment builder now used by
+add_questions and add_answer_key. Both paths must produce the same body XML.
+Needs python-docx only; no database connection is made.
+
+Usage: python benchmark_exam_word_exporter.py [--sizes 50,500,2000] [--repeat N]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from docx import Document
+from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.shared import Inches, Pt
+from lxml import etree
+
+# Add the python directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from exam_word_exporter import ExamWordExporter
+
+EXPORT_OPTIONS = {'showAnswers': True, 'separateAnswerSheet': True}
+
+
+def build_questions(count):
+    questions = []
+    for i in range(count):
+        questions.append({
+            'NoiDung': f"Question {i}: which statement about\tcase {i} is correct?\nChoose one.",
+            'answers': [
+                {'NoiDung': f"Option {j} for question {i} <{j}> & more", 'LaDapAn': j == i % 4}
+                for j in range(4)
+            ]
+        })
+    return questions
+
+
+def add_questions_python_docx(doc, questions, export_options):
+    """Previous rendering path: one python-docx proxy call per paragraph and run"""
+    show_answers = export_options.get('showAnswers', False)
+
+    for i, question in enumerate(questions, 1):
+        q_p = doc.add_paragraph()
+        q_num_run = q_p.add_run(f"Câu {i}: ")
+        q_num_run.bold = True
+        q_p.add_run(question['NoiDung'] or '')
+
+        for j, answer in enumerate(question['answers']):
+            answer_p = doc.add_paragraph()
+            answer_p.paragraph_format.left_indent = Inches(0.3)
+            answer_run = answer_p.add_run(f"{chr(65 + j)}. {answer['NoiDung'] or ''}")
+            if show_answers and answer['LaDapAn']:
+                answer_run.bold = True
+                correct_run = answer_p.add_run(" ✓")
+                correct_run.font.color.rgb = None
+                correct_run.bold = True
+
+        doc.add_paragraph()
+
+    if export_options.get('separateAnswerSheet', False):
+        doc.add_page_break()
+        title_p = doc.add_paragraph()
+        title_p.alignment = WD_ALIGN_PARAGRAPH.CENTER
+        title_run = title_p.add_run("ĐÁP ÁN")
+        title_run.font.size = Pt(14)
+        title_run.bold = True
+        doc.add_paragraph()
+
+        for i, question in enumerate(questions, 1):
+            correct_answers = [chr(65 + j) for j, answer in enumerate(question['answers'])
+                               if answer['LaDapAn']]
+            if correct_answers:
+                doc.add_paragraph().add_run(f"Câu {i}: {', '.join(correct_answers)}")
+
+
+def render_python_docx(questions):
+    doc = Document()
+    add_questions_python_docx(doc, questions, EXPORT_OPTIONS)
+    return doc
+
+
+def render_fragments(questions):
+    doc = Document()
+    exporter = ExamWordExporter({})
+    exporter.add_questions(doc, questions, EXPORT_OPTIONS)
+    exporter.add_answer_key(doc, questions, EXPORT_OPTIONS)
+    return doc
+
+
+def body_xml(doc):
+    return b''.join(etree.tostring(child, method='c14n') for child in doc.element.body)
+
+
+def best_of(repeat, func, *args):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark exam body rendering')
+    parser.add_argument('--sizes', default='50,500,2000', help='Comma-separated question counts')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement, best is reported')
+    args = parser.parse_args()
+
+    print(f"{'questions':>10} {'python-docx':>13} {'fragments':>11} {'speedup':>8}")
+    for size in (int(value) for value in args.sizes.split(',')):
+        questions = build_questions(size)
+
+        # Both paths must write the same document body
+        assert body_xml(render_python_docx(questions)) == body_xml(render_fragments(questions))
+
+        proxy_time = best_of(args.repeat, render_python_docx, questions)
+        fragment_time = best_of(args.repeat, render_fragments, questions)
+        print(f"{size:>10} {proxy_time * 1000:>10.1f} ms {fragment_time * 1000:>8.1f} ms "
+              f"{proxy_time / fragment_time:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
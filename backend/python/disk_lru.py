@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Byte-budgeted directory of cache files with least-recently-used eviction
+Author: Linh Dang Dev
+
+Used by the exporter's on-disk caches. Every entry is one file,
+<key><suffix>, written to a temporary file and renamed into place so
+readers never see a partial file.
+
+The directory is scanned once when the cache opens. Sizes and recency are
+then kept in memory, ordered from least to most recently used, so a put
+evicts from the front of that order instead of stat-ing every file. A hit
+also touches the file's mtime, which is the order the next scan (another
+process, or a restart) starts from. Entries other processes add to a
+shared directory are only seen after such a scan.
+"""
+
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+
+def atomic_write(path: str, data: bytes):
+    """Write data to path through a temporary file in the same directory"""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+class DiskLRU:
+    """Files of one directory kept under max_bytes, oldest use evicted first
+
+    Keys are file names without the suffix; with an empty suffix every file
+    in the directory (but not its subdirectories) is an entry. Thread-safe.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, suffix: str = ''):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[str, int]' = OrderedDict()
+        self._total = 0
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        found = []
+        for entry in os.scandir(self.directory):
+            name = entry.name
+            if not entry.is_file() or name.endswith('.tmp') or not name.endswith(self.suffix):
+                continue
+            stat = entry.stat()
+            key = name[:len(name) - len(self.suffix)] if self.suffix else name
+            found.append((stat.st_mtime_ns, key, stat.st_size))
+        found.sort()
+        for _, key, size in found:
+            self._entries[key] = size
+            self._total += size
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}{self.suffix}")
+
+    def keys(self) -> List[str]:
+        """Keys from least to most recently used"""
+        with self._lock:
+            return list(self._entries)
+
+    def touch(self, key: str) -> Optional[str]:
+        """Mark an entry as just used and return its path; None if it is gone"""
+        path = self.path_for(key)
+        with self._lock:
+            if key not in self._entries:
+                return None
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                # Evicted by another process sharing the directory
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+        return path
+
+    def discard(self, key: str):
+        """Forget an entry whose file turned out to be missing or unusable"""
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+
+    def put(self, key: str, data: bytes) -> List[str]:
+        """Store data as the most recently used entry; returns the evicted keys"""
+        atomic_write(self.path_for(key), data)
+        with self._lock:
+            self._total += len(data) - self._entries.get(key, 0)
+            self._entries[key] = len(data)
+            self._entries.move_to_end(key)
+            return self._evict(keep=key)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._total, 'evictions': self.evictions}
+
+    def _drop(self, key: str):
+        self._total -= self._entries.pop(key)
+
+    def _evict(self, keep: str) -> List[str]:
+        """Remove least recently used entries past the budget; called with the lock held"""
+        evicted = []
+        while self._total > self.max_bytes:
+            key = next(iter(self._entries))
+            if key == keep:
+                break  # only the new entry is left; kept even when over budget
+            self._drop(key)
+            self.evictions += 1
+            evicted.append(key)
+            try:
+                os.remove(self.path_for(key))
+            except FileNotFoundError:
+                pass
+        return evicted
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Batch export of many exams into one ZIP archive
+Author: Linh Dang Dev
+
+Exports every approved exam in a list of IDs or matching a filter (subject,
+faculty, creation date range) with one database connection. Exam data is
+fetched with set-based queries per chunk of exams, documents are rendered
+in worker processes, and each finished document is written straight into
+the archive, so only a few documents are held in memory at a time. The
+archive ends with manifest.json listing every exam and its outcome.
+
+Usage: python exam_batch_export.py (--exam-ids ID,ID | --subject ID | --faculty ID |
+                                    --from DATE | --to DATE) [--output PATH | --zip-fd FD]
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import re
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+
+from exam_word_exporter import (BATCH_QUERY_CHUNK, DEFAULT_DB_CONFIG, ExamWordExporter,
+                                add_fragment_arguments, add_media_arguments, fragments_from_args,
+                                media_from_args, open_binary_fd)
+
+logger = logging.getLogger('exam_batch_export')
+
+DEFAULT_BATCH_WORKERS = min(4, os.cpu_count() or 1)
+
+# Characters Windows does not allow in archive member names
+UNSAFE_NAME_CHARS = re.compile(r'[\\/:*?"<>|\x00-\x1f]+')
+
+
+# Fragment cache of a render process, set once by the pool initializer
+_batch_fragments = None
+
+
+def _init_batch_worker(fragments=None):
+    global _batch_fragments
+    _batch_fragments = fragments
+
+
+def _render_exam_document(exam_data, export_options):
+    """Worker entry point: render one exam to .docx bytes"""
+    doc = ExamWordExporter({}, fragments=_batch_fragments).create_word_document(exam_data, export_options)
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+
+def _safe_name(value, fallback):
+    name = UNSAFE_NAME_CHARS.sub('_', str(value or '')).strip(' ._')
+    return name[:100] or fallback
+
+
+def member_name(exam_info):
+    """Archive path of an exam: <subject>/<exam title>_<exam ID prefix>.docx"""
+    exam_id = str(exam_info['MaDeThi'])
+    subject = _safe_name(exam_info.get('TenMonHoc'), 'Khac')
+    title = _safe_name(exam_info.get('TenDeThi'), 'De_thi')
+    return f"{subject}/{title}_{exam_id[:8]}.docx"
+
+
+def export_exam_batch(exporter, exam_ids, export_options, output_stream,
+                      workers=DEFAULT_BATCH_WORKERS):
+    """Write the documents of exam_ids into a ZIP archive on output_stream
+
+    The exporter must be connected. output_stream does not need to be
+    seekable. Returns the batch result; an exam that fails to render is
+    recorded in the manifest and does not stop the batch.
+    """
+    # GUIDs compare case-insensitively in SQL Server
+    exam_ids = list({str(exam_id).lower(): exam_id for exam_id in exam_ids}.values())
+    manifest = []
+    exported = 0
+    total_questions = 0
+    # Results waiting to be written are bounded so memory stays flat
+    window = max(1, workers) * 2
+
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker,
+                                       initargs=(exporter.fragments,))
+    else:
+        executor = None
+        _init_batch_worker(exporter.fragments)
+    try:
+        with zipfile.ZipFile(output_stream, 'w') as archive:
+            used_names = set()
+            pending = deque()
+
+            def write_next():
+                nonlocal exported, total_questions
+                exam_data, entry, get_document = pending.popleft()
+                try:
+                    document = get_document()
+                except Exception as e:
+                    logger.error(f"Failed to render exam {entry['exam_id']}: {e}")
+                    entry.update(success=False, message=str(e))
+                    return
+                # Documents are already deflated, so they are stored as is
+                archive.writestr(entry['file'], document, compress_type=zipfile.ZIP_STORED)
+                entry.update(success=True, size=len(document))
+                exported += 1
+                total_questions += exam_data['total_questions']
+
+            for start in range(0, len(exam_ids), BATCH_QUERY_CHUNK):
+                chunk = exam_ids[start:start + BATCH_QUERY_CHUNK]
+                exams = exporter.get_exams_data(chunk)
+                exporter.resolve_images(exams)
+
+                found = {str(exam_data['exam']['MaDeThi']).lower() for exam_data in exams}
+                for exam_id in chunk:
+                    if str(exam_id).lower() not in found:
+                        manifest.append({'exam_id': str(exam_id), 'success': False,
+                                         'message': 'Approved exam not found'})
+
+                for exam_data in exams:
+                    exam_info = exam_data['exam']
+                    name = member_name(exam_info)
+                    if name in used_names:
+                        name = f"{name[:-5]}_{str(exam_info['MaDeThi'])}.docx"
+                    used_names.add(name)
+
+                    entry = {'exam_id': str(exam_info['MaDeThi']), 'title': exam_info['TenDeThi'],
+                             'subject': exam_info['TenMonHoc'], 'file': name,
+                             'total_questions': exam_data['total_questions']}
+                    manifest.append(entry)
+
+                    if executor is not None:
+                        future = executor.submit(_render_exam_document, exam_data, export_options)
+                        pending.append((exam_data, entry, future.result))
+                    else:
+                        pending.append((exam_data, entry, lambda exam_data=exam_data:
+                                        _render_exam_document(exam_data, export_options)))
+                    if len(pending) >= window:
+                        write_next()
+
+            while pending:
+                write_next()
+
+            archive.writestr('manifest.json', json.dumps(manifest, ensure_ascii=False, indent=2,
+                                                         default=str),
+                             compress_type=zipfile.ZIP_DEFLATED)
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    failed = [entry for entry in manifest if not entry['success']]
+    return {
+        'success': exported > 0 or not manifest,
+        'message': f"Exported {exported} of {len(manifest)} exams",
+        'exported': exported,
+        'failed': failed,
+        'total_questions': total_questions
+    }
+
+
+def parse_date(value):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid date (expected YYYY-MM-DD): {value}")
+
+
+def main():
+    """Main function for command line usage"""
+    parser = argparse.ArgumentParser(description='Export many approved exams into one ZIP archive')
+    parser.add_argument('--exam-ids', help='Comma-separated exam IDs (MaDeThi)')
+    parser.add_argument('--subject', help='Exams of this subject (MaMonHoc)')
+    parser.add_argument('--faculty', help='Exams of this faculty (MaKhoa)')
+    parser.add_argument('--from', dest='created_from', type=parse_date,
+                        help='Exams created on or after this date (YYYY-MM-DD)')
+    parser.add_argument('--to', dest='created_to', type=parse_date,
+                        help='Exams created on or before this date (YYYY-MM-DD)')
+    parser.add_argument('--options', default='{}', help='Export options JSON applied to every exam')
+    parser.add_argument('--output', help='Archive path (default: exam_batch_<timestamp>.zip)')
+    parser.add_argument('--zip-fd', type=int,
+                        help='Write the archive to this file descriptor (1 for stdout) instead of a file')
+    parser.add_argument('--status-fd', type=int, default=1,
+                        help='File descriptor for the JSON status (default: 1, stdout)')
+    parser.add_argument('--workers', type=int, default=DEFAULT_BATCH_WORKERS,
+                        help=f'Processes rendering documents (default: {DEFAULT_BATCH_WORKERS})')
+    add_media_arguments(parser)
+    add_fragment_arguments(parser)
+    args = parser.parse_args()
+
+    if not (args.exam_ids or args.subject or args.faculty or args.created_from or args.created_to):
+        parser.error('give --exam-ids or at least one filter')
+    if args.zip_fd is not None and args.output:
+        parser.error('--output and --zip-fd cannot be used together')
+    if args.zip_fd is not None and args.zip_fd == args.status_fd:
+        parser.error('--zip-fd and --status-fd must be different descriptors')
+
+    try:
+        export_options = json.loads(args.options)
+    except json.JSONDecodeError as e:
+        parser.error(f"Error parsing export options JSON: {e}")
+
+    exporter = ExamWordExporter(DEFAULT_DB_CONFIG, media=media_from_args(parser, args),
+                                fragments=fragments_from_args(args))
+    output_path = None
+    try:
+        if not exporter.connect_database():
+            raise Exception("Failed to connect to database")
+
+        exam_ids = [exam_id.strip() for exam_id in (args.exam_ids or '').split(',') if exam_id.strip()]
+        if args.subject or args.faculty or args.created_from or args.created_to:
+            matching = exporter.find_exam_ids(args.subject, args.faculty,
+                                              args.created_from, args.created_to)
+            if exam_ids:
+                wanted = {exam_id.lower() for exam_id in exam_ids}
+                matching = [exam_id for exam_id in matching if str(exam_id).lower() in wanted]
+            exam_ids = matching
+        logger.info(f"Exporting {len(exam_ids)} exams")
+
+        if args.zip_fd is not None:
+            output_stream = open_binary_fd(args.zip_fd)
+            result = export_exam_batch(exporter, exam_ids, export_options, output_stream, args.workers)
+            output_stream.flush()
+        else:
+            output_path = args.output or f"exam_batch_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+            with open(output_path, 'wb') as output_stream:
+                result = export_exam_batch(exporter, exam_ids, export_options, output_stream, args.workers)
+        result['zip_path'] = output_path
+
+    except Exception as e:
+        logger.error(f"Batch export failed: {e}")
+        result = {'success': False, 'message': str(e), 'zip_path': None}
+    finally:
+        if exporter.connection:
+            exporter.connection.close()
+
+    # Output result as JSON
+    if args.status_fd == 1:
+        print(json.dumps(result, ensure_ascii=False, default=str))
+    else:
+        with os.fdopen(args.status_fd, 'w', closefd=False) as status:
+            status.write(json.dumps(result, ensure_ascii=False, default=str) + '\n')
+
+
+if __name__ == "__main__":
+    main()
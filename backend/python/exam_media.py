@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+Images referenced by exam content, fetched once into an on-disk cache
+Author: Linh Dang Dev
+
+Question and answer content refers to images with <img src="..."> tags and
+[IMAGE: filename] markers. References are fetched concurrently from the
+configured storage (Digital Ocean Spaces or another HTTP endpoint such as an
+S3-compatible mock, or a local directory), scaled down to print width,
+converted to a format Word can embed, and kept on disk. A URL maps to the
+hash of the content it returned, and prepared images are stored by that
+hash, so a figure shared by several exams (or uploaded twice) is downloaded
+and resized only once. The cache directory is kept under a byte budget by
+evicting the least recently used images.
+
+Image URLs are assumed immutable: a URL is not fetched again while its
+image is cached, so an image replaced under the same name keeps being served
+until it is evicted. Upload changed images under a new name.
+"""
+
+import hashlib
+import io
+import logging
+import os
+import re
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from disk_lru import DiskLRU, atomic_write
+
+logger = logging.getLogger('exam_media')
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+DEFAULT_FETCH_WORKERS = 8
+FETCH_TIMEOUT = 15
+MAX_IMAGE_BYTES = 20 * 1024 * 1024
+
+# Wider images are scaled down; 6 inches at 200 dpi
+DEFAULT_MAX_WIDTH = 1200
+
+# A failed fetch is not retried for this long
+FAILED_RETRY_SECONDS = 300
+
+# Failed fetches remembered at once; the oldest are forgotten first
+MAX_FAILED = 10000
+
+# Public image base when no storage is configured (see MediaMarkupUtil)
+DEFAULT_IMAGE_BASE_URL = 'https://datauploads.sgp1.digitaloceanspaces.com/images/'
+
+IMAGE_REFERENCE = re.compile(
+    r'<img\b[^>]*?\bsrc\s*=\s*(["\'])(?P<src>.*?)\1[^>]*>|\[IMAGE:\s*(?P<marker>[^\]]+)\]',
+    re.IGNORECASE | re.DOTALL)
+
+# Formats Word embeds as is, by magic bytes
+WORD_IMAGE_SIGNATURES = {
+    b'\x89PNG\r\n\x1a\n': 'png',
+    b'\xff\xd8\xff': 'jpg',
+    b'GIF87a': 'gif',
+    b'GIF89a': 'gif',
+    b'BM': 'bmp',
+    b'II*\x00': 'tiff',
+    b'MM\x00*': 'tiff',
+}
+
+
+def reference_of(match) -> str:
+    """Reference of an IMAGE_REFERENCE match: the img src or the marker filename"""
+    src = match.group('src')
+    return src.strip() if src is not None else match.group('marker').strip()
+
+
+def find_image_references(text: str) -> List[str]:
+    """Return image references found in text, in order of appearance"""
+    if not text:
+        return []
+    return [reference_of(match) for match in IMAGE_REFERENCE.finditer(text)]
+
+
+def image_format(data: bytes) -> Optional[str]:
+    for signature, name in WORD_IMAGE_SIGNATURES.items():
+        if data.startswith(signature):
+            return name
+    return None
+
+
+class LocalMediaStorage:
+    """Images from a local directory: STORAGE_PROVIDER=local uploads, or a stand-in for testing
+
+    A reference is looked up by its URL path below the directory, then by
+    its file name, so full storage URLs resolve against a flat copy.
+    """
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+
+    def locate(self, reference: str) -> Optional[str]:
+        path = urllib.parse.unquote(urllib.parse.urlparse(reference).path).lstrip('/\\')
+        for candidate in (path, os.path.basename(path)):
+            if not candidate:
+                continue
+            full_path = os.path.abspath(os.path.join(self.root, candidate))
+            if full_path.startswith(self.root + os.sep) and os.path.isfile(full_path):
+                return full_path
+        return None
+
+    def fetch(self, location: str) -> bytes:
+        with open(location, 'rb') as f:
+            return f.read(MAX_IMAGE_BYTES + 1)
+
+
+def _origin(url: str):
+    """(scheme, host, port) of a URL, with the scheme's default port filled in"""
+    parts = urllib.parse.urlsplit(url)
+    scheme = parts.scheme.lower()
+    try:
+        port = parts.port
+    except ValueError:
+        return None
+    if port is None:
+        port = {'http': 80, 'https': 443}.get(scheme)
+    return scheme, (parts.hostname or '').lower(), port
+
+
+class _OriginRedirectHandler(urllib.request.HTTPRedirectHandler):
+    """Follows a redirect only when it stays on the storage's origins"""
+
+    def __init__(self, storage: 'HttpMediaStorage'):
+        super().__init__()
+        self.storage = storage
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        if not self.storage.allows(newurl):
+            raise urllib.error.HTTPError(newurl, code, f"Redirect outside the media storage: {newurl}",
+                                         headers, fp)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+class HttpMediaStorage:
+    """Images over HTTP(S): Digital Ocean Spaces, S3 or a compatible mock endpoint
+
+    Marker filenames and relative paths are resolved against base_url and
+    must stay below it. Absolute URLs are only fetched when their scheme,
+    host and port are those of base_url (or one of extra_origins), and so
+    are redirects, so exam content cannot make the exporter request
+    internal addresses.
+    """
+
+    def __init__(self, base_url: str, timeout: float = FETCH_TIMEOUT, extra_origins: Sequence[str] = ()):
+        if '://' not in base_url:
+            base_url = f"https://{base_url}"
+        self.base_url = base_url if base_url.endswith('/') else base_url + '/'
+        self.timeout = timeout
+        self._base_path = urllib.parse.urlsplit(self.base_url).path
+        self._origins = {_origin(url if '://' in url else f"https://{url}")
+                         for url in (self.base_url, *extra_origins)}
+        self._opener = urllib.request.build_opener(_OriginRedirectHandler(self))
+
+    def allows(self, url: str) -> bool:
+        origin = _origin(url)
+        return origin is not None and origin[0] in ('http', 'https') and origin in self._origins
+
+    def locate(self, reference: str) -> Optional[str]:
+        parts = urllib.parse.urlsplit(reference)
+        if parts.scheme or parts.netloc:
+            # data:, file: and URLs on other hosts are not fetched
+            return reference if self.allows(reference) else None
+        # Escapes are decoded first so "%2e%2e/" is resolved like "../"
+        path = urllib.parse.unquote(reference).lstrip('/')
+        location = urllib.parse.urljoin(self.base_url, urllib.parse.quote(path, safe='/'))
+        # "../" segments must not climb out of the base path
+        if not urllib.parse.urlsplit(location).path.startswith(self._base_path) or not self.allows(location):
+            return None
+        return location
+
+    def fetch(self, location: str) -> bytes:
+        if not self.allows(location):
+            raise ValueError(f"URL outside the media storage: {location}")
+        with self._opener.open(location, timeout=self.timeout) as response:
+            return response.read(MAX_IMAGE_BYTES + 1)
+
+
+def media_storage_from_env(media_dir: Optional[str] = None):
+    """Storage configured like the Nest backend (STORAGE_PROVIDER and its variables)
+
+    media_dir, or EXPORT_MEDIA_DIR, replaces the configured storage with a
+    local directory.
+    """
+    media_dir = media_dir or os.environ.get('EXPORT_MEDIA_DIR')
+    if media_dir:
+        return LocalMediaStorage(media_dir)
+
+    provider = os.environ.get('STORAGE_PROVIDER', 'do-spaces')
+    if provider == 'local':
+        return LocalMediaStorage(os.environ.get('UPLOAD_PATH', './uploads'))
+    if provider == 'aws-s3' and os.environ.get('AWS_S3_PUBLIC_URL'):
+        return HttpMediaStorage(urllib.parse.urljoin(os.environ['AWS_S3_PUBLIC_URL'] + '/', 'images/'))
+    # Content may link the CDN or the origin endpoint of the same Space
+    public_urls = [url for url in (os.environ.get('DO_SPACES_CDN_URL'), os.environ.get('DO_SPACES_PUBLIC_URL'))
+                   if url]
+    if public_urls:
+        public_url = public_urls[0]
+        if '://' not in public_url:
+            public_url = f"https://{public_url}"
+        return HttpMediaStorage(urllib.parse.urljoin(public_url.rstrip('/') + '/', 'images/'),
+                                extra_origins=public_urls[1:])
+    return HttpMediaStorage(DEFAULT_IMAGE_BASE_URL)
+
+
+class ImageCache:
+    """Fetched and prepared images keyed by URL and content hash"""
+
+    def __init__(self, cache_dir: str, storage, max_bytes: int = DEFAULT_MAX_BYTES,
+                 max_width: int = DEFAULT_MAX_WIDTH, workers: int = DEFAULT_FETCH_WORKERS):
+        self.cache_dir = cache_dir
+        self.storage = storage
+        self.max_bytes = max_bytes
+        self.max_width = max_width
+        self.workers = workers
+        self._urls_dir = os.path.join(cache_dir, 'urls')
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, threading.Event] = {}
+        self._failed: 'OrderedDict[str, float]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.fetches = 0
+        self.failures = 0
+        os.makedirs(self._urls_dir, exist_ok=True)
+        # Prepared images are <content hash>.<extension>; the URL index lives in urls/
+        self._files = DiskLRU(cache_dir, max_bytes)
+        # Prepared image name by content hash, for images fetched under another URL
+        self._by_hash: Dict[str, str] = {name.split('.', 1)[0]: name for name in self._files.keys()}
+
+    def get_many(self, references: Iterable[str]) -> Dict[str, Optional[str]]:
+        """Prepared image paths for references, fetching the missing ones concurrently"""
+        unique = list(dict.fromkeys(references))
+        if len(unique) <= 1 or self.workers <= 1:
+            return {reference: self.get(reference) for reference in unique}
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(unique)),
+                                thread_name_prefix='media') as executor:
+            return dict(zip(unique, executor.map(self.get, unique)))
+
+    def get(self, reference: str) -> Optional[str]:
+        """Prepared image path for a reference, or None if it cannot be embedded"""
+        location = self.storage.locate(reference)
+        if location is None:
+            return None
+        url_key = hashlib.sha256(location.encode('utf-8')).hexdigest()
+
+        while True:
+            with self._lock:
+                path = self._cached_path(url_key)
+                if path is not None:
+                    self.hits += 1
+                    return path
+                self._forget_failures()
+                if url_key in self._failed:
+                    return None
+                # Another thread fetching the same URL is waited for
+                waiting = self._inflight.get(url_key)
+                if waiting is None:
+                    self._inflight[url_key] = threading.Event()
+                    self.misses += 1
+                    break
+            waiting.wait()
+
+        path = None
+        try:
+            path = self._fetch(location, url_key)
+        finally:
+            with self._lock:
+                if path is None:
+                    self._failed[url_key] = time.monotonic()
+                    if len(self._failed) > MAX_FAILED:
+                        self._failed.popitem(last=False)
+                self._inflight.pop(url_key).set()
+        return path
+
+    def stats(self) -> Dict[str, int]:
+        files = self._files.stats()
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'fetches': self.fetches,
+                'failures': self.failures,
+                'entries': files['entries'],
+                'bytes': files['bytes'],
+            }
+
+    def _forget_failures(self):
+        """Drop failures old enough to retry; called with the lock held"""
+        expired_before = time.monotonic() - FAILED_RETRY_SECONDS
+        while self._failed and next(iter(self._failed.values())) < expired_before:
+            self._failed.popitem(last=False)
+
+    def _cached_path(self, url_key: str) -> Optional[str]:
+        """Path of a URL's prepared image; called with the lock held"""
+        try:
+            with open(os.path.join(self._urls_dir, url_key), encoding='ascii') as f:
+                name = f.read().strip()
+        except FileNotFoundError:
+            return None
+        path = self._files.touch(name)
+        if path is None:
+            # URL entries of evicted images are left behind and read as misses
+            self._by_hash.pop(name.split('.', 1)[0], None)
+        return path
+
+    def _fetch(self, location: str, url_key: str) -> Optional[str]:
+        try:
+            data = self.storage.fetch(location)
+        except Exception as e:
+            logger.warning(f"Could not fetch image {location}: {e}")
+            with self._lock:
+                self.failures += 1
+            return None
+        with self._lock:
+            self.fetches += 1
+        if len(data) > MAX_IMAGE_BYTES:
+            logger.warning(f"Image too large to embed: {location}")
+            return None
+
+        content_hash = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            name = self._by_hash.get(content_hash)
+            if name is not None and self._files.touch(name) is None:
+                del self._by_hash[content_hash]
+                name = None
+
+        if name is None:
+            prepared = self.prepare(data)
+            if prepared is None:
+                logger.warning(f"Unsupported image format: {location}")
+                return None
+            image_data, extension = prepared
+            name = f"{content_hash}.{extension}"
+            evicted = self._files.put(name, image_data)
+            with self._lock:
+                self._by_hash[content_hash] = name
+                for old_name in evicted:
+                    self._by_hash.pop(old_name.split('.', 1)[0], None)
+
+        atomic_write(os.path.join(self._urls_dir, url_key), name.encode('ascii'))
+        return self._files.path_for(name)
+
+    def prepare(self, data: bytes):
+        """(image bytes, extension) Word can embed, scaled to max_width; None if it cannot"""
+        extension = image_format(data)
+        if Image is None:
+            # Without Pillow, images are embedded as fetched when Word reads them
+            return (data, extension) if extension else None
+
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                if extension and image.width <= self.max_width:
+                    return data, extension
+                if image.width > self.max_width:
+                    height = max(1, round(image.height * self.max_width / image.width))
+                    image = image.resize((self.max_width, height), Image.LANCZOS)
+                output = io.BytesIO()
+                if extension == 'jpg':
+                    image.convert('RGB').save(output, format='JPEG', quality=90)
+                else:
+                    # WebP and other formats Word cannot embed become PNG
+                    if image.mode not in ('RGB', 'RGBA', 'L', 'LA', 'P'):
+                        image = image.convert('RGBA')
+                    image.save(output, format='PNG', optimize=True)
+                    extension = 'png'
+                return output.getvalue(), extension
+        except Exception as e:
+            logger.warning(f"Could not read image: {e}")
+            return None
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Exam snapshots: exam data handed over by the caller instead of queried
+Author: Linh Dang Dev
+
+The Nest backend loads exams through TypeORM before exporting them, so it
+can pass the exam along as a snapshot and the exporter does not need a
+database connection (or an ODBC driver) at all. A snapshot is a JSON or
+MessagePack document shaped like the entities:
+
+    {"exam": {"MaDeThi": "...", "TenDeThi": "...", "NgayTao": "...",
+              "MonHoc": {"TenMonHoc": "..."}},
+     "questions": [{"MaCauHoi": "...", "NoiDung": "...", "ThuTu": 1,
+                    "MaCauHoiCha": null, "HoanVi": true,
+                    "CauTraLoi": [{"MaCauTraLoi": "...", "NoiDung": "...",
+                                   "LaDapAn": true, "ThuTu": 1, "HoanVi": true}]}]}
+
+"TenMonHoc" may also be given on the exam itself, "answers" instead of
+"CauTraLoi", and "order" (as getExamForWordExport returns it) instead of
+ThuTu. The result is the exam data get_exam_data returns.
+"""
+
+import hashlib
+import json
+from typing import Any, Dict
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+SNAPSHOT_FORMATS = ('auto', 'json', 'msgpack')
+
+
+def _order(item: Dict[str, Any]):
+    value = item.get('ThuTu', item.get('order'))
+    # Items without an order keep their place after the ordered ones
+    return (value is None, value if value is not None else 0)
+
+
+def parse_snapshot(data: bytes, snapshot_format: str = 'auto') -> Dict[str, Any]:
+    """Decode a JSON or MessagePack snapshot; auto-detects JSON by its first byte"""
+    if snapshot_format == 'auto':
+        snapshot_format = 'json' if data.lstrip()[:1] in (b'{', b'\xef') else 'msgpack'
+
+    if snapshot_format == 'json':
+        return json.loads(data.decode('utf-8-sig'))
+    if msgpack is None:
+        raise ValueError("MessagePack snapshot given but msgpack is not installed (pip install msgpack)")
+    return msgpack.unpackb(data, raw=False, timestamp=3)
+
+
+def exam_data_from_snapshot(snapshot: Dict[str, Any], exam_id=None) -> Dict[str, Any]:
+    """Exam data as get_exam_data returns it, from a decoded snapshot"""
+    if not isinstance(snapshot, dict) or not isinstance(snapshot.get('exam'), dict):
+        raise ValueError("Snapshot must be an object with an 'exam' object")
+    exam = snapshot['exam']
+    questions = snapshot.get('questions')
+    if not isinstance(questions, list):
+        raise ValueError("Snapshot must have a 'questions' list")
+
+    subject = exam.get('MonHoc') or {}
+    exam_info = {
+        'MaDeThi': exam.get('MaDeThi') or exam_id,
+        'TenDeThi': exam.get('TenDeThi'),
+        'NgayTao': exam.get('NgayTao'),
+        'DaDuyet': exam.get('DaDuyet', True),
+        'TenMonHoc': exam.get('TenMonHoc') or subject.get('TenMonHoc') or 'Không có thông tin'
+    }
+
+    exam_questions = []
+    for index, question in enumerate(sorted(questions, key=_order), 1):
+        if not isinstance(question, dict) or not question.get('MaCauHoi'):
+            raise ValueError(f"Snapshot question {index} has no MaCauHoi")
+        answers = question.get('CauTraLoi', question.get('answers')) or []
+        exam_questions.append({
+            'MaCauHoi': question['MaCauHoi'],
+            'NoiDung': question.get('NoiDung'),
+            'MaCLO': question.get('MaCLO'),
+            'CapDo': question.get('CapDo'),
+            'ThuTu': question.get('ThuTu', question.get('order')),
+            'MaCauHoiCha': question.get('MaCauHoiCha'),
+            'HoanVi': question.get('HoanVi'),
+            'answers': [{
+                'MaCauTraLoi': answer.get('MaCauTraLoi'),
+                'NoiDung': answer.get('NoiDung'),
+                'LaDapAn': bool(answer.get('LaDapAn')),
+                'ThuTu': answer.get('ThuTu'),
+                'HoanVi': answer.get('HoanVi')
+            } for answer in sorted(answers, key=_order)]
+        })
+
+    return {
+        'exam': exam_info,
+        'questions': exam_questions,
+        'total_questions': len(exam_questions)
+    }
+
+
+def snapshot_marker(exam_data: Dict[str, Any]) -> str:
+    """Change marker of snapshot exam data for the export cache"""
+    payload = json.dumps(exam_data, sort_keys=True, ensure_ascii=False, default=str)
+    return 'snapshot:' + hashlib.sha256(payload.encode('utf-8')).hexdigest()
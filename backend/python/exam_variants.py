@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Shuffled variants (mã đề) of an exam
+Author: Linh Dang Dev
+
+A variant is a seeded permutation of the exam's question order and of the
+answer order of each question, computed from exam data fetched once. The
+questions of a group (children sharing MaCauHoiCha, and the parent
+question when it is part of the exam) move as one block and keep their
+order inside it, wherever they sit in the exam. Questions and answers
+with HoanVi = 0 keep their position.
+
+The same seed and variant code always give the same variant, so a set of
+variants can be generated again later and match the printed papers.
+"""
+
+import csv
+import json
+import random
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence
+
+FIRST_VARIANT_CODE = 101
+
+
+@dataclass
+class Variant:
+    """One shuffled version of an exam
+
+    question_order[p] is the canonical index of the question printed at
+    position p, and answer_orders[p][k] the canonical index of its k-th
+    printed answer.
+    """
+    code: str
+    question_order: List[int]
+    answer_orders: List[List[int]]
+
+
+def answer_label(index: int) -> str:
+    return chr(65 + index)  # A, B, C, D
+
+
+def variant_codes(count: int, first: int = FIRST_VARIANT_CODE) -> List[str]:
+    return [str(first + i) for i in range(count)]
+
+
+def resolve_variant_codes(count: Optional[int], codes: Optional[Sequence[Any]] = None) -> List[str]:
+    """Codes of the variants to export: the given codes, or count codes from 101
+
+    When both are given they must agree; a count that differs from the
+    number of codes raises ValueError instead of one silently winning, and
+    so does a repeated code, whose papers would overwrite each other.
+    """
+    if not codes:
+        if not count or count < 1:
+            raise ValueError("At least one variant is required")
+        return variant_codes(count)
+
+    codes = [str(code) for code in codes]
+    if count is not None and count != len(codes):
+        raise ValueError(f"variantCodes lists {len(codes)} codes but {count} variants were requested")
+    if len(set(codes)) != len(codes):
+        raise ValueError("variantCodes must not repeat a code")
+    return codes
+
+
+def is_shuffled(item: Dict[str, Any]) -> bool:
+    """HoanVi defaults to shuffling when the column is missing or NULL"""
+    value = item.get('HoanVi')
+    return value is None or bool(value)
+
+
+def _group_key(question: Dict[str, Any]):
+    # A question without a parent heads the group of its own children
+    group = question.get('MaCauHoiCha')
+    if group is None:
+        group = question.get('MaCauHoi')
+    return str(group).lower() if group is not None else None
+
+
+def question_blocks(questions: Sequence[Dict[str, Any]]) -> List[List[int]]:
+    """Split the canonical order into blocks that move together
+
+    Questions are grouped by MaCauHoiCha over the whole exam, not only in
+    contiguous runs, so a group split by other questions still moves as
+    one block. A block takes the position of its first member and keeps
+    its members in canonical order.
+    """
+    blocks: List[List[int]] = []
+    block_of: Dict[Any, List[int]] = {}
+    for index, question in enumerate(questions):
+        key = _group_key(question)
+        block = block_of.get(key) if key is not None else None
+        if block is None:
+            block = []
+            blocks.append(block)
+            if key is not None:
+                block_of[key] = block
+        block.append(index)
+    return blocks
+
+
+def permutation(count: int, fixed: Sequence[int], rng: random.Random) -> List[int]:
+    """Random order of range(count) that keeps the fixed positions in place"""
+    fixed = set(fixed)
+    movable = [i for i in range(count) if i not in fixed]
+    shuffled = list(movable)
+    rng.shuffle(shuffled)
+    order = list(range(count))
+    for slot, index in zip(movable, shuffled):
+        order[slot] = index
+    return order
+
+
+def make_variant(questions: Sequence[Dict[str, Any]], code: str, seed: Any,
+                 blocks: Optional[List[List[int]]] = None) -> Variant:
+    rng = random.Random(f"{seed}:{code}")
+    if blocks is None:
+        blocks = question_blocks(questions)
+
+    # A block stays in place when its leading question must not be shuffled
+    fixed_blocks = [i for i, block in enumerate(blocks) if not is_shuffled(questions[block[0]])]
+    question_order = [index
+                      for block_index in permutation(len(blocks), fixed_blocks, rng)
+                      for index in blocks[block_index]]
+
+    answer_orders = []
+    for index in question_order:
+        answers = questions[index]['answers']
+        fixed_answers = [j for j, answer in enumerate(answers) if not is_shuffled(answer)]
+        answer_orders.append(permutation(len(answers), fixed_answers, rng))
+
+    return Variant(code=code, question_order=question_order, answer_orders=answer_orders)
+
+
+def make_variants(questions: Sequence[Dict[str, Any]], codes: Sequence[str], seed: Any) -> List[Variant]:
+    blocks = question_blocks(questions)
+    return [make_variant(questions, code, seed, blocks) for code in codes]
+
+
+def apply_variant(questions: Sequence[Dict[str, Any]], variant: Variant) -> List[Dict[str, Any]]:
+    """Questions in the variant's order with their answers reordered"""
+    shuffled = []
+    for index, answer_order in zip(variant.question_order, variant.answer_orders):
+        question = questions[index]
+        answers = question['answers']
+        shuffled.append(dict(question, answers=[answers[j] for j in answer_order]))
+    return shuffled
+
+
+def correct_labels(answers: Sequence[Dict[str, Any]]) -> List[str]:
+    return [answer_label(j) for j, answer in enumerate(answers) if answer['LaDapAn']]
+
+
+def answer_key_matrix(questions: Sequence[Dict[str, Any]], variants: Sequence[Variant]) -> Dict[str, Any]:
+    """Correct answers of every variant, mapped back to the canonical exam
+
+    For each variant question: its printed number and correct labels, the
+    canonical question number, and labels mapping each printed answer
+    label to the canonical one.
+    """
+    return {
+        'codes': [variant.code for variant in variants],
+        'questions': [
+            {'number': i + 1, 'MaCauHoi': str(question.get('MaCauHoi')),
+             'correct': correct_labels(question['answers'])}
+            for i, question in enumerate(questions)
+        ],
+        'variants': [
+            {
+                'code': variant.code,
+                'questions': [
+                    {
+                        'number': position + 1,
+                        'canonical': index + 1,
+                        'correct': [answer_label(k) for k, j in enumerate(answer_order)
+                                    if questions[index]['answers'][j]['LaDapAn']],
+                        'labels': {answer_label(k): answer_label(j) for k, j in enumerate(answer_order)}
+                    }
+                    for position, (index, answer_order)
+                    in enumerate(zip(variant.question_order, variant.answer_orders))
+                ]
+            }
+            for variant in variants
+        ]
+    }
+
+
+def write_answer_key(matrix: Dict[str, Any], csv_path: str, json_path: Optional[str] = None):
+    """Write the grading grid (question number x variant code) and the full matrix"""
+    codes = matrix['codes']
+    rows = len(matrix['questions'])
+    with open(csv_path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Câu'] + [f"Mã đề {code}" for code in codes])
+        for position in range(rows):
+            writer.writerow([position + 1] + [
+                ','.join(variant['questions'][position]['correct'])
+                for variant in matrix['variants']
+            ])
+
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(matrix, f, ensure_ascii=False, indent=2)
@@ -7,52 +7,515 @@ This script exports exam questions to Word document with custom formatting
 """
 
 import sys
+import io
+import re
+import copy
 import json
-import pyodbc
+import queue
+import zipfile
+import threading
+import time
+import argparse
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from docx import Document
-from docx.shared import Inches, Pt
+from docx.shared import Emu, Inches, Pt
 from docx.enum.text import WD_ALIGN_PARAGRAPH
 from docx.enum.style import WD_STYLE_TYPE
+from docx.oxml import parse_xml
+from docx.oxml.shape import CT_Inline
 from docx.oxml.shared import OxmlElement, qn
+from docx.text.paragraph import Paragraph
+from docx.text.run import Run
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
+from export_cache import ExportCache, export_key
+from fragment_cache import (DEFAULT_MAX_BYTES as DEFAULT_FRAGMENT_CACHE_BYTES,
+                            DEFAULT_MEMORY_BYTES as DEFAULT_FRAGMENT_MEMORY_BYTES, FragmentCache,
+                            content_version, fragment_key)
+from exam_snapshot import SNAPSHOT_FORMATS, exam_data_from_snapshot, parse_snapshot, snapshot_marker
+from exam_variants import (answer_key_matrix, apply_variant, make_variants, resolve_variant_codes,
+                           write_answer_key)
+from exam_media import (DEFAULT_MAX_BYTES as DEFAULT_MEDIA_CACHE_BYTES, IMAGE_REFERENCE, ImageCache,
+                        find_image_references, media_storage_from_env, reference_of)
+from lxml import etree
+from xml.sax.saxutils import escape
 import logging
 
-# Configure logging
+try:
+    import pyodbc
+except ImportError:  # only snapshot exports work without it
+    pyodbc = None
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Configure logging; the log goes to stderr, so LOG_FD carries no other output
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s')
+LOG_FD = 2
 logger = logging.getLogger(__name__)
 
+# Database configuration - using Windows Authentication for local
+DEFAULT_DB_CONFIG = {
+    'server': 'localhost',
+    'port': 1433,
+    'database': 'question_bank',
+    'username': '',  # Empty for Windows Auth
+    'password': '',  # Empty for Windows Auth
+    'driver': 'ODBC Driver 17 for SQL Server',
+    'trusted_connection': 'yes'
+}
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(
+    __file__), '..', '..', 'template', 'TemplateHutechOffical.dotx')
+
+# python-docx only opens documents, so the .dotx main part is relabelled
+TEMPLATE_MAIN_CONTENT_TYPE = b'application/vnd.openxmlformats-officedocument.wordprocessingml.template.main+xml'
+DOCUMENT_MAIN_CONTENT_TYPE = b'application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml'
+
+# Header slots of the template: (slot, paragraph label, paragraph text up to
+# and including the anchor run, mode). 'after' writes the value in a new run
+# after the anchor, 'replace' overwrites the anchor run's text.
+TEMPLATE_TEXT_SLOTS = (
+    ('semester', 'ĐỀ THI HỌC KỲ', 'ĐỀ THI HỌC KỲ …', 'replace'),
+    ('academic_year', 'ĐỀ THI HỌC KỲ', 'ĐỀ THI HỌC KỲ … NĂM HỌC ', 'after'),
+    ('course', 'Khóa/Lớp', 'Khóa/Lớp\t: ', 'after'),
+    ('subject', 'Môn thi', 'Môn thi\t: ', 'after'),
+    ('exam_date', 'Ngày thi', 'Ngày thi\t: ', 'after'),
+    ('duration', 'Thời gian làm bài', 'Thời gian làm bài\t: ', 'after'),
+    ('exam_code', 'Mã đề', 'Mã đề (Nếu có)\t: ', 'after'),
+)
+# Header defaults when the export options leave a slot out; see template_values
+DEFAULT_EXAM_DURATION = '90 phút'
+# Month in which a new academic year starts
+ACADEMIC_YEAR_START_MONTH = 8
+
+# Paragraph whose Wingdings boxes are ticked: first box "CÓ", second "KHÔNG"
+TEMPLATE_MATERIALS_LABEL = 'SỬ DỤNG TÀI LIỆU'
+WINGDINGS_CHECKED_BOX = 'F0FE'
+
+# Pre-serialized WordprocessingML for the exam body, matching what the
+# equivalent python-docx calls produce. {content} is run content from
+# run_content_xml; left="432" is Inches(0.3) in twips and sz 28 is Pt(14).
+W_NAMESPACE = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+BODY_FRAGMENTS = {
+    'question': '<w:p><w:r><w:rPr><w:b/></w:rPr><w:t xml:space="preserve">Câu {number}: </w:t></w:r>'
+                '<w:r>{content}</w:r></w:p>',
+    'answer': '<w:p><w:pPr><w:ind w:left="432"/></w:pPr><w:r>{content}</w:r></w:p>',
+    'correct_answer': '<w:p><w:pPr><w:ind w:left="432"/></w:pPr><w:r><w:rPr><w:b/></w:rPr>{content}</w:r>'
+                      '<w:r><w:rPr><w:b/></w:rPr><w:t xml:space="preserve"> ✓</w:t></w:r></w:p>',
+    'text': '<w:p><w:r>{content}</w:r></w:p>',
+    'title': '<w:p><w:pPr><w:jc w:val="center"/></w:pPr><w:r><w:rPr><w:b/><w:sz w:val="28"/></w:rPr>'
+             '{content}</w:r></w:p>',
+    'empty': '<w:p/>',
+    'page_break': '<w:p><w:r><w:br w:type="page"/></w:r></w:p>',
+}
+
+# Characters XML 1.0 does not allow in text
+INVALID_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+RUN_BREAKS = re.compile(r'(\t|\r\n|\r|\n)')
+
+# Export server defaults (see serve_main)
+DEFAULT_SERVER_WORKERS = 4
+DEFAULT_JOB_TIMEOUT = 60
+DEFAULT_CACHE_MB = 500
+
+DEFAULT_VARIANT_WORKERS = min(4, os.cpu_count() or 1)
+
+# Exam IDs per set-based query; SQL Server allows 2100 parameters
+BATCH_QUERY_CHUNK = 500
+
+# Widest embedded image: the printable width of the template page
+MAX_IMAGE_WIDTH = Inches(6)
+
+
+def default_academic_year(today=None):
+    """Academic year a date falls in, e.g. '2025-2026' from August 2025 to July 2026"""
+    today = today or datetime.now()
+    start = today.year if today.month >= ACADEMIC_YEAR_START_MONTH else today.year - 1
+    return f"{start}-{start + 1}"
+
+
+def with_dated_defaults(export_options):
+    """Export options with the header values that default to today filled in.
+
+    Resolved once per export, so the export cache key and the document see
+    the same exam date and academic year.
+    """
+    return dict(export_options,
+                academicYear=export_options.get('academicYear') or default_academic_year(),
+                examDate=export_options.get('examDate') or datetime.now().strftime('%d/%m/%Y'))
+
+
+def build_connection_string(db_config):
+    """ODBC connection string for a database configuration"""
+    if db_config.get('trusted_connection') == 'yes':
+        # Windows Authentication
+        return (
+            f"DRIVER={{ODBC Driver 17 for SQL Server}};"
+            f"SERVER={db_config['server']};"
+            f"DATABASE={db_config['database']};"
+            f"Trusted_Connection=yes;"
+            "TrustServerCertificate=yes;"
+        )
+    # SQL Server Authentication
+    return (
+        f"DRIVER={{ODBC Driver 17 for SQL Server}};"
+        f"SERVER={db_config['server']},{db_config['port']};"
+        f"DATABASE={db_config['database']};"
+        f"UID={db_config['username']};"
+        f"PWD={db_config['password']};"
+        "TrustServerCertificate=yes;"
+    )
+
+
+def open_connection(db_config):
+    if pyodbc is None:
+        raise RuntimeError("pyodbc is not installed; pass the exam as a snapshot instead")
+    return pyodbc.connect(build_connection_string(db_config))
+
+
+def run_content_xml(text):
+    """Run content for text, with tabs and line breaks as python-docx writes them"""
+    parts = []
+    for piece in RUN_BREAKS.split(INVALID_XML_CHARS.sub('', text)):
+        if piece == '\t':
+            parts.append('<w:tab/>')
+        elif piece in ('\r\n', '\r', '\n'):
+            # python-docx writes one break per character
+            parts.append('<w:br/>' * len(piece))
+        elif piece:
+            space = ' xml:space="preserve"' if piece.strip() != piece else ''
+            parts.append(f'<w:t{space}>{escape(piece)}</w:t>')
+    return ''.join(parts)
+
+
+def question_fragments(question, show_answers):
+    """FragmentCache entry of a question: its paragraphs split where the number and labels go"""
+    # The number has a run of its own, and NUL never survives run_content_xml
+    head, tail = BODY_FRAGMENTS['question'].format(
+        number='\x00', content=run_content_xml(question['NoiDung'] or '')).split('\x00')
+
+    answers = {}
+    for answer in question['answers']:
+        fragment = 'correct_answer' if show_answers and answer['LaDapAn'] else 'answer'
+        prefix, suffix = BODY_FRAGMENTS[fragment].split('{content}')
+        # The label starts the first text element of the run, whatever follows it
+        content = run_content_xml(f"A. {answer['NoiDung'] or ''}")
+        label_at = content.index('>') + 1
+        answers[str(answer['MaCauTraLoi'])] = [prefix + content[:label_at], content[label_at + 1:] + suffix]
+
+    return {'question': [head, tail], 'answers': answers}
+
+
+def has_inline_images(question, images):
+    """Whether any text of the question embeds a picture, which ties its XML to one document"""
+    if not images:
+        return False
+    texts = [question['NoiDung']] + [answer['NoiDung'] for answer in question['answers']]
+    return any(images.get(reference) for text in texts for reference in find_image_references(text))
+
+
+class InlineImages:
+    """Inline pictures for the image references in one document's content
+
+    paths maps references (see exam_media) to local image files; a
+    reference without a file is left in the text as it is.
+    """
+
+    def __init__(self, doc, paths):
+        self.part = doc.part
+        self.paths = paths
+        self._next_id = None
+
+    def content_xml(self, text):
+        parts = []
+        position = 0
+        for match in IMAGE_REFERENCE.finditer(text):
+            path = self.paths.get(reference_of(match))
+            if not path:
+                continue
+            parts.append(run_content_xml(text[position:match.start()]))
+            parts.append(self.drawing_xml(path))
+            position = match.end()
+        parts.append(run_content_xml(text[position:]))
+        return ''.join(parts)
+
+    def drawing_xml(self, path):
+        # The package stores an image used several times only once
+        rId, image = self.part.get_or_add_image(path)
+        cx, cy = image.width, image.height
+        if cx > MAX_IMAGE_WIDTH:
+            cx, cy = MAX_IMAGE_WIDTH, int(cy * MAX_IMAGE_WIDTH / cx)
+
+        # Drawing ids must be unique in the document; the body is not
+        # appended yet, so they are counted here instead of read from it
+        if self._next_id is None:
+            self._next_id = self.part.next_id
+        shape_id = self._next_id
+        self._next_id += 1
+
+        inline = CT_Inline.new_pic_inline(shape_id, rId, image.filename, Emu(cx), Emu(cy))
+        return f'<w:drawing>{etree.tostring(inline, encoding="unicode")}</w:drawing>'
+
+
+class BodyFragmentBuilder:
+    """Collects exam body paragraphs as XML text and appends them in one go
+
+    Paragraphs are rendered from BODY_FRAGMENTS instead of being built one
+    python-docx proxy call at a time; append_to() parses the whole batch
+    once and moves the paragraphs in front of the body's sectPr. With
+    InlineImages, image references in the text become pictures.
+    """
+
+    def __init__(self, images=None):
+        self._parts = []
+        self._images = images
+
+    def add(self, fragment, text=None, **fields):
+        if text is not None:
+            fields['content'] = self._images.content_xml(text) if self._images else run_content_xml(text)
+        self._parts.append(BODY_FRAGMENTS[fragment].format(**fields))
+
+    def add_xml(self, xml):
+        """Add paragraphs already rendered, e.g. from a FragmentCache"""
+        self._parts.append(xml)
+
+    def append_to(self, doc):
+        if not self._parts:
+            return
+        batch = parse_xml(f'<w:body xmlns:w="{W_NAMESPACE}">{"".join(self._parts)}</w:body>')
+        body = doc.element.body
+        sect_pr = body.find(qn('w:sectPr'))
+        for paragraph in list(batch):
+            if sect_pr is not None:
+                sect_pr.addprevious(paragraph)
+            else:
+                body.append(paragraph)
+        self._parts = []
+
+
+class ExamTemplate:
+    """Parsed exam template, loaded once and cloned for every export
+
+    The prototype document is never modified; new_document() deep-copies it,
+    which is cheaper than reading and parsing the package again and needs no
+    temporary file. The header slots are located once at load time and kept
+    as child-index paths from the document body, so filling them in a clone
+    is a direct lookup.
+    """
+
+    _cache = {}
+    _cache_lock = threading.Lock()
+
+    def __init__(self, template_path):
+        self.template_path = template_path
+        self._prototype = Document(io.BytesIO(self._read_as_document(template_path)))
+        self._clone_lock = threading.Lock()
+        self.slots = {}
+        self.materials_slot = None
+        self._compile_slots()
+
+    @classmethod
+    def get(cls, template_path=TEMPLATE_PATH):
+        """Return the template for a path, loading it on first use"""
+        key = os.path.abspath(template_path)
+        with cls._cache_lock:
+            template = cls._cache.get(key)
+            if template is None:
+                template = cls(template_path)
+                cls._cache[key] = template
+                logger.info(f"Loaded exam template: {template_path}")
+            return template
+
+    @staticmethod
+    def _read_as_document(template_path):
+        """Template package bytes with the main part declared as a document"""
+        output = io.BytesIO()
+        with zipfile.ZipFile(template_path) as source, \
+                zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as target:
+            for info in source.infolist():
+                data = source.read(info)
+                if info.filename == '[Content_Types].xml':
+                    data = data.replace(TEMPLATE_MAIN_CONTENT_TYPE, DOCUMENT_MAIN_CONTENT_TYPE)
+                target.writestr(info, data)
+        return output.getvalue()
+
+    def _compile_slots(self):
+        body = self._prototype.element.body
+        for p in body.iter(qn('w:p')):
+            paragraph = Paragraph(p, None)
+            text = paragraph.text
+            for name, label, through_anchor, mode in TEMPLATE_TEXT_SLOTS:
+                if name in self.slots or not text.startswith(label):
+                    continue
+                anchor = self._anchor_run(paragraph, through_anchor)
+                if anchor is not None:
+                    self.slots[name] = (self._path(body, p), anchor, mode)
+            if self.materials_slot is None and text.startswith(TEMPLATE_MATERIALS_LABEL):
+                boxes = [i for i, r in enumerate(p.r_lst) if r.find(qn('w:sym')) is not None]
+                if len(boxes) == 2:
+                    self.materials_slot = (self._path(body, p), boxes)
+
+        missing = [name for name, *_ in TEMPLATE_TEXT_SLOTS if name not in self.slots]
+        if missing:
+            logger.warning(f"Template slots not found: {', '.join(missing)}")
+
+    @staticmethod
+    def _anchor_run(paragraph, through_anchor):
+        """Index of the run at which the paragraph text reaches through_anchor"""
+        text = ''
+        for i, run in enumerate(paragraph.runs):
+            text += run.text
+            if text == through_anchor:
+                return i
+            if not through_anchor.startswith(text):
+                return None
+        return None
+
+    @staticmethod
+    def _path(body, element):
+        path = []
+        while element is not body:
+            parent = element.getparent()
+            path.append(parent.index(element))
+            element = parent
+        return tuple(reversed(path))
+
+    @staticmethod
+    def _follow(body, path):
+        element = body
+        for index in path:
+            element = element[index]
+        return element
+
+    def new_document(self, values=None, allow_materials=None):
+        """Clone the template and fill its header slots
+
+        Args:
+            values: Slot name -> text; empty values leave the slot as is
+            allow_materials: Tick "CÓ" (True) or "KHÔNG" (False), or neither (None)
+        """
+        with self._clone_lock:
+            doc = copy.deepcopy(self._prototype)
+        body = doc.element.body
+
+        for name, value in (values or {}).items():
+            if not value or name not in self.slots:
+                continue
+            path, anchor, mode = self.slots[name]
+            p = self._follow(body, path)
+            paragraph = Paragraph(p, None)
+            anchor_r = p.r_lst[anchor]
+            if mode == 'replace':
+                Run(anchor_r, paragraph).text = str(value)
+            else:
+                value_r = copy.deepcopy(anchor_r)
+                anchor_r.addnext(value_r)
+                Run(value_r, paragraph).text = str(value)
+
+        if allow_materials is not None and self.materials_slot:
+            path, boxes = self.materials_slot
+            p = self._follow(body, path)
+            box_r = p.r_lst[boxes[0] if allow_materials else boxes[1]]
+            box_r.find(qn('w:sym')).set(qn('w:char'), WINGDINGS_CHECKED_BOX)
+
+        return doc
+
+
+def process_peak_rss_mb():
+    """Peak resident memory of this process in MB, or None where it is not available
+
+    This is the peak over the process lifetime, so in --serve mode it covers
+    every job run so far, not only the current one.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+class ExportTimings:
+    """Wall time per phase of one export, row counts and an optional trace
+
+    Phases are named like "query" or, for steps inside one, "query.answers";
+    only top-level phases appear in timings_ms, every step in the trace.
+    """
+
+    def __init__(self, trace=False):
+        self.started = time.perf_counter()
+        self.started_peak_rss_mb = process_peak_rss_mb()
+        self.phases = {}
+        self.rows = {}
+        self.trace = [] if trace else None
+
+    @contextmanager
+    def phase(self, name, **detail):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.phases[name] = self.phases.get(name, 0.0) + elapsed
+            if self.trace is not None:
+                self.trace.append(dict(detail, phase=name,
+                                       start_ms=round((start - self.started) * 1000, 2),
+                                       ms=round(elapsed * 1000, 2)))
+
+    def count(self, name, value):
+        self.rows[name] = self.rows.get(name, 0) + value
+
+    def summary(self):
+        timings = {name: round(seconds * 1000, 2)
+                   for name, seconds in self.phases.items() if '.' not in name}
+        timings['total'] = round((time.perf_counter() - self.started) * 1000, 2)
+        peak = process_peak_rss_mb()
+        summary = {'timings_ms': timings, 'rows': dict(self.rows), 'process_peak_rss_mb': peak}
+        if peak is not None:
+            # How far this export raised the process peak; 0 when it stayed
+            # below an earlier job's peak. Concurrent jobs share the growth.
+            summary['peak_rss_growth_mb'] = round(peak - self.started_peak_rss_mb, 1)
+        if self.trace is not None:
+            summary['trace'] = self.trace
+        return summary
+
+
+def _hashed_row(*columns):
+    """SQL expression encoding columns as one unambiguous NVARCHAR(MAX) string
+
+    Every value is written as its byte length, ':' and the value itself, so
+    no content can shift into a neighbouring column; NULL has no length.
+    """
+    return 'CONCAT(' + ", ';', ".join(
+        f"DATALENGTH(CAST({column} AS NVARCHAR(MAX))), ':', CAST({column} AS NVARCHAR(MAX))"
+        for column in columns) + ')'
+
 
 class ExamWordExporter:
-    def __init__(self, db_config):
+    def __init__(self, db_config, connection=None, cache=None, media=None, trace=False, fragments=None):
         self.db_config = db_config
-        self.connection = None
+        # A connection passed in (e.g. from a ConnectionPool) is used as is
+        # and left open; otherwise each export opens and closes its own
+        self.connection = connection
+        self.owns_connection = connection is None
+        # Optional ExportCache of rendered documents
+        self.cache = cache
+        # Optional ImageCache; without it image references stay as text
+        self.media = media
+        # Optional FragmentCache of rendered questions shared across exports
+        self.fragments = fragments
+        # Phase timings of the current export; trace adds every step
+        self.trace = trace
+        self.timings = ExportTimings(trace)
 
     def connect_database(self):
         """Connect to SQL Server database"""
         try:
-            if self.db_config.get('trusted_connection') == 'yes':
-                # Windows Authentication
-                connection_string = (
-                    f"DRIVER={{ODBC Driver 17 for SQL Server}};"
-                    f"SERVER={self.db_config['server']};"
-                    f"DATABASE={self.db_config['database']};"
-                    f"Trusted_Connection=yes;"
-                    "TrustServerCertificate=yes;"
-                )
-            else:
-                # SQL Server Authentication
-                connection_string = (
-                    f"DRIVER={{ODBC Driver 17 for SQL Server}};"
-                    f"SERVER={self.db_config['server']},{self.db_config['port']};"
-                    f"DATABASE={self.db_config['database']};"
-                    f"UID={self.db_config['username']};"
-                    f"PWD={self.db_config['password']};"
-                    "TrustServerCertificate=yes;"
-                )
-
-            self.connection = pyodbc.connect(connection_string)
+            self.connection = open_connection(self.db_config)
             logger.info("Successfully connected to database")
             return True
         except Exception as e:
@@ -62,118 +525,259 @@ class ExamWordExporter:
     def get_exam_data(self, exam_id):
         """Get exam and questions data from database"""
         try:
-            cursor = self.connection.cursor()
-
-            # Get exam info
-            exam_query = """
-            SELECT dt.MaDeThi, dt.TenDeThi, dt.NgayTao, dt.DaDuyet,
-                   mh.TenMonHoc
-            FROM DeThi dt
-            LEFT JOIN MonHoc mh ON dt.MaMonHoc = mh.MaMonHoc
-            WHERE dt.MaDeThi = ? AND dt.DaDuyet = 1
-            """
-            cursor.execute(exam_query, exam_id)
-            exam_result = cursor.fetchone()
-
-            if not exam_result:
+            exams = self.get_exams_data([exam_id])
+            if not exams:
                 raise Exception(f"Approved exam not found: {exam_id}")
-
-            exam_info = {
-                'MaDeThi': exam_result[0],
-                'TenDeThi': exam_result[1],
-                'NgayTao': exam_result[2],
-                'DaDuyet': exam_result[3],
-                'TenMonHoc': exam_result[4] or 'Không có thông tin'
-            }
-
-            # Get exam questions
-            questions_query = """
-            SELECT ch.MaCauHoi, ch.NoiDung, ch.MaCLO, ch.CapDo,
-                   ctdt.ThuTu
-            FROM ChiTietDeThi ctdt
-            INNER JOIN CauHoi ch ON ctdt.MaCauHoi = ch.MaCauHoi
-            WHERE ctdt.MaDeThi = ?
-            ORDER BY ctdt.ThuTu
-            """
-            cursor.execute(questions_query, exam_id)
-            questions_results = cursor.fetchall()
-
-            questions = []
-            for q in questions_results:
-                question = {
-                    'MaCauHoi': q[0],
-                    'NoiDung': q[1],
-                    'MaCLO': q[2],
-                    'CapDo': q[3],
-                    'ThuTu': q[4],
-                    'answers': []
-                }
-
-                # Get answers for this question
-                answers_query = """
-                SELECT MaCauTraLoi, NoiDung, LaDapAn, ThuTu
-                FROM CauTraLoi
-                WHERE MaCauHoi = ?
-                ORDER BY ThuTu
-                """
-                cursor.execute(answers_query, q[0])
-                answers_results = cursor.fetchall()
-
-                for a in answers_results:
-                    answer = {
-                        'MaCauTraLoi': a[0],
-                        'NoiDung': a[1],
-                        'LaDapAn': a[2],
-                        'ThuTu': a[3]
-                    }
-                    question['answers'].append(answer)
-
-                questions.append(question)
-
-            return {
-                'exam': exam_info,
-                'questions': questions,
-                'total_questions': len(questions)
-            }
+            return exams[0]
 
         except Exception as e:
             logger.error(f"Error getting exam data: {e}")
             raise
 
+    def get_exams_data(self, exam_ids):
+        """Get exam and questions data of several exams with set-based queries
+
+        Returns the data of the approved exams among exam_ids, in the given
+        order; other IDs are skipped. Each chunk of BATCH_QUERY_CHUNK IDs
+        takes three queries: exams, questions and answers.
+        """
+        # GUIDs compare case-insensitively in SQL Server
+        unique_ids = {}
+        for exam_id in exam_ids:
+            unique_ids.setdefault(str(exam_id).lower(), exam_id)
+
+        ids = list(unique_ids.values())
+        exams = {}
+        for start in range(0, len(ids), BATCH_QUERY_CHUNK):
+            exams.update(self._fetch_exams(ids[start:start + BATCH_QUERY_CHUNK]))
+        return [exams[key] for key in unique_ids if key in exams]
+
+    def _fetch_exams(self, exam_ids):
+        cursor = self.connection.cursor()
+        marks = ', '.join('?' * len(exam_ids))
+
+        # Get exam info
+        exam_query = f"""
+        SELECT dt.MaDeThi, dt.TenDeThi, dt.NgayTao, dt.DaDuyet,
+               mh.TenMonHoc
+        FROM DeThi dt
+        LEFT JOIN MonHoc mh ON dt.MaMonHoc = mh.MaMonHoc
+        WHERE dt.MaDeThi IN ({marks}) AND dt.DaDuyet = 1
+        """
+        with self.timings.phase('query.exams', exams=len(exam_ids)):
+            cursor.execute(exam_query, exam_ids)
+            exam_rows = cursor.fetchall()
+        self.timings.count('exams', len(exam_rows))
+
+        exams = {}
+        for e in exam_rows:
+            exams[str(e[0]).lower()] = {
+                'exam': {
+                    'MaDeThi': e[0],
+                    'TenDeThi': e[1],
+                    'NgayTao': e[2],
+                    'DaDuyet': e[3],
+                    'TenMonHoc': e[4] or 'Không có thông tin'
+                },
+                'questions': [],
+                'total_questions': 0
+            }
+        if not exams:
+            return exams
+
+        # Get exam questions
+        questions_query = f"""
+        SELECT ctdt.MaDeThi, ch.MaCauHoi, ch.NoiDung, ch.MaCLO, ch.CapDo,
+               ctdt.ThuTu, ch.MaCauHoiCha, ch.HoanVi
+        FROM ChiTietDeThi ctdt
+        INNER JOIN CauHoi ch ON ctdt.MaCauHoi = ch.MaCauHoi
+        WHERE ctdt.MaDeThi IN ({marks})
+        ORDER BY ctdt.MaDeThi, ctdt.ThuTu
+        """
+        with self.timings.phase('query.questions'):
+            cursor.execute(questions_query, exam_ids)
+            questions_results = cursor.fetchall()
+        self.timings.count('questions', len(questions_results))
+
+        # Get the answers of all exam questions in one query; a question
+        # listed in several sections or exams still gets its answers only once
+        answers_query = f"""
+        SELECT ctl.MaCauHoi, ctl.MaCauTraLoi, ctl.NoiDung, ctl.LaDapAn, ctl.ThuTu, ctl.HoanVi
+        FROM CauTraLoi ctl
+        WHERE ctl.MaCauHoi IN (
+            SELECT ctdt.MaCauHoi FROM ChiTietDeThi ctdt WHERE ctdt.MaDeThi IN ({marks})
+        )
+        ORDER BY ctl.MaCauHoi, ctl.ThuTu
+        """
+        with self.timings.phase('query.answers'):
+            cursor.execute(answers_query, exam_ids)
+            answer_rows = cursor.fetchall()
+        self.timings.count('answers', len(answer_rows))
+
+        answers_by_question = {}
+        for a in answer_rows:
+            answers_by_question.setdefault(a[0], []).append({
+                'MaCauTraLoi': a[1],
+                'NoiDung': a[2],
+                'LaDapAn': a[3],
+                'ThuTu': a[4],
+                'HoanVi': a[5]
+            })
+
+        for q in questions_results:
+            exam_data = exams.get(str(q[0]).lower())
+            if exam_data is None:
+                continue
+            exam_data['questions'].append({
+                'MaCauHoi': q[1],
+                'NoiDung': q[2],
+                'MaCLO': q[3],
+                'CapDo': q[4],
+                'ThuTu': q[5],
+                'MaCauHoiCha': q[6],
+                'HoanVi': q[7],
+                'answers': list(answers_by_question.get(q[1], []))
+            })
+
+        for exam_data in exams.values():
+            exam_data['total_questions'] = len(exam_data['questions'])
+        return exams
+
+    def resolve_images(self, exams):
+        """Fetch the images referenced by the exams' content into the media cache
+
+        Sets exam_data['images'] to a map of reference to local file (None
+        when it could not be fetched). All exams are resolved in one
+        concurrent batch, so a figure they share is fetched once.
+        """
+        if self.media is None:
+            return
+
+        references = {}
+        for exam_data in exams:
+            refs = []
+            for question in exam_data['questions']:
+                refs.extend(find_image_references(question['NoiDung']))
+                for answer in question['answers']:
+                    refs.extend(find_image_references(answer['NoiDung']))
+            references[id(exam_data)] = refs
+
+        paths = self.media.get_many(ref for refs in references.values() for ref in refs)
+        self.timings.count('images', len(paths))
+        for exam_data in exams:
+            exam_data['images'] = {ref: paths[ref] for ref in references[id(exam_data)]}
+
+    def find_exam_ids(self, subject_id=None, faculty_id=None, created_from=None, created_to=None):
+        """IDs of approved exams matching a filter, by subject then creation date
+
+        subject_id is a MaMonHoc, faculty_id a MaKhoa; created_from and
+        created_to are dates, both inclusive.
+        """
+        conditions = ['dt.DaDuyet = 1']
+        params = []
+        if subject_id:
+            conditions.append('dt.MaMonHoc = ?')
+            params.append(subject_id)
+        if faculty_id:
+            conditions.append('mh.MaKhoa = ?')
+            params.append(faculty_id)
+        if created_from:
+            conditions.append('dt.NgayTao >= ?')
+            params.append(datetime.combine(created_from, datetime.min.time()))
+        if created_to:
+            conditions.append('dt.NgayTao < ?')
+            params.append(datetime.combine(created_to + timedelta(days=1), datetime.min.time()))
+
+        query = f"""
+        SELECT dt.MaDeThi
+        FROM DeThi dt
+        LEFT JOIN MonHoc mh ON dt.MaMonHoc = mh.MaMonHoc
+        WHERE {' AND '.join(conditions)}
+        ORDER BY mh.TenMonHoc, dt.NgayTao
+        """
+        cursor = self.connection.cursor()
+        cursor.execute(query, params)
+        return [row[0] for row in cursor.fetchall()]
+
+    def count_rows(self, exam_data):
+        """Count the rows of exam data given by the caller like queried ones"""
+        self.timings.count('exams', 1)
+        self.timings.count('questions', len(exam_data['questions']))
+        self.timings.count('answers', sum(len(question['answers']) for question in exam_data['questions']))
+
+    def get_change_marker(self, exam_id):
+        """Fingerprint of everything in the database an export renders
+
+        Returns (marker, question count), or None when the exam is not an
+        approved exam. One round trip: SHA-256 digests of the exam header
+        and of the exam's question and answer rows, each hashed over the
+        exact column values the renderer reads, in render order. Any edit,
+        reordering, addition or removal changes the marker, including
+        changes a case-insensitive collation would treat as equal.
+        """
+        cursor = self.connection.cursor()
+        question_row = _hashed_row('ctdt.MaCauHoi', 'ctdt.ThuTu', 'ch.NoiDung', 'ch.MaCauHoiCha', 'ch.HoanVi')
+        answer_row = _hashed_row('ctl.MaCauHoi', 'ctl.MaCauTraLoi', 'ctl.NoiDung', 'ctl.LaDapAn',
+                                 'ctl.ThuTu', 'ctl.HoanVi')
+        marker_query = f"""
+        SELECT HASHBYTES('SHA2_256', {_hashed_row('dt.TenDeThi', 'mh.TenMonHoc')}),
+               (SELECT COUNT(*) FROM ChiTietDeThi ctdt WHERE ctdt.MaDeThi = dt.MaDeThi),
+               (SELECT HASHBYTES('SHA2_256', STRING_AGG({question_row}, '')
+                                             WITHIN GROUP (ORDER BY ctdt.ThuTu, ctdt.MaCauHoi))
+                FROM ChiTietDeThi ctdt
+                INNER JOIN CauHoi ch ON ctdt.MaCauHoi = ch.MaCauHoi
+                WHERE ctdt.MaDeThi = dt.MaDeThi),
+               (SELECT HASHBYTES('SHA2_256', STRING_AGG({answer_row}, '')
+                                             WITHIN GROUP (ORDER BY ctl.MaCauHoi, ctl.ThuTu, ctl.MaCauTraLoi))
+                FROM CauTraLoi ctl
+                WHERE ctl.MaCauHoi IN (SELECT MaCauHoi FROM ChiTietDeThi WHERE MaDeThi = dt.MaDeThi))
+        FROM DeThi dt
+        LEFT JOIN MonHoc mh ON dt.MaMonHoc = mh.MaMonHoc
+        WHERE dt.MaDeThi = ? AND dt.DaDuyet = 1
+        """
+        cursor.execute(marker_query, exam_id)
+        row = cursor.fetchone()
+        if not row:
+            return None
+        marker = ':'.join(value.hex() if isinstance(value, (bytes, bytearray)) else str(value)
+                          for value in row)
+        return marker, row[1]
+
+    def template_version(self):
+        """Identity of the template file, so a new template is not served from cache"""
+        try:
+            stat = os.stat(TEMPLATE_PATH)
+            return f"{stat.st_size}:{stat.st_mtime_ns}"
+        except OSError:
+            return None
+
     def create_word_document(self, exam_data, export_options):
         """Create Word document with exam content using original template"""
         try:
-            # Use the original template from the old service
-            template_path = os.path.join(os.path.dirname(
-                __file__), '..', '..', 'template', 'TemplateHutechOffical.dotx')
-
-            if os.path.exists(template_path):
-                logger.info(f"Using original HUTECH template: {template_path}")
-                # For .dotx files, we need to copy and modify
-                import shutil
-                temp_doc_path = template_path.replace('.dotx', '_temp.docx')
-                shutil.copy2(template_path, temp_doc_path)
-                doc = Document(temp_doc_path)
-
-                # Clean up temp file after loading
-                try:
-                    os.remove(temp_doc_path)
-                except:
-                    pass
-            else:
-                logger.warning("Template not found, creating basic document")
-                doc = Document()
-                # Add basic HUTECH header if no template
-                self.add_basic_hutech_header(
-                    doc, exam_data['exam'], export_options)
-
-            # Add questions
-            self.add_questions(doc, exam_data['questions'], export_options)
-
-            # Add answer key if requested
-            if export_options.get('showAnswers', False):
-                self.add_answer_key(
-                    doc, exam_data['questions'], export_options)
+            # Use the original template from the old service, parsed once
+            # per process and cloned in memory
+            with self.timings.phase('template'):
+                if os.path.exists(TEMPLATE_PATH):
+                    template = ExamTemplate.get(TEMPLATE_PATH)
+                    doc = template.new_document(
+                        self.template_values(exam_data['exam'], export_options),
+                        export_options.get('allowMaterials', False))
+                else:
+                    logger.warning("Template not found, creating basic document")
+                    doc = Document()
+                    # Add basic HUTECH header if no template
+                    self.add_basic_hutech_header(
+                        doc, exam_data['exam'], export_options)
+
+            with self.timings.phase('render', questions=len(exam_data['questions'])):
+                # Add questions
+                self.add_questions(doc, exam_data['questions'], export_options,
+                                   exam_data.get('images'))
+
+                # Add answer key if requested
+                if export_options.get('showAnswers', False):
+                    self.add_answer_key(
+                        doc, exam_data['questions'], export_options)
 
             return doc
 
@@ -181,8 +785,25 @@ class ExamWordExporter:
             logger.error(f"Error creating Word document: {e}")
             raise
 
+    def template_values(self, exam_info, export_options):
+        """Values of the template header slots"""
+        # The template already reads "ĐỀ THI HỌC KỲ", so only the number is kept
+        semester = re.sub(r'^\s*học kỳ\s*', '', export_options.get('semester') or '', flags=re.IGNORECASE)
+        dated = with_dated_defaults(export_options)
+        return {
+            'semester': semester,
+            'academic_year': dated['academicYear'],
+            'course': export_options.get('course', ''),
+            'subject': export_options.get('subject') or exam_info['TenMonHoc'],
+            'exam_date': dated['examDate'],
+            'duration': export_options.get('duration') or DEFAULT_EXAM_DURATION,
+            'exam_code': export_options.get('examCode', '')
+        }
+
     def add_basic_hutech_header(self, doc, exam_info, export_options):
         """Add basic HUTECH header when template is not available"""
+        values = self.template_values(exam_info, export_options)
+
         # School header
         header_p = doc.add_paragraph()
         header_p.alignment = WD_ALIGN_PARAGRAPH.CENTER
@@ -207,7 +828,7 @@ class ExamWordExporter:
         year_p = doc.add_paragraph()
         year_p.alignment = WD_ALIGN_PARAGRAPH.CENTER
         year_run = year_p.add_run(
-            f"NĂM HỌC {export_options.get('academicYear', '2024-2025')}")
+            f"NĂM HỌC {values['academic_year']}")
         year_run.font.size = Pt(12)
         year_run.bold = True
 
@@ -215,6 +836,8 @@ class ExamWordExporter:
 
     def add_header(self, doc, exam_info, export_options):
         """Add document header with school info and exam details"""
+        values = self.template_values(exam_info, export_options)
+
         # School header
         header_p = doc.add_paragraph()
         header_p.alignment = WD_ALIGN_PARAGRAPH.CENTER
@@ -239,7 +862,7 @@ class ExamWordExporter:
         year_p = doc.add_paragraph()
         year_p.alignment = WD_ALIGN_PARAGRAPH.CENTER
         year_run = year_p.add_run(
-            f"NĂM HỌC {export_options.get('academicYear', '2024-2025')}")
+            f"NĂM HỌC {values['academic_year']}")
         year_run.font.size = Pt(12)
         year_run.bold = True
 
@@ -247,16 +870,16 @@ class ExamWordExporter:
         doc.add_paragraph()  # Space
 
         details_p = doc.add_paragraph()
-        details_p.add_run(f"Khoa/Lớp: {export_options.get('course', '')}\t\t")
+        details_p.add_run(f"Khoa/Lớp: {values['course']}\t\t")
         details_p.add_run(f"Số TC: ___________\n")
         details_p.add_run(
-            f"Môn thi: {export_options.get('subject', exam_info['TenMonHoc'])}\t\t")
+            f"Môn thi: {values['subject']}\t\t")
         details_p.add_run(f"Hình thức thi: ___________\n")
         details_p.add_run(
-            f"Ngày thi: {export_options.get('examDate', datetime.now().strftime('%d/%m/%Y'))}\t\t")
+            f"Ngày thi: {values['exam_date']}\t\t")
         details_p.add_run(f"Mã đề (Nếu có): ___________\n")
         details_p.add_run(
-            f"Thời gian làm bài: {export_options.get('duration', '90 phút')}\t\t")
+            f"Thời gian làm bài: {values['duration']}\t\t")
 
         # Materials checkbox
         allow_materials = export_options.get('allowMaterials', False)
@@ -282,8 +905,9 @@ class ExamWordExporter:
 
     def add_instructions(self, doc, export_options):
         """Add exam instructions"""
+        duration = export_options.get('duration') or DEFAULT_EXAM_DURATION
         instructions = export_options.get('instructions',
-                                          'Thời gian làm bài: 90 phút. Không được sử dụng tài liệu.')
+                                          f"Thời gian làm bài: {duration}. Không được sử dụng tài liệu.")
 
         inst_p = doc.add_paragraph()
         inst_run = inst_p.add_run(instructions)
@@ -291,92 +915,170 @@ class ExamWordExporter:
 
         doc.add_paragraph()  # Space
 
-    def add_questions(self, doc, questions, export_options):
-        """Add questions to document"""
+    def add_questions(self, doc, questions, export_options, images=None):
+        """Add questions to document; images maps image references to local files"""
         show_answers = export_options.get('showAnswers', False)
+        builder = BodyFragmentBuilder(InlineImages(doc, images) if images else None)
 
         for i, question in enumerate(questions, 1):
-            # Question number and content
-            q_p = doc.add_paragraph()
-            q_num_run = q_p.add_run(f"Câu {i}: ")
-            q_num_run.bold = True
+            entry = self.cached_fragments(question, show_answers, images)
+            if entry is not None:
+                head, tail = entry['question']
+                parts = [head, str(i), tail]
+                for j, answer in enumerate(question['answers']):
+                    head, tail = entry['answers'][str(answer['MaCauTraLoi'])]
+                    parts += [head, chr(65 + j), tail]
+                builder.add_xml(''.join(parts))
+                builder.add('empty')  # Space between questions
+                continue
 
-            q_content_run = q_p.add_run(question['NoiDung'] or '')
+            # Question number and content
+            builder.add('question', question['NoiDung'] or '', number=i)
 
             # Skip CLO and difficulty info as requested
 
             # Add answers
-            if question['answers']:
-                for j, answer in enumerate(question['answers']):
-                    answer_p = doc.add_paragraph()
-                    answer_p.paragraph_format.left_indent = Inches(0.3)
-
-                    label = chr(65 + j)  # A, B, C, D
-                    answer_run = answer_p.add_run(
-                        f"{label}. {answer['NoiDung'] or ''}")
-
-                    # Highlight correct answer if showing answers
-                    if show_answers and answer['LaDapAn']:
-                        answer_run.bold = True
-                        # Add checkmark or highlight
-                        correct_run = answer_p.add_run(" ✓")
-                        correct_run.font.color.rgb = None  # Green color would be better
-                        correct_run.bold = True
-
-            doc.add_paragraph()  # Space between questions
+            for j, answer in enumerate(question['answers']):
+                label = chr(65 + j)  # A, B, C, D
+                # Correct answers are bold with a checkmark when showing answers
+                fragment = 'correct_answer' if show_answers and answer['LaDapAn'] else 'answer'
+                builder.add(fragment, f"{label}. {answer['NoiDung'] or ''}")
+
+            builder.add('empty')  # Space between questions
+
+        builder.append_to(doc)
+
+    def cached_fragments(self, question, show_answers, images=None):
+        """The question's FragmentCache entry, rendered on a miss; None when it is not cached"""
+        if self.fragments is None or not question.get('MaCauHoi') or \
+                any(answer.get('MaCauTraLoi') is None for answer in question['answers']) or \
+                has_inline_images(question, images):
+            return None
+
+        key = fragment_key(question['MaCauHoi'], content_version(question), showAnswers=bool(show_answers))
+        entry = self.fragments.get(key)
+        if entry is None:
+            entry = question_fragments(question, show_answers)
+            self.fragments.put(key, entry)
+        return entry
 
     def add_answer_key(self, doc, questions, export_options):
         """Add answer key section"""
         if not export_options.get('separateAnswerSheet', False):
             return
 
-        # Add page break
-        doc.add_page_break()
-
-        # Answer key title
-        title_p = doc.add_paragraph()
-        title_p.alignment = WD_ALIGN_PARAGRAPH.CENTER
-        title_run = title_p.add_run("ĐÁP ÁN")
-        title_run.font.size = Pt(14)
-        title_run.bold = True
-
-        doc.add_paragraph()  # Space
+        builder = BodyFragmentBuilder()
+        builder.add('page_break')
+        builder.add('title', "ĐÁP ÁN")
+        builder.add('empty')  # Space
 
         # Answer key content
         for i, question in enumerate(questions, 1):
-            if question['answers']:
-                correct_answers = [chr(65 + j) for j, answer in enumerate(question['answers'])
-                                   if answer['LaDapAn']]
-                if correct_answers:
-                    answer_p = doc.add_paragraph()
-                    answer_p.add_run(f"Câu {i}: {', '.join(correct_answers)}")
-
-    def export_exam_to_word(self, exam_id, export_options, output_path):
-        """Main export function"""
+            correct_answers = [chr(65 + j) for j, answer in enumerate(question['answers'])
+                               if answer['LaDapAn']]
+            if correct_answers:
+                builder.add('text', f"Câu {i}: {', '.join(correct_answers)}")
+
+        builder.append_to(doc)
+
+    def export_exam_to_word(self, exam_id, export_options, output_path=None, output_stream=None,
+                            exam_data=None):
+        """Main export function
+
+        The document is saved to output_path, or written to the binary
+        output_stream instead when one is given (file_path is then None).
+        Exam data given by the caller (see exam_snapshot) is exported as is,
+        without connecting to the database. The result includes the
+        export's timings (see ExportTimings).
+        """
+        self.timings = timings = ExportTimings(self.trace)
+        # The defaulted date goes into the cache key as well as the document
+        export_options = with_dated_defaults(export_options)
         try:
             logger.info(f"Starting export for exam: {exam_id}")
 
-            # Connect to database
-            if not self.connect_database():
-                raise Exception("Failed to connect to database")
+            # Connect to database, unless the caller gave the exam data
+            if exam_data is not None:
+                self.count_rows(exam_data)
+            elif self.owns_connection:
+                with timings.phase('connect'):
+                    connected = self.connect_database()
+                if not connected:
+                    raise Exception("Failed to connect to database")
+
+            # Serve an unchanged exam from the export cache
+            cache_key = None
+            if self.cache is not None:
+                with timings.phase('cache_lookup'):
+                    if exam_data is not None:
+                        change = (snapshot_marker(exam_data), exam_data['total_questions'])
+                    else:
+                        change = self.get_change_marker(exam_id)
+                    served = False
+                    if change is not None:
+                        marker, total_questions = change
+                        cache_key = export_key(exam_id, export_options, marker,
+                                               template=self.template_version(),
+                                               media=self.media is not None)
+                        if output_stream is not None:
+                            data = self.cache.read(cache_key)
+                            served = data is not None
+                            if served:
+                                output_stream.write(data)
+                        else:
+                            served = self.cache.copy_to(cache_key, output_path)
+                if served:
+                    logger.info(f"Served exam {exam_id} from export cache")
+                    return {
+                        'success': True,
+                        'message': 'Export completed successfully',
+                        'file_path': output_path if output_stream is None else None,
+                        'total_questions': total_questions,
+                        'cached': True,
+                        'size': len(data) if output_stream is not None else os.path.getsize(output_path),
+                        **timings.summary()
+                    }
 
             # Get exam data
-            exam_data = self.get_exam_data(exam_id)
+            if exam_data is None:
+                with timings.phase('query'):
+                    exam_data = self.get_exam_data(exam_id)
             logger.info(
                 f"Retrieved exam data: {exam_data['total_questions']} questions")
+            with timings.phase('images'):
+                self.resolve_images([exam_data])
 
             # Create Word document
             doc = self.create_word_document(exam_data, export_options)
 
-            # Save document
-            doc.save(output_path)
-            logger.info(f"Document saved to: {output_path}")
+            # Serialize once in memory; the bytes go to the caller and the cache
+            with timings.phase('save'):
+                buffer = io.BytesIO()
+                doc.save(buffer)
+                data = buffer.getvalue()
+
+            with timings.phase('write'):
+                if output_stream is not None:
+                    output_stream.write(data)
+                    logger.info(f"Document written to stream ({len(data)} bytes)")
+                else:
+                    with open(output_path, 'wb') as f:
+                        f.write(data)
+                    logger.info(f"Document saved to: {output_path}")
+
+            # A document missing an image that failed to fetch is not kept
+            if cache_key is not None and all(exam_data.get('images', {}).values()):
+                with timings.phase('cache_store'):
+                    self.cache.put(cache_key, data)
 
             return {
                 'success': True,
                 'message': 'Export completed successfully',
-                'file_path': output_path,
-                'total_questions': exam_data['total_questions']
+                'file_path': output_path if output_stream is None else None,
+                'total_questions': exam_data['total_questions'],
+                'cached': False,
+                'size': len(data),
+                **timings.summary()
             }
 
         except Exception as e:
@@ -384,49 +1086,563 @@ class ExamWordExporter:
             return {
                 'success': False,
                 'message': str(e),
-                'file_path': None
+                'file_path': None,
+                **timings.summary()
             }
         finally:
-            if self.connection:
+            if self.owns_connection and self.connection:
                 self.connection.close()
+                self.connection = None
+
+    def export_exam_variants(self, exam_id, export_options, count, output_dir,
+                             seed=None, workers=DEFAULT_VARIANT_WORKERS, exam_data=None):
+        """Export shuffled variants (mã đề) of an exam from one data fetch
+
+        Writes de_<code>.docx for each variant to output_dir, with the
+        grading grid dap_an.csv and the answer-key matrix dap_an.json that
+        maps every variant back to the canonical exam. Codes come from the
+        variantCodes option or run from 101; with both, count (None to take
+        the codes as given) must match the number of codes or the export
+        fails. The seed defaults to the exam ID so the same variants can be
+        generated again.
+        """
+        self.timings = timings = ExportTimings(self.trace)
+        try:
+            logger.info(f"Starting variant export for exam: {exam_id}")
+            # Conflicting variant options fail before any data is fetched
+            codes = resolve_variant_codes(count, export_options.get('variantCodes'))
+
+            if exam_data is not None:
+                self.count_rows(exam_data)
+            else:
+                if self.owns_connection:
+                    with timings.phase('connect'):
+                        connected = self.connect_database()
+                    if not connected:
+                        raise Exception("Failed to connect to database")
+
+                with timings.phase('query'):
+                    exam_data = self.get_exam_data(exam_id)
+            with timings.phase('images'):
+                self.resolve_images([exam_data])
+            variants = make_variants(exam_data['questions'], codes,
+                                     seed if seed is not None else exam_id)
+
+            os.makedirs(output_dir, exist_ok=True)
+            tasks = [(variant, os.path.join(output_dir, f"de_{variant.code}.docx")) for variant in variants]
+            # Template, rendering and saving of every variant, in the workers
+            with timings.phase('render', variants=len(tasks)):
+                if workers <= 1 or len(tasks) == 1:
+                    _init_variant_worker(exam_data, export_options, self.fragments)
+                    file_paths = [_render_variant(*task) for task in tasks]
+                else:
+                    with ProcessPoolExecutor(max_workers=min(workers, len(tasks)),
+                                             initializer=_init_variant_worker,
+                                             initargs=(exam_data, export_options,
+                                                       self.fragments)) as executor:
+                        file_paths = list(executor.map(_render_variant, *zip(*tasks)))
+
+            answer_key_path = os.path.join(output_dir, 'dap_an.csv')
+            answer_matrix_path = os.path.join(output_dir, 'dap_an.json')
+            with timings.phase('answer_key'):
+                write_answer_key(answer_key_matrix(exam_data['questions'], variants),
+                                 answer_key_path, answer_matrix_path)
+            logger.info(f"Exported {len(variants)} variants to: {output_dir}")
+
+            return {
+                'success': True,
+                'message': 'Export completed successfully',
+                'variants': [{'code': variant.code, 'file_path': path}
+                             for variant, path in zip(variants, file_paths)],
+                'answer_key_path': answer_key_path,
+                'answer_matrix_path': answer_matrix_path,
+                'total_questions': exam_data['total_questions'],
+                'size': sum(os.path.getsize(path) for path in file_paths),
+                **timings.summary()
+            }
+
+        except Exception as e:
+            logger.error(f"Variant export failed: {e}")
+            return {
+                'success': False,
+                'message': str(e),
+                'variants': [],
+                **timings.summary()
+            }
+        finally:
+            if self.owns_connection and self.connection:
+                self.connection.close()
+                self.connection = None
+
+
+# Exam data of a variant render process, set once by the pool initializer
+_variant_exam_data = None
+_variant_export_options = None
+_variant_fragments = None
+
+
+def _init_variant_worker(exam_data, export_options, fragments=None):
+    global _variant_exam_data, _variant_export_options, _variant_fragments
+    _variant_exam_data = exam_data
+    _variant_export_options = export_options
+    # Every variant has the same questions, so all but the first are assembled
+    _variant_fragments = fragments
+
+
+def _render_variant(variant, output_path):
+    """Worker entry point: render one variant to output_path"""
+    exam_data = dict(_variant_exam_data,
+                     questions=apply_variant(_variant_exam_data['questions'], variant))
+    export_options = dict(_variant_export_options, examCode=variant.code)
+    doc = ExamWordExporter({}, fragments=_variant_fragments).create_word_document(exam_data, export_options)
+    doc.save(output_path)
+    return output_path
+
+
+class ConnectionPool:
+    """Bounded pool of pyodbc connections shared by export jobs
+
+    Connections are opened lazily, up to max_size, and reused by later jobs.
+    A connection that fails a liveness check is closed instead of returned.
+    """
+
+    def __init__(self, db_config, max_size=DEFAULT_SERVER_WORKERS):
+        self.db_config = db_config
+        self.max_size = max_size
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self.opened = 0
+
+    def acquire(self, timeout=None):
+        """Take an idle connection, or open one if the pool is not full"""
+        if not self._slots.acquire(timeout=timeout):
+            raise TimeoutError("No database connection available")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            connection = open_connection(self.db_config)
+        except Exception:
+            self._slots.release()
+            raise
+        self.opened += 1
+        logger.info(f"Opened pooled database connection ({self.opened} total)")
+        return connection
+
+    def release(self, connection, healthy=True):
+        """Return a connection to the pool, or close it if it is broken"""
+        if healthy:
+            self._idle.put(connection)
+        else:
+            self._close(connection)
+        self._slots.release()
+
+    def is_alive(self, connection):
+        try:
+            connection.cursor().execute("SELECT 1").fetchone()
+            return True
+        except Exception:
+            return False
+
+    def close_all(self):
+        while True:
+            try:
+                self._close(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+    def _close(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+
+class ExportJob:
+    """State of one export job while the server runs it"""
+
+    def __init__(self, job_id, exam_id, export_options, output_path, timeout, stream=False, trace=False,
+                 exam_data=None):
+        self.id = job_id
+        self.exam_id = exam_id
+        self.export_options = export_options
+        # Exam data from the job's snapshot; the job then needs no connection
+        self.exam_data = exam_data
+        self.output_path = output_path
+        self.stream = stream
+        self.trace = trace
+        self.submitted = time.monotonic()
+        self.deadline = self.submitted + timeout
+        self.finished = False
+        self.future = None
+        self.timer = None
+
+    def remaining(self):
+        return max(0.0, self.deadline - time.monotonic())
+
+
+class ExportServer:
+    """Long-running exporter that takes jobs as JSON lines on stdin
+
+    Each input line is a job:
+        {"id": "...", "exam_id": "...", "options": {...},
+         "output_path": "...", "timeout": 60}
+    and gets exactly one JSON line on stdout with its id and the usual
+    export result (success, message, file_path, total_questions, size and
+    the timings; "trace": true adds the step trace). A line
+    {"id": "...", "type": "ping"} is answered with the server counters,
+    including the export, image and fragment cache metrics when they are used.
+
+    A job may carry the exam itself as "snapshot" (see exam_snapshot); it
+    is exported without a database connection.
+
+    With a document stream (--docx-fd), a job with "stream": true is not
+    saved to disk: its .docx bytes are written to that stream and the
+    response carries their "size" instead of a file_path. Documents are
+    written in the same order as their response lines, so the reader takes
+    the next size bytes from the stream for each streamed response.
+
+    Jobs run on a fixed number of worker threads, with database connections
+    taken from a ConnectionPool. A job that does not finish within its
+    timeout (counted from submission) is answered with a failure; if it was
+    still queued it never runs, and the output of a late finish is removed.
+    """
+
+    def __init__(self, db_config, workers=DEFAULT_SERVER_WORKERS, pool_size=None,
+                 job_timeout=DEFAULT_JOB_TIMEOUT, cache=None, docx_stream=None, media=None, fragments=None):
+        self.db_config = db_config
+        self.job_timeout = job_timeout
+        self.cache = cache
+        self.media = media
+        self.fragments = fragments
+        self.pool = ConnectionPool(db_config, pool_size or workers)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='export')
+        self._lock = threading.Lock()
+        self._output = sys.stdout
+        self._docx_output = docx_stream
+        self.stats = {'completed': 0, 'failed': 0, 'timed_out': 0}
+
+    def serve(self, input_stream=None, output_stream=None):
+        """Read jobs until the input is closed, then wait for running jobs"""
+        input_stream = input_stream or sys.stdin
+        self._output = output_stream or sys.stdout
+        logger.info("Export server ready")
+
+        for line in input_stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                request = json.loads(line)
+            except json.JSONDecodeError as e:
+                self._respond({'id': None, 'success': False, 'message': f"Invalid job JSON: {e}"})
+                continue
+            self.submit(request)
+
+        self.executor.shutdown(wait=True)
+        self.pool.close_all()
+
+    def submit(self, request):
+        job_id = request.get('id')
+        if request.get('type') == 'ping':
+            with self._lock:
+                stats = dict(self.stats, connections=self.pool.opened)
+            if self.cache is not None:
+                stats['cache'] = self.cache.stats()
+            if self.media is not None:
+                stats['media'] = self.media.stats()
+            if self.fragments is not None:
+                stats['fragments'] = self.fragments.stats()
+            self._respond({'id': job_id, 'success': True, 'message': 'pong', 'stats': stats})
+            return
+
+        exam_id = request.get('exam_id')
+        if not exam_id:
+            self._respond({'id': job_id, 'success': False, 'message': 'exam_id is required', 'file_path': None})
+            return
+
+        export_options = request.get('options') or {}
+        stream = bool(request.get('stream'))
+        if stream and self._docx_output is None:
+            self._respond({'id': job_id, 'success': False, 'file_path': None,
+                           'message': 'stream requires the server to run with --docx-fd'})
+            return
+
+        exam_data = None
+        if request.get('snapshot') is not None:
+            try:
+                exam_data = exam_data_from_snapshot(request['snapshot'], exam_id)
+            except ValueError as e:
+                self._respond({'id': job_id, 'success': False, 'file_path': None,
+                               'message': f"Invalid snapshot: {e}"})
+                return
+
+        output_path = None
+        if not stream:
+            output_path = request.get('output_path') or export_options.get('outputPath') or \
+                f"exam_export_{exam_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.docx"
+        job = ExportJob(job_id, exam_id, export_options, output_path,
+                        float(request.get('timeout') or self.job_timeout), stream,
+                        bool(request.get('trace')), exam_data)
+
+        job.timer = threading.Timer(job.remaining(), self._expire, (job,))
+        job.timer.daemon = True
+        job.future = self.executor.submit(self._run, job)
+        # Started after submit so _expire always has the future to cancel; a
+        # job that already finished has cancelled the timer before it starts
+        job.timer.start()
+
+    def _run(self, job):
+        if job.finished:
+            return
+        started = time.monotonic()
+        connection = None
+        if job.exam_data is None:
+            try:
+                connection = self.pool.acquire(timeout=job.remaining())
+            except Exception as e:
+                self._finish(job, {'success': False, 'message': str(e), 'file_path': None})
+                return
+        # Time spent waiting for a worker and for a pooled connection
+        waits = {'queue': round((started - job.submitted) * 1000, 2),
+                 'pool_wait': round((time.monotonic() - started) * 1000, 2)}
+
+        healthy = True
+        buffer = io.BytesIO() if job.stream else None
+        try:
+            if connection is not None:
+                # Queries must not outlive the job either (pyodbc timeout is in seconds)
+                connection.timeout = max(1, int(job.remaining()))
+            exporter = ExamWordExporter(self.db_config, connection=connection, cache=self.cache,
+                                        media=self.media, trace=job.trace, fragments=self.fragments)
+            result = exporter.export_exam_to_word(job.exam_id, job.export_options, job.output_path,
+                                                  output_stream=buffer, exam_data=job.exam_data)
+            if not result['success'] and connection is not None:
+                healthy = self.pool.is_alive(connection)
+        except Exception as e:
+            result = {'success': False, 'message': str(e), 'file_path': None}
+            if connection is not None:
+                healthy = self.pool.is_alive(connection)
+        finally:
+            if connection is not None:
+                self.pool.release(connection, healthy)
+
+        result = dict(result, timings_ms=dict(waits, **result.get('timings_ms', {})))
+        data = buffer.getvalue() if buffer is not None and result['success'] else None
+        self._finish(job, result, data=data)
+
+    def _expire(self, job):
+        # A job that has not started yet is dropped from the queue
+        job.future.cancel()
+        self._finish(job, {'success': False, 'message': 'Export timed out', 'file_path': None}, timed_out=True)
+
+    def _finish(self, job, result, timed_out=False, data=None):
+        with self._lock:
+            if job.finished:
+                late = True
+            else:
+                late = False
+                job.finished = True
+                if timed_out:
+                    self.stats['timed_out'] += 1
+                elif result.get('success'):
+                    self.stats['completed'] += 1
+                else:
+                    self.stats['failed'] += 1
+
+        if late:
+            # The caller already got a timeout for this job
+            if result.get('success') and result.get('file_path'):
+                try:
+                    os.remove(result['file_path'])
+                except OSError:
+                    pass
+            return
+
+        job.timer.cancel()
+        self._respond(dict(result, id=job.id), data)
+
+    def _respond(self, response, data=None):
+        line = json.dumps(response, ensure_ascii=False, default=str)
+        with self._lock:
+            # The document goes out before its response line so the reader
+            # can pair them up in order
+            if data is not None:
+                self._docx_output.write(data)
+                self._docx_output.flush()
+            self._output.write(line + '\n')
+            self._output.flush()
+
+
+def serve_main(argv):
+    """Run the long-lived export server on stdin/stdout"""
+    parser = argparse.ArgumentParser(description='Exam Word export server (JSON lines on stdin/stdout)')
+    parser.add_argument('--workers', type=int, default=DEFAULT_SERVER_WORKERS,
+                        help=f'Concurrent export jobs (default: {DEFAULT_SERVER_WORKERS})')
+    parser.add_argument('--pool-size', type=int,
+                        help='Maximum pooled database connections (default: --workers)')
+    parser.add_argument('--job-timeout', type=float, default=DEFAULT_JOB_TIMEOUT,
+                        help=f'Seconds before a job is answered with a timeout (default: {DEFAULT_JOB_TIMEOUT})')
+    parser.add_argument('--cache-dir', help='Keep rendered documents in this directory and serve '
+                                            'unchanged exams from it')
+    parser.add_argument('--cache-mb', type=int, default=DEFAULT_CACHE_MB,
+                        help=f'Size limit of --cache-dir in MB (default: {DEFAULT_CACHE_MB})')
+    parser.add_argument('--docx-fd', type=int,
+                        help='Write documents of "stream" jobs to this file descriptor')
+    add_media_arguments(parser)
+    add_fragment_arguments(parser)
+    args = parser.parse_args(argv)
+
+    if args.docx_fd is not None and args.docx_fd in (0, 1):
+        parser.error('--docx-fd cannot share stdin/stdout with the job protocol')
+    if args.docx_fd == LOG_FD:
+        parser.error('--docx-fd cannot be 2: log messages are written to stderr')
+
+    cache = ExportCache(args.cache_dir, args.cache_mb * 1024 * 1024) if args.cache_dir else None
+    docx_stream = open_binary_fd(args.docx_fd) if args.docx_fd is not None else None
+    server = ExportServer(DEFAULT_DB_CONFIG, args.workers, args.pool_size, args.job_timeout,
+                          cache, docx_stream, media_from_args(parser, args), fragments_from_args(args))
+    server.serve()
+
+
+def add_media_arguments(parser):
+    parser.add_argument('--media-cache-dir', help='Embed referenced images, caching them in this directory')
+    parser.add_argument('--media-cache-mb', type=int, default=DEFAULT_MEDIA_CACHE_BYTES // (1024 * 1024),
+                        help='Size limit of --media-cache-dir in MB '
+                             f'(default: {DEFAULT_MEDIA_CACHE_BYTES // (1024 * 1024)})')
+    parser.add_argument('--media-dir', help='Read images from this directory instead of the storage '
+                                            'configured by STORAGE_PROVIDER (e.g. a test stand-in)')
+
+
+def media_from_args(parser, args):
+    """ImageCache for the media arguments, or None when images are not embedded"""
+    if not args.media_cache_dir:
+        if args.media_dir:
+            parser.error('--media-dir needs --media-cache-dir')
+        return None
+    return ImageCache(args.media_cache_dir, media_storage_from_env(args.media_dir),
+                      args.media_cache_mb * 1024 * 1024)
+
+
+def add_fragment_arguments(parser):
+    parser.add_argument('--fragment-cache-dir',
+                        help='Also keep rendered question fragments in this directory, shared by processes')
+    parser.add_argument('--fragment-cache-mb', type=int, default=DEFAULT_FRAGMENT_CACHE_BYTES // (1024 * 1024),
+                        help='Size limit of --fragment-cache-dir in MB '
+                             f'(default: {DEFAULT_FRAGMENT_CACHE_BYTES // (1024 * 1024)})')
+    parser.add_argument('--fragment-memory-mb', type=int,
+                        default=DEFAULT_FRAGMENT_MEMORY_BYTES // (1024 * 1024),
+                        help='Rendered question fragments kept in memory, in MB; 0 turns the cache off '
+                             f'unless --fragment-cache-dir is given (default: '
+                             f'{DEFAULT_FRAGMENT_MEMORY_BYTES // (1024 * 1024)})')
+
+
+def fragments_from_args(args):
+    """FragmentCache for the fragment arguments, or None when it is turned off"""
+    if not args.fragment_cache_dir and args.fragment_memory_mb <= 0:
+        return None
+    return FragmentCache(args.fragment_cache_dir, args.fragment_cache_mb * 1024 * 1024,
+                         max(0, args.fragment_memory_mb) * 1024 * 1024)
+
+
+def open_binary_fd(fd):
+    """Binary stream for a file descriptor inherited from the parent process"""
+    if fd == 1:
+        sys.stdout.flush()
+        return sys.stdout.buffer
+    return os.fdopen(fd, 'wb', closefd=False)
 
 
 def main():
     """Main function for command line usage"""
-    if len(sys.argv) < 3:
-        print("Usage: python exam_word_exporter.py <exam_id> <export_options_json>")
-        sys.exit(1)
-
-    exam_id = sys.argv[1]
-    export_options_json = sys.argv[2]
+    if len(sys.argv) > 1 and sys.argv[1] == '--serve':
+        serve_main(sys.argv[2:])
+        return
+
+    parser = argparse.ArgumentParser(
+        description='Export an exam to Word',
+        epilog='Server mode: python exam_word_exporter.py --serve [--workers N] [--pool-size N] '
+               '[--job-timeout S] [--docx-fd FD]')
+    parser.add_argument('exam_id', help='Exam ID (MaDeThi)')
+    parser.add_argument('export_options_json', help='Export options as JSON')
+    parser.add_argument('--docx-fd', type=int,
+                        help='Write the document to this file descriptor (1 for stdout) '
+                             'instead of a file in the working directory')
+    parser.add_argument('--status-fd', type=int, default=1,
+                        help='File descriptor for the JSON status (default: 1, stdout; '
+                             'not 2, which carries the log)')
+    parser.add_argument('--variants', type=int,
+                        help='Export this many shuffled variants (mã đề) to --output-dir; '
+                             'must match the number of variantCodes when the options list them')
+    parser.add_argument('--seed', help='Seed of the variant shuffles (default: the exam ID)')
+    parser.add_argument('--output-dir', help='Directory for --variants '
+                                             '(default: exam_variants_<exam_id>_<timestamp>)')
+    parser.add_argument('--workers', type=int, default=DEFAULT_VARIANT_WORKERS,
+                        help=f'Processes rendering variants (default: {DEFAULT_VARIANT_WORKERS})')
+    parser.add_argument('--snapshot', metavar='PATH',
+                        help='Read the exam from this JSON or MessagePack snapshot ("-" for stdin) '
+                             'instead of the database')
+    parser.add_argument('--snapshot-format', choices=SNAPSHOT_FORMATS, default='auto',
+                        help='Format of --snapshot (default: auto)')
+    add_media_arguments(parser)
+    add_fragment_arguments(parser)
+    parser.add_argument('--trace', action='store_true',
+                        help='Add a trace of every export step to the JSON result')
+    args = parser.parse_args()
+
+    if args.docx_fd is not None and args.docx_fd == args.status_fd:
+        parser.error('--docx-fd and --status-fd must be different descriptors')
+    for option, fd in (('--docx-fd', args.docx_fd), ('--status-fd', args.status_fd)):
+        if fd == LOG_FD:
+            parser.error(f'{option} cannot be 2: log messages are written to stderr')
+    if args.variants is not None and args.docx_fd is not None:
+        parser.error('--variants writes files and cannot be used with --docx-fd')
 
     try:
-        export_options = json.loads(export_options_json)
+        export_options = json.loads(args.export_options_json)
     except json.JSONDecodeError as e:
         print(f"Error parsing export options JSON: {e}")
         sys.exit(1)
 
-    # Database configuration - using Windows Authentication for local
-    db_config = {
-        'server': 'localhost',
-        'port': 1433,
-        'database': 'question_bank',
-        'username': '',  # Empty for Windows Auth
-        'password': '',  # Empty for Windows Auth
-        'driver': 'ODBC Driver 17 for SQL Server',
-        'trusted_connection': 'yes'
-    }
-
-    # Output file path
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    output_path = f"exam_export_{exam_id}_{timestamp}.docx"
-
-    # Create exporter and run
-    exporter = ExamWordExporter(db_config)
-    result = exporter.export_exam_to_word(exam_id, export_options, output_path)
+    exam_data = None
+    if args.snapshot:
+        try:
+            if args.snapshot == '-':
+                data = sys.stdin.buffer.read()
+            else:
+                with open(args.snapshot, 'rb') as f:
+                    data = f.read()
+            exam_data = exam_data_from_snapshot(parse_snapshot(data, args.snapshot_format), args.exam_id)
+        except (OSError, ValueError) as e:
+            print(f"Error reading exam snapshot: {e}")
+            sys.exit(1)
+
+    exporter = ExamWordExporter(DEFAULT_DB_CONFIG, media=media_from_args(parser, args), trace=args.trace,
+                                fragments=fragments_from_args(args))
+    if args.variants is not None:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        output_dir = args.output_dir or f"exam_variants_{args.exam_id}_{timestamp}"
+        result = exporter.export_exam_variants(args.exam_id, export_options, args.variants,
+                                               output_dir, args.seed, args.workers, exam_data)
+    elif args.docx_fd is not None:
+        docx_stream = open_binary_fd(args.docx_fd)
+        result = exporter.export_exam_to_word(args.exam_id, export_options, output_stream=docx_stream,
+                                              exam_data=exam_data)
+        docx_stream.flush()
+    else:
+        # Output file path
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        output_path = f"exam_export_{args.exam_id}_{timestamp}.docx"
+        result = exporter.export_exam_to_word(args.exam_id, export_options, output_path,
+                                              exam_data=exam_data)
 
     # Output result as JSON
-    print(json.dumps(result))
+    if args.status_fd == 1:
+        print(json.dumps(result))
+    else:
+        with os.fdopen(args.status_fd, 'w', closefd=False) as status:
+            status.write(json.dumps(result) + '\n')
 
 
 if __name__ == "__main__":
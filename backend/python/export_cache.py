@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Disk cache for exported exam documents
+Author: Linh Dang Dev
+
+Approved exams rarely change, so a .docx rendered for an exam and a set of
+export options is kept as <sha256>.docx and served again for the same
+request. The key covers the exam ID, the normalized export options and a
+change marker computed from the exam's questions and answers, so an edited
+exam gets a new key instead of a stale document. The cache directory is
+kept under a byte budget by evicting the least recently used files (see
+disk_lru).
+"""
+
+import hashlib
+import json
+import logging
+import shutil
+import threading
+from typing import Any, Dict, Optional
+
+from disk_lru import DiskLRU
+
+logger = logging.getLogger('export_cache')
+
+DEFAULT_MAX_BYTES = 500 * 1024 * 1024
+
+# Bump when the rendering changes so documents from older code are not served
+CACHE_VERSION = 1
+
+# Options that do not change the document
+IGNORED_OPTIONS = {'outputPath'}
+
+
+def normalize_options(export_options: Dict[str, Any]) -> Dict[str, Any]:
+    """Drop options that render the same as when they are missing.
+
+    The exporter reads every option with a falsy default, so None, '' and
+    False are equivalent to leaving the option out.
+    """
+    normalized = {}
+    for name, value in export_options.items():
+        if name in IGNORED_OPTIONS or value is None or value == '' or value is False:
+            continue
+        if isinstance(value, dict):
+            value = normalize_options(value)
+            if not value:
+                continue
+        normalized[name] = value
+    return normalized
+
+
+def export_key(exam_id: str, export_options: Dict[str, Any], change_marker: str, **extra: Any) -> str:
+    """Cache key for an export; extra holds other inputs such as the template version"""
+    payload = json.dumps({
+        'version': CACHE_VERSION,
+        'exam_id': str(exam_id).lower(),
+        'options': normalize_options(export_options),
+        'marker': change_marker,
+        'extra': extra,
+    }, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ExportCache:
+    """Content-addressed .docx cache with LRU eviction and hit/miss counters"""
+
+    def __init__(self, cache_dir: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self._files = DiskLRU(cache_dir, max_bytes, suffix='.docx')
+
+    def path_for(self, key: str) -> str:
+        return self._files.path_for(key)
+
+    def _count(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached document path for a key, or None on a miss"""
+        path = self._files.touch(key)
+        self._count(path is not None)
+        return path
+
+    def copy_to(self, key: str, output_path: str) -> bool:
+        """Copy the cached document to output_path; False on a miss"""
+        path = self._files.touch(key)
+        try:
+            if path is not None:
+                shutil.copyfile(path, output_path)
+        except FileNotFoundError:
+            # Evicted by another process sharing the directory
+            self._files.discard(key)
+            path = None
+        self._count(path is not None)
+        return path is not None
+
+    def read(self, key: str) -> Optional[bytes]:
+        """Return the cached document bytes; None on a miss"""
+        path = self._files.touch(key)
+        data = None
+        try:
+            if path is not None:
+                with open(path, 'rb') as f:
+                    data = f.read()
+        except FileNotFoundError:
+            self._files.discard(key)
+        self._count(data is not None)
+        return data
+
+    def put(self, key: str, data: bytes):
+        """Store a rendered document"""
+        self._files.put(key, data)
+        with self._lock:
+            self.stores += 1
+
+    def stats(self) -> Dict[str, int]:
+        files = self._files.stats()
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'stores': self.stores,
+                'evictions': files['evictions'],
+                'entries': files['entries'],
+                'bytes': files['bytes'],
+            }
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Cache of rendered question fragments shared across exams and variants
+Author: Linh Dang Dev
+
+The same questions appear in many exams and in every variant of an exam.
+Their body XML (the question paragraph and one paragraph per answer) is
+kept with the question number and answer labels left out, so an exam that
+reuses a question, or shows its answers in another order, only assembles
+fragments already rendered. An entry is keyed by the question ID, a
+version computed from the question and answer content, and the render
+options that change the XML (showAnswers), so an edited question gets a
+new key instead of a stale fragment.
+
+Entries live in a bounded in-memory LRU and, with a cache directory, in
+<key>.json files shared by processes and kept under a byte budget by
+evicting the least recently used files (see disk_lru).
+"""
+
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from disk_lru import DiskLRU
+
+logger = logging.getLogger('fragment_cache')
+
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+DEFAULT_MEMORY_BYTES = 64 * 1024 * 1024
+
+# Bump when the body fragments change so entries from older code are not used
+FRAGMENT_VERSION = 1
+
+
+def content_version(question: Dict[str, Any]) -> str:
+    """Content a question renders from, as one string; answer order does not count"""
+    answers = sorted('\x1e'.join((str(answer['MaCauTraLoi']), answer['NoiDung'] or '',
+                                   '1' if answer['LaDapAn'] else '0'))
+                     for answer in question['answers'])
+    return '\x1f'.join([question['NoiDung'] or ''] + answers)
+
+
+def fragment_key(question_id: Any, version: str, **options: Any) -> str:
+    """Cache key of a question's fragments; options are the render options they depend on"""
+    # Computed for every question of every export, so kept to one cheap hash
+    payload = '\x1d'.join((str(FRAGMENT_VERSION), str(question_id).lower(),
+                           repr(sorted(options.items())), version))
+    return hashlib.blake2b(payload.encode('utf-8'), digest_size=20).hexdigest()
+
+
+def _entry_size(entry: Dict[str, Any]) -> int:
+    return sum(len(part) for part in entry['question']) + \
+        sum(len(answer_id) + len(part) for answer_id, parts in entry['answers'].items() for part in parts)
+
+
+class FragmentCache:
+    """Rendered question fragments in memory and, with cache_dir, on disk
+
+    An entry is {'question': [head, tail], 'answers': {MaCauTraLoi: [head, tail]}};
+    the question number goes between the question's parts and the answer
+    label between an answer's parts. A cache passed to a worker process is
+    reopened there with an empty memory tier.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, max_bytes: int = DEFAULT_MAX_BYTES,
+                 memory_bytes: int = DEFAULT_MEMORY_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        self._lock = threading.Lock()
+        self._memory: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self._memory_sizes: Dict[str, int] = {}
+        self._memory_total = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self._files = DiskLRU(cache_dir, max_bytes, suffix='.json') if cache_dir else None
+
+    def __getstate__(self):
+        return {'cache_dir': self.cache_dir, 'max_bytes': self.max_bytes,
+                'memory_bytes': self.memory_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def path_for(self, key: str) -> str:
+        return self._files.path_for(key)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the fragments for a key, or None on a miss"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return entry
+
+        entry = self._read(key) if self._files is not None else None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, entry)
+        return entry
+
+    def put(self, key: str, entry: Dict[str, Any]):
+        """Store the fragments of a question"""
+        with self._lock:
+            self._remember(key, entry)
+            self.stores += 1
+        if self._files is not None:
+            self._files.put(key, json.dumps(entry, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+    def stats(self) -> Dict[str, int]:
+        files = self._files.stats() if self._files is not None else {'entries': 0, 'bytes': 0, 'evictions': 0}
+        with self._lock:
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'stores': self.stores,
+                'evictions': files['evictions'],
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_total,
+                'entries': files['entries'],
+                'bytes': files['bytes'],
+            }
+
+    def _read(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._files.touch(key)
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return json.loads(f.read())
+        except FileNotFoundError:
+            # Evicted by another process sharing the directory
+            self._files.discard(key)
+        except ValueError as e:
+            logger.warning(f"Ignoring unreadable fragment cache entry {key}: {e}")
+        return None
+
+    def _remember(self, key: str, entry: Dict[str, Any]):
+        """Keep an entry in the memory tier; called with the lock held"""
+        size = _entry_size(entry)
+        if size > self.memory_bytes:
+            return
+        self._memory_total -= self._memory_sizes.get(key, 0)
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        self._memory_sizes[key] = size
+        self._memory_total += size
+        while self._memory_total > self.memory_bytes:
+            oldest, _ = self._memory.popitem(last=False)
+            self._memory_total -= self._memory_sizes.pop(oldest)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Tests for the disk LRU shared by the caches
+Author: Linh Dang Dev
+"""
+
+import sys
+import os
+import tempfile
+
+# Add the exporter directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from disk_lru import DiskLRU
+
+
+def test_eviction_order():
+    """Test that the least recently used entries are evicted first"""
+    with tempfile.TemporaryDirectory() as directory:
+        files = DiskLRU(directory, max_bytes=300, suffix='.bin')
+        for key in ('a', 'b', 'c'):
+            assert files.put(key, b'x' * 100) == []
+        assert files.touch('a') == os.path.join(directory, 'a.bin')
+
+        assert files.put('d', b'x' * 100) == ['b']
+        assert files.keys() == ['c', 'a', 'd']
+        assert files.touch('b') is None
+        assert not os.path.exists(os.path.join(directory, 'b.bin'))
+
+        # Replacing an entry counts its new size only
+        assert files.put('c', b'x' * 150) == ['a']
+        assert files.stats() == {'entries': 2, 'bytes': 250, 'evictions': 2}
+
+        # An entry larger than the budget is kept on its own
+        assert files.put('big', b'x' * 1000) == ['d', 'c']
+        assert files.keys() == ['big']
+
+
+def test_scan_and_missing_files():
+    """Test reopening a directory and entries removed behind the cache's back"""
+    with tempfile.TemporaryDirectory() as directory:
+        files = DiskLRU(directory, max_bytes=1000, suffix='.bin')
+        for key in ('a', 'b', 'c'):
+            files.put(key, key.encode() * 10)
+        # Recency survives a reopen through the files' modification times
+        os.utime(files.path_for('a'), ns=(3 * 10**18, 3 * 10**18))
+        os.utime(files.path_for('b'), ns=(1 * 10**18, 1 * 10**18))
+        os.utime(files.path_for('c'), ns=(2 * 10**18, 2 * 10**18))
+        os.mkdir(os.path.join(directory, 'index'))
+        with open(os.path.join(directory, 'partial.bin.tmp'), 'wb') as f:
+            f.write(b'x')
+        with open(os.path.join(directory, 'other.txt'), 'wb') as f:
+            f.write(b'x')
+
+        reopened = DiskLRU(directory, max_bytes=1000, suffix='.bin')
+        assert reopened.keys() == ['b', 'c', 'a']
+        assert reopened.stats()['bytes'] == 30
+
+        os.remove(reopened.path_for('c'))
+        assert reopened.touch('c') is None
+        assert reopened.keys() == ['b', 'a']
+        reopened.discard('b')
+        assert reopened.stats() == {'entries': 1, 'bytes': 10, 'evictions': 0}
+
+
+def main():
+    """Main test function"""
+    print("=== Disk LRU Test ===\n")
+
+    print("1. Testing eviction order...")
+    test_eviction_order()
+
+    print("\n" + "="*50)
+    print("2. Testing directory scan and missing files...")
+    test_scan_and_missing_files()
+
+    print("\n" + "="*50)
+    print("Test completed successfully!")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Tests for batch export of exams into a ZIP archive
+Author: Linh Dang Dev
+
+The exporter here serves exam data from memory instead of the database.
+"""
+
+import sys
+import os
+import io
+import json
+import zipfile
+
+# Add the exporter directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from docx import Document
+
+from exam_batch_export import export_exam_batch, member_name
+from exam_word_exporter import ExamWordExporter
+
+
+def _exam(exam_id, title, subject='Cơ sở dữ liệu', questions=2):
+    return {
+        'exam': {'MaDeThi': exam_id, 'TenDeThi': title, 'TenMonHoc': subject,
+                 'NgayTao': None, 'DaDuyet': True},
+        'questions': [{'MaCauHoi': f"{exam_id}-Q{i}", 'NoiDung': f"{title} câu {i}", 'MaCauHoiCha': None,
+                       'HoanVi': None,
+                       'answers': [{'MaCauTraLoi': f"{exam_id}-Q{i}-{j}", 'NoiDung': f"Đáp án {j}",
+                                    'LaDapAn': j == 0, 'HoanVi': None} for j in range(4)]}
+                      for i in range(1, questions + 1)],
+        'total_questions': questions
+    }
+
+
+class InMemoryExporter(ExamWordExporter):
+    """Exporter whose approved exams are held in memory"""
+
+    def __init__(self, exams):
+        super().__init__({})
+        self.exams = {str(exam_data['exam']['MaDeThi']).lower(): exam_data for exam_data in exams}
+
+    def get_exams_data(self, exam_ids):
+        return [self.exams[str(exam_id).lower()] for exam_id in exam_ids
+                if str(exam_id).lower() in self.exams]
+
+
+def _export(exporter, exam_ids, workers):
+    output = io.BytesIO()
+    result = export_exam_batch(exporter, exam_ids, {'showAnswers': False}, output, workers=workers)
+    return result, zipfile.ZipFile(io.BytesIO(output.getvalue()))
+
+
+def test_member_name():
+    """Test archive paths built from subject and title"""
+    exam_info = {'MaDeThi': 'ABCDEF12-3456', 'TenDeThi': 'Đề 1: phần A/B', 'TenMonHoc': 'Toán*'}
+    assert member_name(exam_info) == 'Toán/Đề 1_ phần A_B_ABCDEF12.docx'
+    assert member_name({'MaDeThi': 'X', 'TenDeThi': ' .. ', 'TenMonHoc': None}) == 'Khac/De_thi_X.docx'
+
+
+def test_batch_zip_contents():
+    """Test the documents and manifest of a batch archive"""
+    exporter = InMemoryExporter([
+        _exam('AAAA0001-1', 'Giữa kỳ'),
+        _exam('BBBB0002-1', 'Cuối kỳ', questions=3),
+        # Same subject, title and ID prefix: the second name gets the full ID
+        _exam('BBBB0002-2', 'Cuối kỳ', questions=1),
+    ])
+    exam_ids = ['AAAA0001-1', 'bbbb0002-1', 'MISSING', 'BBBB0002-2', 'aaaa0001-1']
+
+    for workers in (1, 2):
+        result, archive = _export(exporter, exam_ids, workers)
+        print(f"Batch result ({workers} workers): {result['message']}")
+        assert result['success'] and result['exported'] == 3
+        assert result['total_questions'] == 6
+        assert [entry['exam_id'] for entry in result['failed']] == ['MISSING']
+
+        names = archive.namelist()
+        assert names == ['Cơ sở dữ liệu/Giữa kỳ_AAAA0001.docx',
+                         'Cơ sở dữ liệu/Cuối kỳ_BBBB0002.docx',
+                         'Cơ sở dữ liệu/Cuối kỳ_BBBB0002_BBBB0002-2.docx',
+                         'manifest.json']
+        assert archive.getinfo(names[0]).compress_type == zipfile.ZIP_STORED
+
+        manifest = json.loads(archive.read('manifest.json'))
+        assert [entry['exam_id'] for entry in manifest] == ['MISSING', 'AAAA0001-1', 'BBBB0002-1',
+                                                            'BBBB0002-2']
+        for entry in manifest[1:]:
+            assert entry['success'] and entry['size'] == archive.getinfo(entry['file']).file_size
+            text = '\n'.join(p.text for p in Document(io.BytesIO(archive.read(entry['file']))).paragraphs)
+            assert f"{entry['title']} câu 1" in text
+
+
+def test_batch_render_failure():
+    """Test that an exam that fails to render is recorded without stopping the batch"""
+    broken = _exam('CCCC0003-1', 'Hỏng')
+    del broken['questions'][0]['answers']
+    exporter = InMemoryExporter([broken, _exam('DDDD0004-1', 'Tốt')])
+
+    result, archive = _export(exporter, ['CCCC0003-1', 'DDDD0004-1'], 1)
+    assert result['success'] and result['exported'] == 1
+    assert [entry['exam_id'] for entry in result['failed']] == ['CCCC0003-1']
+    assert archive.namelist() == ['Cơ sở dữ liệu/Tốt_DDDD0004.docx', 'manifest.json']
+
+
+def main():
+    """Main test function"""
+    print("=== Batch Export Test ===\n")
+
+    print("1. Testing archive member names...")
+    test_member_name()
+
+    print("\n" + "="*50)
+    print("2. Testing batch archive contents...")
+    test_batch_zip_contents()
+
+    print("\n" + "="*50)
+    print("3. Testing render failures...")
+    test_batch_render_failure()
+
+    print("\n" + "="*50)
+    print("Test completed successfully!")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Tests for fetching exam images
+Author: Linh Dang Dev
+
+HTTP fetches go to a server on 127.0.0.1 started by the test.
+"""
+
+import sys
+import os
+import struct
+import tempfile
+import threading
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Add the exporter directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import exam_media
+from exam_media import HttpMediaStorage, ImageCache, LocalMediaStorage, find_image_references
+
+
+def _png(width, height, shade=0):
+    """A grayscale PNG built without Pillow"""
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    rows = b''.join(b'\x00' + bytes([shade]) * width for _ in range(height))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(rows)) + chunk(b'IEND', b''))
+
+
+def test_find_image_references():
+    """Test reading img tags and [IMAGE: ...] markers from content"""
+    text = 'Xem <img alt="x" src=" https://cdn.example/images/a.png "> và [IMAGE: b.webp] rồi trả lời'
+    assert find_image_references(text) == ['https://cdn.example/images/a.png', 'b.webp']
+    assert find_image_references(None) == []
+
+
+def test_local_storage_stays_in_root():
+    """Test that references cannot climb out of the local media directory"""
+    with tempfile.TemporaryDirectory() as work_dir:
+        root = os.path.join(work_dir, 'media')
+        os.makedirs(os.path.join(root, 'images'))
+        with open(os.path.join(root, 'images', 'fig.png'), 'wb') as f:
+            f.write(_png(2, 2))
+        with open(os.path.join(work_dir, 'secret.png'), 'wb') as f:
+            f.write(_png(2, 2))
+        storage = LocalMediaStorage(root)
+
+        expected = os.path.join(root, 'images', 'fig.png')
+        assert storage.locate('images/fig.png') == expected
+        assert storage.locate('https://cdn.example/images/fig.png') == expected
+        # Bare file names are looked up at the top of the directory
+        assert storage.locate('fig.png') is None
+
+        for reference in ('../secret.png', '/../secret.png', 'images/../../secret.png',
+                          '..%2fsecret.png', os.path.join(work_dir, 'secret.png'), 'missing.png'):
+            assert storage.locate(reference) is None, reference
+
+
+def test_http_storage_origins():
+    """Test that only the storage's origins and paths are fetched"""
+    storage = HttpMediaStorage('https://bucket.sgp1.digitaloceanspaces.com/images',
+                               extra_origins=['cdn.example.com'])
+
+    assert storage.locate('fig.png') == 'https://bucket.sgp1.digitaloceanspaces.com/images/fig.png'
+    assert storage.locate('sub/hình 1.png') == \
+        'https://bucket.sgp1.digitaloceanspaces.com/images/sub/h%C3%ACnh%201.png'
+    assert storage.locate('https://cdn.example.com/images/a.png') == 'https://cdn.example.com/images/a.png'
+    assert storage.locate('https://BUCKET.sgp1.digitaloceanspaces.com:443/x.png') is not None
+
+    for reference in ('../private/key.png', 'a/../../private.png', '%2e%2e/private.png',
+                      'http://169.254.169.254/latest/meta-data', 'https://evil.example/a.png',
+                      'https://cdn.example.com:8443/a.png', 'http://cdn.example.com/a.png',
+                      '//evil.example/a.png', 'file:///etc/passwd', 'data:image/png;base64,AAAA'):
+        assert storage.locate(reference) is None, reference
+
+    try:
+        storage.fetch('http://127.0.0.1:1/a.png')
+    except ValueError as e:
+        print(f"Refused fetch: {e}")
+    else:
+        raise AssertionError("Expected ValueError for a URL outside the storage")
+
+
+class _ImageHandler(BaseHTTPRequestHandler):
+    image = _png(4, 4, 200)
+
+    def do_GET(self):
+        port = self.server.server_address[1]
+        if self.path == '/images/fig.png':
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(self.image)
+            return
+        redirects = {
+            '/images/moved.png': '/images/fig.png',
+            # Same port, other host name: another origin
+            '/images/away.png': f"http://localhost:{port}/images/fig.png",
+        }
+        if self.path in redirects:
+            self.send_response(302)
+            self.send_header('Location', redirects[self.path])
+            self.end_headers()
+            return
+        self.send_response(404)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_image_cache_over_http():
+    """Test fetching through the cache, redirects included, and sharing images by content"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _ImageHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        storage = HttpMediaStorage(f"http://127.0.0.1:{server.server_address[1]}/images/", timeout=5)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = ImageCache(cache_dir, storage, workers=2)
+            paths = cache.get_many(['fig.png', 'moved.png', 'away.png', 'missing.png'])
+
+            assert paths['fig.png'] is not None and paths['moved.png'] == paths['fig.png']
+            assert paths['away.png'] is None and paths['missing.png'] is None
+            with open(paths['fig.png'], 'rb') as f:
+                assert f.read() == _ImageHandler.image
+
+            stats = cache.stats()
+            print(f"Image cache stats: {stats}")
+            assert (stats['fetches'], stats['failures'], stats['entries']) == (2, 2, 1)
+
+            # URLs and prepared images are found again after a restart
+            reopened = ImageCache(cache_dir, storage)
+            assert reopened.get('fig.png') == paths['fig.png']
+            assert reopened.stats()['hits'] == 1 and reopened.stats()['fetches'] == 0
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_image_cache_eviction():
+    """Test that evicted images are fetched again"""
+    with tempfile.TemporaryDirectory() as work_dir:
+        media_dir = os.path.join(work_dir, 'media')
+        os.makedirs(media_dir)
+        images = [_png(8, 8, i) for i in range(3)]
+        for i, image in enumerate(images):
+            with open(os.path.join(media_dir, f"{i}.png"), 'wb') as f:
+                f.write(image)
+        size = max(len(image) for image in images)
+
+        cache = ImageCache(os.path.join(work_dir, 'cache'), LocalMediaStorage(media_dir),
+                           max_bytes=2 * size, workers=1)
+        first = cache.get('0.png')
+        cache.get('1.png')
+        cache.get('2.png')
+        assert not os.path.exists(first)
+        assert cache.stats()['entries'] == 2
+
+        assert cache.get('0.png') == first and os.path.exists(first)
+        assert cache.stats()['fetches'] == 4
+
+
+class DictStorage:
+    """Storage serving images from a dict; other references fail to fetch"""
+
+    def __init__(self, images):
+        self.images = images
+
+    def locate(self, reference):
+        return reference
+
+    def fetch(self, location):
+        return self.images[location]
+
+
+def test_failed_fetches_bounded():
+    """Test that failed fetches are retried after a while and kept to a bound"""
+    max_failed, retry = exam_media.MAX_FAILED, exam_media.FAILED_RETRY_SECONDS
+    exam_media.MAX_FAILED = 2
+    try:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            images = {}
+            cache = ImageCache(cache_dir, DictStorage(images), workers=1)
+
+            for name in ('a.png', 'b.png', 'c.png', 'a.png', 'c.png'):
+                assert cache.get(name) is None
+            # a.png was forgotten when c.png failed, so it was fetched again
+            assert cache.stats()['failures'] == 4 and len(cache._failed) == 2
+
+            # A failed image that appears is fetched once the failure expires
+            images['c.png'] = _png(2, 2)
+            assert cache.get('c.png') is None
+            exam_media.FAILED_RETRY_SECONDS = 0
+            assert cache.get('c.png') is not None
+            assert (cache.stats()['failures'], cache.stats()['fetches']) == (4, 1)
+    finally:
+        exam_media.MAX_FAILED, exam_media.FAILED_RETRY_SECONDS = max_failed, retry
+
+
+def main():
+    """Main test function"""
+    print("=== Exam Media Test ===\n")
+
+    print("1. Testing image references...")
+    test_find_image_references()
+
+    print("\n" + "="*50)
+    print("2. Testing local storage paths...")
+    test_local_storage_stays_in_root()
+
+    print("\n" + "="*50)
+    print("3. Testing HTTP storage origins...")
+    test_http_storage_origins()
+
+    print("\n" + "="*50)
+    print("4. Testing the image cache over HTTP...")
+    test_image_cache_over_http()
+
+    print("\n" + "="*50)
+    print("5. Testing image cache eviction...")
+    test_image_cache_eviction()
+    test_failed_fetches_bounded()
+
+    print("\n" + "="*50)
+    print("Test completed successfully!")
+
+
+if __name__ == '__main__':
+    main()
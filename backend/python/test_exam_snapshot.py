@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Tests for exporting exam snapshots
+Author: Linh Dang Dev
+
+A snapshot carries the exam data, so these exports need no database
+connection or ODBC driver.
+"""
+
+import sys
+import os
+import copy
+import io
+import json
+import tempfile
+import zipfile
+
+# Add the exporter directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from docx import Document
+
+from exam_snapshot import exam_data_from_snapshot, parse_snapshot, snapshot_marker
+from exam_word_exporter import ExamWordExporter
+from export_cache import ExportCache
+
+
+def _sample_snapshot():
+    return {
+        'exam': {'MaDeThi': 'E1', 'TenDeThi': 'Đề kiểm tra', 'NgayTao': '2024-05-01T00:00:00',
+                 'MonHoc': {'TenMonHoc': 'Toán rời rạc'}},
+        # Out of order on purpose: ThuTu (or order) decides the exam order
+        'questions': [
+            {'MaCauHoi': f"Q{i}", 'NoiDung': f"Câu hỏi số {i}", 'ThuTu': i,
+             'CauTraLoi': [{'MaCauTraLoi': f"Q{i}-{j}", 'NoiDung': f"Lựa chọn {i}.{j}",
+                            'LaDapAn': j == 1, 'ThuTu': 4 - j} for j in range(4)]}
+            for i in (3, 1, 2)
+        ]
+    }
+
+
+def _document_text(data):
+    return '\n'.join(paragraph.text for paragraph in Document(io.BytesIO(data)).paragraphs)
+
+
+def test_snapshot_to_exam_data():
+    """Test decoding a snapshot into the exam data get_exam_data returns"""
+    raw = json.dumps(_sample_snapshot(), ensure_ascii=False).encode('utf-8-sig')
+    exam_data = exam_data_from_snapshot(parse_snapshot(raw))
+
+    assert exam_data['exam']['MaDeThi'] == 'E1'
+    assert exam_data['exam']['TenMonHoc'] == 'Toán rời rạc'
+    assert exam_data['total_questions'] == 3
+    assert [question['MaCauHoi'] for question in exam_data['questions']] == ['Q1', 'Q2', 'Q3']
+    answers = exam_data['questions'][0]['answers']
+    assert [answer['MaCauTraLoi'] for answer in answers] == ['Q1-3', 'Q1-2', 'Q1-1', 'Q1-0']
+    assert [answer['LaDapAn'] for answer in answers] == [False, False, True, False]
+
+    for broken in ({}, {'exam': {}}, {'exam': {}, 'questions': [{'NoiDung': 'x'}]}):
+        try:
+            exam_data_from_snapshot(broken)
+        except ValueError as e:
+            print(f"Rejected snapshot: {e}")
+        else:
+            raise AssertionError(f"Expected ValueError for {broken!r}")
+
+
+def test_snapshot_export_round_trip():
+    """Test exporting a snapshot without a database, then serving it from the cache"""
+    exam_data = exam_data_from_snapshot(_sample_snapshot())
+    options = {'showAnswers': True, 'semester': 'Học kỳ 2'}
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        cache = ExportCache(os.path.join(work_dir, 'cache'))
+        # No db_config: a connection attempt would fail the export
+        exporter = ExamWordExporter({}, cache=cache)
+
+        output_path = os.path.join(work_dir, 'de_thi.docx')
+        result = exporter.export_exam_to_word('E1', options, output_path, exam_data=exam_data)
+        assert result['success'], result['message']
+        assert not result['cached'] and result['total_questions'] == 3
+        assert result['rows'] == {'exams': 1, 'questions': 3, 'answers': 12}
+        with open(output_path, 'rb') as f:
+            data = f.read()
+        text = _document_text(data)
+        assert text.index('Câu hỏi số 1') < text.index('Câu hỏi số 2') < text.index('Câu hỏi số 3')
+        assert 'Lựa chọn 2.1' in text
+
+        stream = io.BytesIO()
+        result = exporter.export_exam_to_word('E1', options, output_stream=stream,
+                                              exam_data=copy.deepcopy(exam_data))
+        assert result['success'] and result['cached'] and result['file_path'] is None
+        assert stream.getvalue() == data
+
+        edited = copy.deepcopy(exam_data)
+        edited['questions'][1]['NoiDung'] = 'Câu hỏi đã sửa'
+        assert snapshot_marker(edited) != snapshot_marker(exam_data)
+        stream = io.BytesIO()
+        result = exporter.export_exam_to_word('E1', options, output_stream=stream, exam_data=edited)
+        assert result['success'] and not result['cached']
+        assert 'Câu hỏi đã sửa' in _document_text(stream.getvalue())
+        assert cache.stats()['entries'] == 2
+
+
+def test_snapshot_variant_export():
+    """Test exporting variants of a snapshot without a database"""
+    exam_data = exam_data_from_snapshot(_sample_snapshot())
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        result = ExamWordExporter({}).export_exam_variants(
+            'E1', {'variantCodes': ['11', '12']}, None, output_dir, workers=1, exam_data=exam_data)
+        assert result['success'], result['message']
+        assert [variant['code'] for variant in result['variants']] == ['11', '12']
+        for variant in result['variants']:
+            assert zipfile.is_zipfile(variant['file_path'])
+        with open(result['answer_matrix_path'], encoding='utf-8') as f:
+            assert json.load(f)['codes'] == ['11', '12']
+
+        result = ExamWordExporter({}).export_exam_variants(
+            'E1', {'variantCodes': ['11', '12']}, 3, output_dir, workers=1, exam_data=exam_data)
+        assert not result['success'] and result['variants'] == []
+
+
+def main():
+    """Main test function"""
+    print("=== Exam Snapshot Test ===\n")
+
+    print("1. Testing snapshot decoding...")
+    test_snapshot_to_exam_data()
+
+    print("\n" + "="*50)
+    print("2. Testing snapshot export round trip...")
+    test_snapshot_export_round_trip()
+
+    print("\n" + "="*50)
+    print("3. Testing snapshot variant export...")
+    test_snapshot_variant_export()
+
+    print("\n" + "="*50)
+    print("Test completed successfully!")
+
+
+if __name__ == '__main__':
+    main()
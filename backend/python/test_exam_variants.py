@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Tests for exam variants (mã đề)
+Author: Linh Dang Dev
+
+Runs without a database: variants are computed from exam data built here.
+"""
+
+import sys
+import os
+import csv
+import json
+import tempfile
+
+# Add the exporter directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from exam_variants import (answer_key_matrix, apply_variant, make_variant, make_variants,
+                           question_blocks, resolve_variant_codes, variant_codes, write_answer_key)
+
+
+def _question(question_id, parent=None, shuffled=None, answers=4, correct=0):
+    return {
+        'MaCauHoi': question_id,
+        'NoiDung': f"Nội dung {question_id}",
+        'MaCauHoiCha': parent,
+        'HoanVi': shuffled,
+        'answers': [{'MaCauTraLoi': f"{question_id}-{j}", 'NoiDung': f"Đáp án {j}",
+                     'LaDapAn': j == correct, 'HoanVi': None}
+                    for j in range(answers)]
+    }
+
+
+def _sample_questions():
+    return [_question(f"Q{i}", correct=i % 4) for i in range(12)]
+
+
+def test_variants_are_deterministic():
+    """Test that a seed and a code always give the same variant"""
+    questions = _sample_questions()
+    codes = variant_codes(4)
+    assert codes == ['101', '102', '103', '104']
+
+    first = make_variants(questions, codes, seed='exam-1')
+    again = make_variants(questions, codes, seed='exam-1')
+    assert first == again
+    # A variant does not depend on the other variants generated with it
+    assert make_variant(questions, '103', 'exam-1') == first[2]
+
+    orders = {tuple(variant.question_order) for variant in first}
+    assert len(orders) == len(codes)
+    assert make_variants(questions, codes, seed='exam-2') != first
+
+    for variant in first:
+        assert sorted(variant.question_order) == list(range(len(questions)))
+        assert all(sorted(order) == [0, 1, 2, 3] for order in variant.answer_orders)
+    print(f"Question orders: {[variant.question_order for variant in first]}")
+
+
+def test_group_blocks():
+    """Test that a group moves as one block even when split in the canonical order"""
+    questions = [
+        _question('P'),
+        _question('C1', parent='P'),
+        _question('S1'),
+        _question('C2', parent='p'),  # GUIDs compare case-insensitively
+        _question('S2'),
+        _question('D1', parent='X'),  # parent not part of the exam
+        _question('D2', parent='X'),
+    ]
+    blocks = question_blocks(questions)
+    assert blocks == [[0, 1, 3], [2], [4], [5, 6]]
+
+    for variant in make_variants(questions, variant_codes(10), seed=7):
+        order = variant.question_order
+        start = order.index(0)
+        assert order[start:start + 3] == [0, 1, 3]
+        start = order.index(5)
+        assert order[start:start + 2] == [5, 6]
+
+
+def test_fixed_questions_and_answers():
+    """Test that HoanVi = 0 keeps questions and answers in place"""
+    questions = _sample_questions()
+    questions[0]['HoanVi'] = False
+    questions[5]['HoanVi'] = 0
+    for answer in questions[3]['answers']:
+        answer['HoanVi'] = False
+    questions[4]['answers'][3]['HoanVi'] = False
+
+    for variant in make_variants(questions, variant_codes(10), seed='fixed'):
+        assert variant.question_order[0] == 0
+        assert variant.question_order[5] == 5
+        position = variant.question_order.index(3)
+        assert variant.answer_orders[position] == [0, 1, 2, 3]
+        position = variant.question_order.index(4)
+        assert variant.answer_orders[position][3] == 3
+
+
+def test_answer_key_matrix():
+    """Test that the answer key maps every variant back to the canonical exam"""
+    questions = _sample_questions()
+    questions[7]['answers'][2]['LaDapAn'] = True  # two correct answers
+    variants = make_variants(questions, ['201', '202', '203'], seed='key')
+    matrix = answer_key_matrix(questions, variants)
+
+    assert matrix['codes'] == ['201', '202', '203']
+    assert matrix['questions'][7]['correct'] == ['C', 'D']
+
+    for variant, key in zip(variants, matrix['variants']):
+        printed = apply_variant(questions, variant)
+        assert key['code'] == variant.code
+        for position, (question, entry) in enumerate(zip(printed, key['questions'])):
+            assert entry['number'] == position + 1
+            assert questions[entry['canonical'] - 1]['MaCauHoi'] == question['MaCauHoi']
+            # Printed correct labels are the labels of the correct printed answers
+            assert entry['correct'] == [chr(65 + k) for k, answer in enumerate(question['answers'])
+                                        if answer['LaDapAn']]
+            # Mapping the printed labels back gives the canonical correct labels
+            canonical = matrix['questions'][entry['canonical'] - 1]['correct']
+            assert sorted(entry['labels'][label] for label in entry['correct']) == canonical
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        csv_path = os.path.join(output_dir, 'dap_an.csv')
+        json_path = os.path.join(output_dir, 'dap_an.json')
+        write_answer_key(matrix, csv_path, json_path)
+        with open(csv_path, encoding='utf-8-sig', newline='') as f:
+            rows = list(csv.reader(f))
+        assert rows[0] == ['Câu', 'Mã đề 201', 'Mã đề 202', 'Mã đề 203']
+        assert len(rows) == len(questions) + 1
+        assert rows[1][1] == ','.join(matrix['variants'][0]['questions'][0]['correct'])
+        with open(json_path, encoding='utf-8') as f:
+            assert json.load(f) == matrix
+
+
+def test_resolve_variant_codes():
+    """Test that variant count and codes must agree"""
+    assert resolve_variant_codes(3) == ['101', '102', '103']
+    assert resolve_variant_codes(None, [301, '302']) == ['301', '302']
+    assert resolve_variant_codes(2, ['A', 'B']) == ['A', 'B']
+
+    for count, codes in ((0, None), (None, None), (3, ['A', 'B']), (None, ['A', 'A'])):
+        try:
+            resolve_variant_codes(count, codes)
+        except ValueError as e:
+            print(f"Rejected {count!r}, {codes!r}: {e}")
+        else:
+            raise AssertionError(f"Expected ValueError for {count!r}, {codes!r}")
+
+
+def main():
+    """Main test function"""
+    print("=== Exam Variants Test ===\n")
+
+    print("1. Testing deterministic variants...")
+    test_variants_are_deterministic()
+
+    print("\n" + "="*50)
+    print("2. Testing group blocks...")
+    test_group_blocks()
+
+    print("\n" + "="*50)
+    print("3. Testing fixed questions and answers...")
+    test_fixed_questions_and_answers()
+
+    print("\n" + "="*50)
+    print("4. Testing the answer-key matrix...")
+    test_answer_key_matrix()
+
+    print("\n" + "="*50)
+    print("5. Testing variant codes...")
+    test_resolve_variant_codes()
+
+    print("\n" + "="*50)
+    print("Test completed successfully!")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Tests for loading exam data in ExamWordExporter
+Author: Linh Dang Dev
+
+The exporter runs against a fake cursor that answers the three set-based
+queries (exams, questions, answers) from rows held in memory.
+"""
+
+import sys
+import os
+import subprocess
+from datetime import datetime
+
+# Add the exporter directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import exam_word_exporter
+from exam_word_exporter import DEFAULT_EXAM_DURATION, ExamWordExporter, default_academic_year
+
+# MaDeThi -> (TenDeThi, DaDuyet, [MaCauHoi in exam order])
+EXAMS = {
+    'E1': ('Đề 1', True, ['Q1', 'Q2']),
+    'E2': ('Đề 2', True, ['Q2', 'Q3']),
+    'E3': ('Đề 3', False, ['Q1']),
+    'E4': ('Đề 4', True, ['Q4']),
+    'E5': ('Đề 5', True, []),
+}
+ANSWERS = {question_id: [(f"{question_id}-{k}", f"Đáp án {k}", k == 1, k, True) for k in (3, 1, 2)]
+           for question_id in ('Q1', 'Q2', 'Q3', 'Q4')}
+
+
+class FakeCursor:
+    """Answers the exporter's queries; exam rows come back in reverse to test ordering"""
+
+    def __init__(self, queries):
+        self.queries = queries
+        self.rows = []
+
+    def execute(self, query, params):
+        ids = [str(exam_id).upper() for exam_id in params]
+        self.queries.append((' '.join(query.split()), list(params)))
+        if 'FROM DeThi' in query:
+            self.rows = [(exam_id, title, None, approved, 'Môn học')
+                         for exam_id, (title, approved, _) in EXAMS.items()
+                         if exam_id in ids and approved]
+            self.rows.reverse()
+        elif 'FROM CauTraLoi' in query:
+            in_exams = {question_id for exam_id in ids if exam_id in EXAMS
+                        for question_id in EXAMS[exam_id][2]}
+            self.rows = [(question_id,) + answer for question_id in sorted(in_exams)
+                         for answer in sorted(ANSWERS[question_id], key=lambda answer: answer[3])]
+        else:
+            self.rows = [(exam_id, question_id, f"Nội dung {question_id}", None, None, position, None, True)
+                         for exam_id in sorted(ids) if exam_id in EXAMS
+                         for position, question_id in enumerate(EXAMS[exam_id][2], 1)]
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeConnection:
+    def __init__(self):
+        self.queries = []
+
+    def cursor(self):
+        return FakeCursor(self.queries)
+
+
+def test_set_based_exam_loading():
+    """Test chunking, three queries per chunk, answer grouping and exam order"""
+    connection = FakeConnection()
+    exporter = ExamWordExporter({}, connection=connection)
+    chunk = exam_word_exporter.BATCH_QUERY_CHUNK
+    exam_word_exporter.BATCH_QUERY_CHUNK = 2
+    try:
+        # Duplicates compare case-insensitively; E3 is not approved, MISSING does not exist
+        exams = exporter.get_exams_data(['E4', 'e1', 'E3', 'E1', 'MISSING', 'E2', 'E5'])
+    finally:
+        exam_word_exporter.BATCH_QUERY_CHUNK = chunk
+
+    assert [exam_data['exam']['MaDeThi'] for exam_data in exams] == ['E4', 'E1', 'E2', 'E5']
+
+    # Chunks [E4, e1], [E3, MISSING], [E2, E5]; a chunk without approved exams stops after one query
+    params = [query_params for _, query_params in connection.queries]
+    assert params == [['E4', 'e1']] * 3 + [['E3', 'MISSING']] + [['E2', 'E5']] * 3
+    kinds = [query.split(' FROM ')[1].split()[0] for query, _ in connection.queries]
+    assert kinds == ['DeThi', 'ChiTietDeThi', 'CauTraLoi', 'DeThi', 'DeThi', 'ChiTietDeThi', 'CauTraLoi']
+    assert all('IN (?, ?)' in query for query, _ in connection.queries)
+
+    by_id = {exam_data['exam']['MaDeThi']: exam_data for exam_data in exams}
+    assert [(q['MaCauHoi'], q['ThuTu']) for q in by_id['E1']['questions']] == [('Q1', 1), ('Q2', 2)]
+    assert [q['MaCauHoi'] for q in by_id['E2']['questions']] == ['Q2', 'Q3']
+    assert by_id['E5']['questions'] == [] and by_id['E5']['total_questions'] == 0
+    assert by_id['E2']['total_questions'] == 2
+
+    # Every question gets its own answers, in the order the query returned them
+    for exam_data in exams:
+        for question in exam_data['questions']:
+            answers = question['answers']
+            assert [answer['MaCauTraLoi'] for answer in answers] == \
+                [f"{question['MaCauHoi']}-{k}" for k in (1, 2, 3)]
+            assert [answer['LaDapAn'] for answer in answers] == [True, False, False]
+
+    # A question in two exams gets equal but separate answer lists
+    q2_e1 = next(q for q in by_id['E1']['questions'] if q['MaCauHoi'] == 'Q2')
+    q2_e2 = next(q for q in by_id['E2']['questions'] if q['MaCauHoi'] == 'Q2')
+    assert q2_e1['answers'] == q2_e2['answers'] and q2_e1['answers'] is not q2_e2['answers']
+
+    summary = exporter.timings.summary()
+    assert summary['rows'] == {'exams': 4, 'questions': 5, 'answers': 15}
+    # The process peak comes with the part of it this export added
+    if summary['process_peak_rss_mb'] is not None:
+        assert 0 <= summary['peak_rss_growth_mb'] <= summary['process_peak_rss_mb']
+
+
+def test_get_exam_data_single_exam():
+    """Test that get_exam_data loads one exam and rejects unapproved ones"""
+    connection = FakeConnection()
+    exporter = ExamWordExporter({}, connection=connection)
+    exam_data = exporter.get_exam_data('E2')
+    assert exam_data['exam']['TenDeThi'] == 'Đề 2' and exam_data['total_questions'] == 2
+    assert len(connection.queries) == 3
+
+    try:
+        exporter.get_exam_data('E3')
+    except Exception as e:
+        print(f"Rejected exam: {e}")
+    else:
+        raise AssertionError("Expected an error for an unapproved exam")
+
+
+def test_template_value_defaults():
+    """Test the header defaults, the academic year following the current date"""
+    assert default_academic_year(datetime(2025, 7, 31)) == '2024-2025'
+    assert default_academic_year(datetime(2025, 8, 1)) == '2025-2026'
+
+    exporter = ExamWordExporter({})
+    values = exporter.template_values({'TenMonHoc': 'Toán'}, {'semester': 'Học kỳ 2'})
+    assert values['academic_year'] == default_academic_year()
+    assert values['duration'] == DEFAULT_EXAM_DURATION
+    assert (values['semester'], values['subject']) == ('2', 'Toán')
+
+    values = exporter.template_values({'TenMonHoc': 'Toán'}, {'academicYear': '2023-2024', 'duration': '60 phút'})
+    assert (values['academic_year'], values['duration']) == ('2023-2024', '60 phút')
+
+
+def test_log_fd_not_used_for_output():
+    """Test that stderr, which carries the log, is refused for the status and document"""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'exam_word_exporter.py')
+    for args in (['--docx-fd', '1', '--status-fd', '2'], ['--docx-fd', '2', '--status-fd', '5'],
+                 ['--serve', '--docx-fd', '2']):
+        command = [sys.executable, script] + (args if args[0] == '--serve' else ['E1', '{}'] + args)
+        completed = subprocess.run(command, stdin=subprocess.DEVNULL, capture_output=True, text=True)
+        assert completed.returncode == 2 and 'log messages are written to stderr' in completed.stderr, args
+
+
+def main():
+    """Main test function"""
+    print("=== Exam Data Loading Test ===\n")
+
+    print("1. Testing set-based exam loading...")
+    test_set_based_exam_loading()
+
+    print("\n" + "="*50)
+    print("2. Testing single exam loading...")
+    test_get_exam_data_single_exam()
+
+    print("\n" + "="*50)
+    print("3. Testing template value defaults...")
+    test_template_value_defaults()
+
+    print("\n" + "="*50)
+    print("4. Testing output descriptors...")
+    test_log_fd_not_used_for_output()
+
+    print("\n" + "="*50)
+    print("Test completed successfully!")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Tests for the export cache
+Author: Linh Dang Dev
+"""
+
+import sys
+import os
+import io
+import tempfile
+import zipfile
+from datetime import datetime
+
+# Add the exporter directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from export_cache import ExportCache, export_key, normalize_options
+import exam_word_exporter
+from exam_word_exporter import ExamWordExporter
+
+
+def test_export_key_invalidation():
+    """Test that every input that changes the document changes the key"""
+    options = {'showAnswers': True, 'semester': '2', 'examCode': '101'}
+    key = export_key('E1', options, 'marker-1', template='t1', media=True)
+
+    # Same inputs, same key; exam IDs compare case-insensitively
+    assert export_key('e1', dict(options), 'marker-1', template='t1', media=True) == key
+    # Options that render the same as a missing option do not split the cache
+    assert export_key('E1', dict(options, outputPath='/tmp/x.docx', allowMaterials=False,
+                                 academicYear=None, course=''),
+                      'marker-1', template='t1', media=True) == key
+    assert normalize_options({'a': {'b': None}, 'c': 0}) == {'c': 0}
+
+    changed = [
+        export_key('E2', options, 'marker-1', template='t1', media=True),
+        export_key('E1', dict(options, showAnswers=False), 'marker-1', template='t1', media=True),
+        export_key('E1', dict(options, examCode='102'), 'marker-1', template='t1', media=True),
+        export_key('E1', options, 'marker-2', template='t1', media=True),
+        export_key('E1', options, 'marker-1', template='t2', media=True),
+        export_key('E1', options, 'marker-1', template='t1', media=False),
+    ]
+    assert len(set(changed + [key])) == len(changed) + 1
+
+
+def test_export_cache_store_and_evict():
+    """Test hits, misses and least-recently-used eviction of documents"""
+    with tempfile.TemporaryDirectory() as work_dir:
+        cache_dir = os.path.join(work_dir, 'cache')
+        cache = ExportCache(cache_dir, max_bytes=250)
+        assert cache.read('a') is None
+
+        for key in ('a', 'b'):
+            cache.put(key, key.encode() * 100)
+        assert cache.read('a') == b'a' * 100  # 'a' is now the most recently used
+        cache.put('c', b'c' * 100)
+
+        assert cache.get('b') is None
+        output_path = os.path.join(work_dir, 'out.docx')
+        assert cache.copy_to('a', output_path)
+        with open(output_path, 'rb') as f:
+            assert f.read() == b'a' * 100
+        assert sorted(os.listdir(cache_dir)) == ['a.docx', 'c.docx']
+
+        stats = cache.stats()
+        print(f"Cache stats: {stats}")
+        assert (stats['hits'], stats['misses'], stats['stores']) == (2, 2, 3)
+        assert (stats['evictions'], stats['entries'], stats['bytes']) == (1, 2, 200)
+
+        # A reopened cache finds the documents left on disk
+        reopened = ExportCache(cache_dir, max_bytes=250)
+        assert reopened.stats()['entries'] == 2
+        assert reopened.read('c') == b'c' * 100
+
+
+def test_removed_document_is_a_miss():
+    """Test that a document removed behind the cache's back counts as a miss"""
+    with tempfile.TemporaryDirectory() as work_dir:
+        cache = ExportCache(os.path.join(work_dir, 'cache'))
+        cache.put('a', b'a' * 10)
+        os.remove(cache.path_for('a'))
+
+        assert cache.read('a') is None
+        assert not cache.copy_to('a', os.path.join(work_dir, 'out.docx'))
+        stats = cache.stats()
+        assert (stats['hits'], stats['misses']) == (0, 2)
+
+
+class FixedDatetime(datetime):
+    today_value = datetime(2025, 6, 1)
+
+    @classmethod
+    def now(cls, tz=None):
+        return cls.today_value
+
+
+def test_defaulted_exam_date_in_key():
+    """Test that a document with a defaulted exam date is not served on another day"""
+    exam_data = {
+        'exam': {'MaDeThi': 'E1', 'TenDeThi': 'Đề 1', 'TenMonHoc': 'Toán', 'NgayTao': None, 'DaDuyet': True},
+        'questions': [{'MaCauHoi': 'Q1', 'NoiDung': 'Câu hỏi', 'MaCauHoiCha': None, 'HoanVi': None,
+                       'answers': [{'MaCauTraLoi': 'A1', 'NoiDung': 'Đáp án', 'LaDapAn': True,
+                                    'HoanVi': None}]}],
+        'total_questions': 1
+    }
+    with tempfile.TemporaryDirectory() as cache_dir:
+        exporter = ExamWordExporter({}, cache=ExportCache(cache_dir))
+
+        def export(options):
+            output = io.BytesIO()
+            result = exporter.export_exam_to_word('E1', options, output_stream=output, exam_data=exam_data)
+            assert result['success'], result['message']
+            return result['cached'], output.getvalue()
+
+        original = exam_word_exporter.datetime
+        exam_word_exporter.datetime = FixedDatetime
+        try:
+            first = export({})
+            assert first[0] is False and export({}) == (True, first[1])
+
+            FixedDatetime.today_value = datetime(2025, 9, 2)
+            cached, data = export({})
+            assert cached is False
+            # The header slots sit in the template's tables, so read the part itself
+            with zipfile.ZipFile(io.BytesIO(data)) as package:
+                text = package.read('word/document.xml').decode('utf-8')
+            assert '02/09/2025' in text and '2025-2026' in text
+        finally:
+            exam_word_exporter.datetime = original
+
+
+def main():
+    """Main test function"""
+    print("=== Export Cache Test ===\n")
+
+    print("1. Testing cache key invalidation...")
+    test_export_key_invalidation()
+
+    print("\n" + "="*50)
+    print("2. Testing document storage and eviction...")
+    test_export_cache_store_and_evict()
+    test_removed_document_is_a_miss()
+
+    print("\n" + "="*50)
+    print("3. Testing the defaulted exam date...")
+    test_defaulted_exam_date_in_key()
+
+    print("\n" + "="*50)
+    print("Test completed successfully!")
+
+
+if __name__ == '__main__':
+    main()
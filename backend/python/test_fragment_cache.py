@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Tests for the question fragment cache
+Author: Linh Dang Dev
+"""
+
+import sys
+import os
+import copy
+import pickle
+import tempfile
+
+# Add the exporter directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from docx.oxml.ns import qn
+from lxml import etree
+
+from exam_word_exporter import ExamWordExporter
+from fragment_cache import FragmentCache, content_version, fragment_key
+
+
+def _question(question_id='Q1', text='Thủ đô của Việt Nam là?'):
+    return {
+        'MaCauHoi': question_id, 'NoiDung': text, 'MaCauHoiCha': None, 'HoanVi': None,
+        'answers': [{'MaCauTraLoi': f"{question_id}-{j}", 'NoiDung': name,
+                     'LaDapAn': j == 0, 'HoanVi': None}
+                    for j, name in enumerate(('Hà Nội', 'Huế', 'Đà Nẵng', 'Sài Gòn'))]
+    }
+
+
+def _entry(text):
+    return {'question': [f"<head>{text}", '<tail/>'], 'answers': {'A1': ['<a>', '</a>']}}
+
+
+def test_fragment_key():
+    """Test that the key follows question content and render options, not answer order"""
+    question = _question()
+    version = content_version(question)
+    key = fragment_key('Q1', version, showAnswers=True)
+
+    reordered = dict(question, answers=list(reversed(question['answers'])))
+    assert fragment_key('q1', content_version(reordered), showAnswers=True) == key
+
+    edited = copy.deepcopy(question)
+    edited['answers'][1]['LaDapAn'] = True
+    assert fragment_key('Q1', content_version(edited), showAnswers=True) != key
+    assert fragment_key('Q1', content_version(_question(text='Khác')), showAnswers=True) != key
+    assert fragment_key('Q1', version, showAnswers=False) != key
+    assert fragment_key('Q2', version, showAnswers=True) != key
+
+
+def test_pickled_cache_shares_disk():
+    """Test that a cache passed to a worker process reopens on the same directory"""
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = FragmentCache(cache_dir, memory_bytes=1024)
+        cache.put('k1', _entry('one'))
+        assert cache.get('k1') == _entry('one')
+
+        worker = pickle.loads(pickle.dumps(cache))
+        assert (worker.cache_dir, worker.max_bytes, worker.memory_bytes) == \
+            (cache_dir, cache.max_bytes, 1024)
+        stats = worker.stats()
+        assert stats['memory_entries'] == 0 and stats['entries'] == 1
+        assert worker.get('k1') == _entry('one')
+        assert worker.get('k1') == _entry('one')
+        stats = worker.stats()
+        assert (stats['disk_hits'], stats['memory_hits'], stats['misses']) == (1, 1, 0)
+
+        # A memory-only cache stays memory-only in the worker
+        memory_only = pickle.loads(pickle.dumps(FragmentCache()))
+        memory_only.put('k2', _entry('two'))
+        assert memory_only.get('k2') == _entry('two') and memory_only.stats()['entries'] == 0
+
+
+def test_cached_fragments_render_the_same():
+    """Test that documents assembled from cached fragments match fresh renders"""
+    exam_data = {'exam': {'MaDeThi': 'E1', 'TenDeThi': 'Đề', 'TenMonHoc': 'Địa lý', 'NgayTao': None},
+                 'questions': [_question(f"Q{i}", f"Câu {i} <b>đậm</b>") for i in range(5)],
+                 'total_questions': 5}
+    options = {'showAnswers': True}
+
+    def body_xml(fragments):
+        doc = ExamWordExporter({}, fragments=fragments).create_word_document(exam_data, options)
+        body = copy.deepcopy(doc.element.body)
+        body.remove(body.find(qn('w:sectPr')))
+        return etree.tostring(body)
+
+    expected = body_xml(None)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = FragmentCache(cache_dir)
+        assert body_xml(cache) == expected
+        assert body_xml(cache) == expected
+        assert body_xml(pickle.loads(pickle.dumps(cache))) == expected
+        stats = cache.stats()
+        print(f"Fragment cache stats: {stats}")
+        assert stats['stores'] == 5 and stats['memory_hits'] == 5
+
+
+def main():
+    """Main test function"""
+    print("=== Fragment Cache Test ===\n")
+
+    print("1. Testing fragment keys...")
+    test_fragment_key()
+
+    print("\n" + "="*50)
+    print("2. Testing pickled caches...")
+    test_pickled_cache_shares_disk()
+
+    print("\n" + "="*50)
+    print("3. Testing rendering from cached fragments...")
+    test_cached_fragments_render_the_same()
+
+    print("\n" + "="*50)
+    print("Test completed successfully!")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Benchmark for Word Processor result serialization
+Author: Linh Dang Dev
+
+Builds a synthetic 10,000-question document (single, group and fill-in-blank
+blocks), parses it, then compares dataclasses.asdict + json.dumps with the
+direct serializer used by word_processor.py, and reports the size and cost of
+the --compress output.
+
+Usage: python benchmark_word_processor.py [--questions N] [--repeat N]
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import time
+from dataclasses import asdict
+
+# Add the scripts directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from word_processor import CompressedOutput, ProcessingResult, WordProcessor, write_result_json
+
+SINGLE_BLOCK = """(DON)
+(CLO1) Question {n}: which option is correct for case {n}?
+A. First option for {n}
+B. Second option for {n}
+C. Third option for {n}
+D. Fourth option for {n}
+[<br>]"""
+
+GROUP_BLOCK = """(NHOM)
+[<sg>]
+Questions {{<1>}} – {{<2>}} refer to passage {n}.
+A short passage used by the following questions.
+[<egc>]
+(NHOM – 1) (CLO2) What is the main idea of passage {n}?
+A. argue
+B. inform
+C. persuade
+D. entertain
+[<br>]
+(NHOM – 2) (CLO2) Which statement about passage {n} is true?
+A. one
+B. two
+C. three
+D. four
+[<br>]
+[</sg>]
+(KETTHUCNHOM)"""
+
+FILL_BLANK_BLOCK = """(DIENKHUYET)
+[<sg>]
+(CLO3) Passage {n}: we {{<1>}} _____ here and they {{<2>}} _____ there.
+[<egc>]
+(DIENKHUYET – 1)
+A. are
+B. is
+C. be
+D. been
+[<br>]
+(DIENKHUYET – 2)
+A. stay
+B. stays
+C. stayed
+D. staying
+[<br>]
+[</sg>]
+(KETTHUCDIENKHUYET)"""
+
+
+def build_document(question_count: int) -> str:
+    """Mix of block types; a group or fill-in-blank block holds 3 questions"""
+    blocks = []
+    count = 0
+    n = 0
+    while count < question_count:
+        n += 1
+        if n % 3 == 1:
+            blocks.append(GROUP_BLOCK.format(n=n))
+            count += 3
+        elif n % 3 == 2:
+            blocks.append(FILL_BLANK_BLOCK.format(n=n))
+            count += 3
+        else:
+            blocks.append(SINGLE_BLOCK.format(n=n))
+            count += 1
+    return '\n'.join(blocks)
+
+
+def serialize_with_asdict(result: ProcessingResult) -> str:
+    """Previous output path: deep-copy into dicts, then json.dumps"""
+    output_data = {
+        'success': result.success,
+        'questions': [asdict(q) for q in result.questions],
+        'images': [asdict(img) for img in result.images],
+        'errors': result.errors,
+        'warnings': result.warnings,
+        'statistics': result.statistics
+    }
+    return json.dumps(output_data, ensure_ascii=False, indent=2)
+
+
+def serialize_direct(result: ProcessingResult) -> str:
+    buffer = io.StringIO()
+    write_result_json(result, buffer, {'questions', 'images', 'statistics'})
+    return buffer.getvalue()
+
+
+def serialize_compressed(result: ProcessingResult, encoding: str = 'gzip') -> bytes:
+    buffer = io.BytesIO()
+    with CompressedOutput(buffer, encoding, threshold=0) as output:
+        write_result_json(result, output, {'questions', 'images', 'statistics'})
+    return buffer.getvalue()
+
+
+def best_of(repeat: int, func, *args) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Word Processor serialization')
+    parser.add_argument('--questions', type=int, default=10000, help='Number of questions (default: 10000)')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per measurement, best is reported')
+    args = parser.parse_args()
+
+    processor = WordProcessor()
+    text = build_document(args.questions)
+
+    start = time.perf_counter()
+    questions = processor._parse_questions(text)
+    parse_time = time.perf_counter() - start
+
+    result = ProcessingResult(
+        success=True,
+        text_content='',
+        html_content='',
+        questions=questions,
+        images=[],
+        errors=[],
+        warnings=[],
+        statistics=processor._generate_statistics(questions, [])
+    )
+
+    # Both paths must describe the same data
+    assert json.loads(serialize_direct(result))['questions'] == \
+        json.loads(serialize_with_asdict(result))['questions']
+
+    asdict_time = best_of(args.repeat, serialize_with_asdict, result)
+    direct_time = best_of(args.repeat, serialize_direct, result)
+
+    print(f"Questions parsed:        {len(questions)} in {parse_time * 1000:.1f} ms")
+    print(f"asdict + json.dumps:     {asdict_time * 1000:.1f} ms "
+          f"({len(serialize_with_asdict(result)) / 1024:.0f} KB)")
+    print(f"direct serializer:       {direct_time * 1000:.1f} ms "
+          f"({len(serialize_direct(result)) / 1024:.0f} KB)")
+    print(f"Speedup:                 {asdict_time / direct_time:.1f}x")
+
+    gzip_time = best_of(args.repeat, serialize_compressed, result)
+    plain_size = len(serialize_direct(result).encode('utf-8'))
+    gzip_size = len(serialize_compressed(result))
+    print(f"direct + gzip:           {gzip_time * 1000:.1f} ms "
+          f"({gzip_size / 1024:.0f} KB, {plain_size / gzip_size:.1f}x smaller)")
+
+
+if __name__ == '__main__':
+    main()
@@ -8,13 +8,20 @@ This script tests the word processor with sample data.
 
 import sys
 import os
+import io
+import gzip
 import json
+import tempfile
+import zipfile
 from pathlib import Path
 
 # Add the scripts directory to Python path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from word_processor import WordProcessor
+from dataclasses import asdict
+
+from word_processor import (WordProcessor, CompressedOutput, ExtractedImage, MediaIndex, TextSpan,
+                            question_to_json, image_to_json)
 
 def test_with_sample_text():
     """Test the processor with sample text data"""
@@ -148,6 +155,89 @@ B. Answer B
     
     return blocks
 
+def test_group_and_fill_blank_parsing():
+    """Test that (NHOM) and (DIENKHUYET) blocks yield a parent and its children"""
+    
+    sample_text = """(NHOM)
+[<sg>]
+(CLO2) Questions {<1>} – {<2>} refer to the following passage.
+Passage text
+[<egc>]
+(NHOM – 1) First child
+A. Answer A
+B. Answer B
+[<br>]
+(NHOM – 2)(CLO1) Second child
+A. Answer A
+B. Answer B
+[<br>]
+[</sg>]
+(KETTHUCNHOM)
+(DIENKHUYET)
+[<sg>]
+We {<1>} _____ here.
+[<egc>]
+(DIENKHUYET – 1)
+A. are
+B. is
+[<br>]
+[</sg>]
+(KETTHUCDIENKHUYET)"""
+
+    processor = WordProcessor()
+    warnings = []
+    questions = processor._parse_questions(sample_text, warnings=warnings)
+    
+    summary = [(q.type, q.parent_order, q.placeholder_number, q.clo) for q in questions]
+    print(f"Parsed: {summary}")
+    
+    assert summary == [
+        ('parent', None, None, '2'),
+        ('group', 1, 1, '2'),
+        ('group', 1, 2, '1'),
+        ('parent', None, None, None),
+        ('fill-in-blank', 2, 1, None),
+    ]
+    assert questions[0].child_count == 2
+    assert questions[0].content == "Questions {<1>} – {<2>} refer to the following passage.\nPassage text"
+    assert questions[1].content == "First child"
+    assert [a.letter for a in questions[4].answers] == ['A', 'B']
+    assert warnings == []
+
+def test_placeholder_mapping():
+    """Test that group children are matched to the passage placeholders"""
+    
+    sample_text = """(NHOM)
+[<sg>]
+Questions {<1>} – {<3>} refer to the following passage.
+[<egc>]
+(NHOM – 1) First child
+A. Answer A
+[<br>]
+Unmarked child
+A. Answer A
+[<br>]
+(NHOM – 5) Stray child
+A. Answer A
+[<br>]
+[</sg>]
+(KETTHUCNHOM)"""
+
+    processor = WordProcessor()
+    warnings = []
+    questions = processor._parse_questions(sample_text, warnings=warnings)
+    
+    print(f"  Placeholders: {[q.placeholder_number for q in questions[1:]]}")
+    for warning in warnings:
+        print(f"  Warning: {warning}")
+    
+    assert [q.placeholder_number for q in questions[1:]] == [1, 2, 5]
+    assert warnings == [
+        "Question block 1: child 2 has no child marker, matched to placeholder {<2>}",
+        "Question block 1: child 3 is marked 5 but the passage has no {<5>} placeholder",
+        "Question block 1: placeholder {<3>} has no child question",
+    ]
+
 def test_answer_parsing():
     """Test answer parsing with different correct answer formats"""
     
@@ -200,6 +290,240 @@ def test_answer_parsing():
             correct_mark = " ✓" if answer.is_correct else ""
             print(f"  {answer.letter}. {answer.content}{correct_mark}")
 
+def test_formatting_answer_detection():
+    """Test that answer correctness is read from run formatting"""
+    
+    def spans(*items):
+        return [[TextSpan(text, **formatting)] for text, formatting in items]
+    
+    answer_lines = ['A. first', 'B. second_value', 'C. third']
+    cases = [
+        ('Underline', spans(('A. first', {}), ('B. second_value', {}), ('C. third', {'underline': True})), ['C']),
+        ('Highlight', spans(('A. first', {'highlight': True}), ('B. second_value', {}), ('C. third', {})), ['A']),
+        ('Bold', spans(('A. first', {}), ('B. second_value', {'bold': True}), ('C. third', {})), ['B']),
+        ('All bold', spans(('A. first', {'bold': True}), ('B. second_value', {'bold': True}),
+                           ('C. third', {'bold': True})), []),
+        ('Plain', spans(('A. first', {}), ('B. second_value', {}), ('C. third', {})), []),
+    ]
+    
+    processor = WordProcessor()
+    
+    for name, answer_spans, expected in cases:
+        answers = processor._parse_answers(answer_lines, answer_spans)
+        correct = [answer.letter for answer in answers if answer.is_correct]
+        print(f"  {name}: {correct}")
+        assert correct == expected, name
+
+def test_media_index():
+    """Test that archive media references resolve by path, then by file name"""
+    
+    index = MediaIndex([
+        'Media/Audio/listen1.mp3',
+        'Media/Images/Chart.png',
+        'Extra/listen1.mp3',
+    ])
+    
+    cases = [
+        ('Media/Audio/listen1.mp3', 'Media/Audio/listen1.mp3'),
+        ('media\\images\\chart.PNG', 'Media/Images/Chart.png'),
+        ('./Extra/listen1.mp3', 'Extra/listen1.mp3'),
+        ('listen1.mp3', 'Extra/listen1.mp3'),  # first in sorted order
+        ('Audio/chart.png', 'Media/Images/Chart.png'),
+        ('missing.mp3', None),
+    ]
+    
+    for reference, expected in cases:
+        resolved = index.resolve(reference)
+        print(f"  {reference} -> {resolved}")
+        assert resolved == expected, reference
+
+def test_archive_media_copy_failures():
+    """Test that media that cannot be copied out of an archive map to None with a warning"""
+    from docx import Document
+    
+    document = Document()
+    for line in ['(DON)', 'Listen [AUDIO: good.mp3] [AUDIO: ../evil.mp3] [AUDIO: blocked.mp3]', 'A. a', 'B. b']:
+        document.add_paragraph(line)
+    docx_data = io.BytesIO()
+    document.save(docx_data)
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        archive_path = os.path.join(temp_dir, 'exam.zip')
+        with zipfile.ZipFile(archive_path, 'w') as archive:
+            archive.writestr('exam.docx', docx_data.getvalue())
+            archive.writestr('good.mp3', b'good')
+            archive.writestr('../evil.mp3', b'evil')
+            archive.writestr('blocked.mp3', b'blocked')
+        media_dir = os.path.join(temp_dir, 'media')
+        # A directory in the way makes the copy fail with an OSError
+        os.makedirs(os.path.join(media_dir, 'blocked.mp3'))
+        
+        result = WordProcessor().process_archive(archive_path, extract_images=False, workers=1,
+                                                 media_dir=media_dir)
+        archive_document = result.documents[0]
+        print(f"  Media: {archive_document.media}")
+        
+        assert result.success
+        assert archive_document.media['good.mp3'] == os.path.join(media_dir, 'good.mp3')
+        assert archive_document.media['../evil.mp3'] is None
+        assert archive_document.media['blocked.mp3'] is None
+        assert not os.path.exists(os.path.join(temp_dir, 'evil.mp3'))
+        warnings = archive_document.result.warnings
+        assert "Skipped media outside the archive root: ../evil.mp3" in warnings
+        assert any(warning.startswith("Could not copy media blocked.mp3") for warning in warnings)
+
+def test_compressed_output():
+    """Test that output is compressed only past the threshold, behind a header"""
+    
+    small = io.BytesIO()
+    with CompressedOutput(small, 'gzip', threshold=100) as output:
+        output.write('{"success":true}')
+    assert small.getvalue() == b'{"success":true}'
+    
+    large = io.BytesIO()
+    text = json.dumps({'content': 'ü' * 200})
+    with CompressedOutput(large, 'gzip', threshold=100) as output:
+        output.write(text[:50])
+        output.write(text[50:])
+    header, _, body = large.getvalue().partition(b'\n')
+    print(f"  Header: {header.decode()}, {len(text)} chars -> {len(body)} bytes")
+    assert header == b'WPJSON/1 encoding=gzip'
+    assert gzip.decompress(body).decode('utf-8') == text
+
+def test_serializer_matches_asdict():
+    """Test that the direct serializer writes the same JSON as asdict"""
+    
+    sample_text = """(DON)
+(CLO2) Quote " backslash \\ tab\tand ü [IMAGE: chart.png]
+A. first
+B. second
+(NHOM)
+[<sg>]
+Passage
+[<egc>]
+(NHOM – 1) Child
+A. yes
+B. no
+[<br>]
+[</sg>]
+(KETTHUCNHOM)"""
+
+    processor = WordProcessor()
+    questions = processor._parse_questions(sample_text)
+    image = ExtractedImage(filename='abc.png', content_type='image/png', size=3,
+                           sha256='abc', original_path='word/media/image1.png',
+                           path='/tmp/abc.png', question_orders=[1], referenced=False)
+    
+    for question in questions:
+        assert json.loads(question_to_json(question)) == asdict(question)
+    assert json.loads(image_to_json(image)) == asdict(image)
+    print(f"Serializer matches asdict for {len(questions)} questions and 1 image")
+
+def _write_sample_docx(path):
+    """Write a small DOCX with a single question, a group and an image"""
+    from docx import Document
+    from PIL import Image
+    
+    png = io.BytesIO()
+    Image.new('RGB', (4, 4), 'red').save(png, 'PNG')
+    
+    document = Document()
+    for line in ['(DON)', '(CLO1) First question', 'A. one', 'B. two', '[<br>]',
+                 '(NHOM)', '[<sg>]', 'Read the passage {<1>}', '[<egc>]',
+                 '(NHOM – 1) Child question', 'A. yes', 'B. no', '[<br>]', '[</sg>]', '(KETTHUCNHOM)']:
+        document.add_paragraph(line)
+    document.paragraphs[1].add_run().add_picture(io.BytesIO(png.getvalue()))
+    document.save(path)
+
+class FlushRecorder(io.StringIO):
+    """Text stream remembering what had been written at every flush"""
+    
+    def __init__(self):
+        super().__init__()
+        self.flushed = []
+    
+    def flush(self):
+        super().flush()
+        self.flushed.append(self.getvalue())
+
+def test_ndjson_stream():
+    """Test the NDJSON records read line by line: types, order and summary"""
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        docx_path = os.path.join(temp_dir, 'sample.docx')
+        _write_sample_docx(docx_path)
+        
+        output = FlushRecorder()
+        success = WordProcessor().stream_docx_file(docx_path, output, extract_images=True,
+                                                   image_dir=os.path.join(temp_dir, 'media'))
+        
+        # Every record is flushed as one complete line
+        assert all(text.endswith('\n') for text in output.flushed)
+        records = [json.loads(line) for line in output.getvalue().splitlines()]
+    
+    kinds = [record['record'] for record in records]
+    print(f"  Records: {kinds}")
+    assert success
+    assert kinds == ['question', 'question', 'question', 'image', 'summary']
+    assert len(output.flushed) == len(records)
+    
+    single, parent, child, image, summary = records
+    assert (single['type'], single['order'], single['clo']) == ('single', 1, '1')
+    assert (parent['type'], parent['order'], parent['child_count']) == ('parent', 2, 1)
+    assert (child['type'], child['parent_order'], child['placeholder_number']) == ('group', 2, 1)
+    assert single['media_references'] == [image['filename']]
+    assert image['question_orders'] == [1] and image['original_path'] == 'word/media/image1.png'
+    
+    assert summary['success'] and summary['errors'] == []
+    assert summary['statistics']['total_questions'] == 3
+    assert summary['statistics']['total_images'] == 1
+
+def test_images_without_extraction():
+    """Test that images are only marked in the text when they are extracted"""
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        docx_path = os.path.join(temp_dir, 'sample.docx')
+        _write_sample_docx(docx_path)
+        
+        processor = WordProcessor()
+        kept = processor.process_docx_file(docx_path, extract_images=True,
+                                           image_dir=os.path.join(temp_dir, 'media'),
+                                           fields={'text_content', 'questions', 'images'})
+        skipped = processor.process_docx_file(docx_path, extract_images=False,
+                                              fields={'text_content', 'questions', 'images'})
+    
+    image = kept.images[0]
+    print(f"  Extracted: {image.filename}, skipped: {len(skipped.images)} images")
+    assert f"[IMAGE: {image.filename}]" in kept.text_content
+    assert kept.questions[0].media_references == [image.filename]
+    
+    assert skipped.success and skipped.images == []
+    assert '[IMAGE:' not in skipped.text_content
+    assert skipped.questions[0].content == 'First question'
+    assert skipped.questions[0].media_references == []
+    assert skipped.statistics['total_images'] == 0
+
+def test_highlighted_answer_docx():
+    """Test that a highlighted answer in a real DOCX is read as correct"""
+    from docx import Document
+    from docx.enum.text import WD_COLOR_INDEX
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        docx_path = os.path.join(temp_dir, 'highlight.docx')
+        document = Document()
+        for line in ['(DON)', '(CLO1) Which one?', 'A. first', 'B. second', 'C. third']:
+            document.add_paragraph(line)
+        document.paragraphs[3].runs[0].font.highlight_color = WD_COLOR_INDEX.YELLOW
+        document.save(docx_path)
+        
+        result = WordProcessor().process_docx_file(docx_path, extract_images=False,
+                                                   fields={'questions'})
+    
+    answers = result.questions[0].answers
+    correct = [answer.letter for answer in answers if answer.is_correct]
+    print(f"  Correct answers: {correct}")
+    assert result.success and correct == ['B']
+
 def main():
     """Main test function"""
     print("=== Word Processor Test ===\n")
@@ -212,9 +536,37 @@ def main():
     test_answer_parsing()
     
     print("\n" + "="*50)
-    print("3. Testing full question parsing...")
+    print("3. Testing group and fill-in-blank parsing...")
+    test_group_and_fill_blank_parsing()
+    test_placeholder_mapping()
+    
+    print("\n" + "="*50)
+    print("4. Testing full question parsing...")
     questions, stats = test_with_sample_text()
     
+    print("\n" + "="*50)
+    print("5. Testing formatting-aware answer detection...")
+    test_formatting_answer_detection()
+    test_highlighted_answer_docx()
+    
+    print("\n" + "="*50)
+    print("6. Testing archive media index...")
+    test_media_index()
+    test_archive_media_copy_failures()
+    
+    print("\n" + "="*50)
+    print("7. Testing compressed output...")
+    test_compressed_output()
+    
+    print("\n" + "="*50)
+    print("8. Testing result serializer...")
+    test_serializer_matches_asdict()
+    
+    print("\n" + "="*50)
+    print("9. Testing NDJSON streaming...")
+    test_ndjson_stream()
+    test_images_without_extraction()
+    
     print("\n" + "="*50)
     print("Test completed successfully!")
     
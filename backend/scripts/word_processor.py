@@ -8,28 +8,85 @@ It handles question parsing with proper formatting detection for correct answers
 """
 
 import os
+import io
 import sys
 import json
-import zipfile
 import tempfile
 import base64
-from pathlib import Path
-from typing import Dict, List, Optional, Tuple, Any
+import hashlib
+import posixpath
+import shutil
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from typing import BinaryIO, Dict, List, Optional, Tuple, Any, Union
 import mammoth
+from mammoth import documents
 import argparse
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, field
+from json.encoder import encode_basestring
 import re
 
-@dataclass
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+IMAGE_EXTENSIONS = {
+    'image/png': '.png',
+    'image/jpeg': '.jpg',
+    'image/gif': '.gif',
+    'image/bmp': '.bmp',
+    'image/webp': '.webp',
+    'image/x-emf': '.emf',
+    'image/x-wmf': '.wmf'
+}
+
+# Content types of package media, by extension, for images no body paragraph shows
+MEDIA_CONTENT_TYPES = {extension: content_type for content_type, extension in IMAGE_EXTENSIONS.items()}
+MEDIA_CONTENT_TYPES['.jpeg'] = 'image/jpeg'
+
+# Images of a document are named <sha256><ext>; other references are bundled media
+EMBEDDED_IMAGE_NAME = re.compile(r'^[0-9a-f]{64}\.\w+$')
+
+# Top-level fields of the JSON output; success, errors and warnings are
+# always written
+OUTPUT_FIELDS = ('text_content', 'html_content', 'questions', 'images', 'statistics')
+
+# Images are copied out of the document in chunks of this size
+IMAGE_CHUNK_SIZE = 64 * 1024
+
+# Archive members that are neither documents nor bundled media
+ARCHIVE_SKIP_PREFIXES = ('__MACOSX/',)
+
+# Default size of the worker pool that processes archive documents
+DEFAULT_ARCHIVE_WORKERS = min(4, os.cpu_count() or 1)
+
+# Compressed output starts with a "<header> encoding=<name>" line; outputs
+# below the threshold stay plain JSON without a header
+COMPRESSION_HEADER = 'WPJSON/1'
+COMPRESSION_ENCODINGS = ('gzip', 'zstd')
+DEFAULT_COMPRESS_THRESHOLD = 1024 * 1024
+
+# Result records are created per question and answer, so drop the per-instance
+# __dict__ where the interpreter supports slotted dataclasses (3.10+)
+RECORD_OPTIONS = {'slots': True} if sys.version_info >= (3, 10) else {}
+
+@dataclass(**RECORD_OPTIONS)
 class ExtractedImage:
     """Represents an extracted image from Word document"""
     filename: str
     content_type: str
-    data: str  # base64 encoded
     size: int
-    original_path: str
+    sha256: str
+    original_path: Optional[str] = None  # part name inside the DOCX package, e.g. word/media/image1.png
+    data: Optional[str] = None  # base64 encoded, only when no image store is used
+    path: Optional[str] = None  # file in the content-addressed image store
+    question_orders: List[int] = field(default_factory=list)  # questions showing the image
+    referenced: bool = True  # False for package media no body paragraph shows
 
-@dataclass
+@dataclass(**RECORD_OPTIONS)
 class ParsedAnswer:
     """Represents a parsed answer option"""
     letter: str
@@ -37,18 +94,28 @@ class ParsedAnswer:
     is_correct: bool
     order: int
 
-@dataclass
+@dataclass(**RECORD_OPTIONS)
 class ParsedQuestion:
     """Represents a parsed question"""
-    type: str  # 'single', 'group', 'fill-in-blank'
+    type: str  # 'single', 'parent', 'group', 'fill-in-blank'
     content: str
     answers: List[ParsedAnswer]
     clo: Optional[str]
-    order: int
+    order: int  # block number; position within the group for child questions
     media_references: List[str]
     placeholder_number: Optional[int] = None
+    parent_order: Optional[int] = None  # block number of the parent for group children
+    child_count: int = 0  # number of child questions of a 'parent' question
+
+@dataclass(**RECORD_OPTIONS)
+class TextSpan:
+    """A piece of one text line with the formatting that marks correct answers"""
+    text: str
+    bold: bool = False
+    underline: bool = False
+    highlight: bool = False
 
-@dataclass
+@dataclass(**RECORD_OPTIONS)
 class ProcessingResult:
     """Result of Word document processing"""
     success: bool
@@ -60,6 +127,356 @@ class ProcessingResult:
     warnings: List[str]
     statistics: Dict[str, int]
 
+@dataclass(**RECORD_OPTIONS)
+class ArchiveDocument:
+    """Result of one document inside a ZIP archive"""
+    name: str  # archive member name
+    result: ProcessingResult
+    # reference -> bundled media file; None when the file could not be copied out
+    media: Dict[str, Optional[str]] = field(default_factory=dict)
+    missing_media: List[str] = field(default_factory=list)  # references not found in the archive
+
+@dataclass(**RECORD_OPTIONS)
+class ArchiveResult:
+    """Result of processing every document of a ZIP archive"""
+    success: bool
+    documents: List[ArchiveDocument]
+    errors: List[str]
+    statistics: Dict[str, int]
+
+def _json_string(value: Optional[str]) -> str:
+    return 'null' if value is None else encode_basestring(value)
+
+def _json_int(value: Optional[int]) -> str:
+    return 'null' if value is None else str(value)
+
+def answer_to_json(answer: ParsedAnswer) -> str:
+    """Serialize an answer straight to JSON text"""
+    return (f'{{"letter":{encode_basestring(answer.letter)},'
+            f'"content":{encode_basestring(answer.content)},'
+            f'"is_correct":{"true" if answer.is_correct else "false"},'
+            f'"order":{answer.order}}}')
+
+def question_to_json(question: ParsedQuestion) -> str:
+    """
+    Serialize a question straight to JSON text
+
+    Writes the same object dataclasses.asdict + json.dumps would, without
+    deep-copying the question into intermediate dicts first. Keep in sync
+    with the ParsedQuestion fields.
+    """
+    answers = ','.join(map(answer_to_json, question.answers))
+    media_references = ','.join(map(encode_basestring, question.media_references))
+    return (f'{{"type":{encode_basestring(question.type)},'
+            f'"content":{encode_basestring(question.content)},'
+            f'"answers":[{answers}],'
+            f'"clo":{_json_string(question.clo)},'
+            f'"order":{question.order},'
+            f'"media_references":[{media_references}],'
+            f'"placeholder_number":{_json_int(question.placeholder_number)},'
+            f'"parent_order":{_json_int(question.parent_order)},'
+            f'"child_count":{question.child_count}}}')
+
+def image_to_json(image: ExtractedImage) -> str:
+    """Serialize an extracted image straight to JSON text"""
+    question_orders = ','.join(map(str, image.question_orders))
+    return (f'{{"filename":{encode_basestring(image.filename)},'
+            f'"content_type":{encode_basestring(image.content_type)},'
+            f'"size":{image.size},'
+            f'"sha256":{encode_basestring(image.sha256)},'
+            f'"original_path":{_json_string(image.original_path)},'
+            f'"data":{_json_string(image.data)},'
+            f'"path":{_json_string(image.path)},'
+            f'"question_orders":[{question_orders}],'
+            f'"referenced":{"true" if image.referenced else "false"}}}')
+
+def write_result_json(result: ProcessingResult, output, fields: Optional[set] = None):
+    """Write a processing result as one compact JSON object, field by field"""
+    def wants(name: str) -> bool:
+        return fields is None or name in fields
+
+    def write_list(items, to_json):
+        output.write('[')
+        for i, item in enumerate(items):
+            if i:
+                output.write(',')
+            output.write(to_json(item))
+        output.write(']')
+
+    output.write(f'{{"success":{"true" if result.success else "false"}')
+    if wants('text_content'):
+        output.write(f',"text_content":{encode_basestring(result.text_content)}')
+    if wants('html_content'):
+        output.write(f',"html_content":{encode_basestring(result.html_content)}')
+    if wants('questions'):
+        output.write(',"questions":')
+        write_list(result.questions, question_to_json)
+    if wants('images'):
+        output.write(',"images":')
+        write_list(result.images, image_to_json)
+    output.write(f',"errors":{json.dumps(result.errors, ensure_ascii=False)}')
+    output.write(f',"warnings":{json.dumps(result.warnings, ensure_ascii=False)}')
+    if wants('statistics'):
+        output.write(f',"statistics":{json.dumps(result.statistics)}')
+    output.write('}')
+
+def write_archive_json(result: ArchiveResult, output, fields: Optional[set] = None):
+    """Write an archive result as one compact JSON object, document by document"""
+    output.write(f'{{"success":{"true" if result.success else "false"},"documents":[')
+    for i, document in enumerate(result.documents):
+        if i:
+            output.write(',')
+        output.write(f'{{"name":{encode_basestring(document.name)},"result":')
+        write_result_json(document.result, output, fields)
+        output.write(f',"media":{json.dumps(document.media, ensure_ascii=False)}')
+        output.write(f',"missing_media":{json.dumps(document.missing_media, ensure_ascii=False)}}}')
+    output.write(f'],"errors":{json.dumps(result.errors, ensure_ascii=False)}')
+    output.write(f',"statistics":{json.dumps(result.statistics)}}}')
+
+class CompressedOutput:
+    """Text stream that compresses the output once it passes a size threshold.
+
+    Writes are buffered until threshold bytes have been written. If the output
+    stays below it, it is written out unchanged. Otherwise a header line
+    naming the encoding is written, followed by the whole output compressed
+    as a single gzip or zstd stream, and later writes are compressed as they
+    arrive.
+    """
+
+    def __init__(self, binary: BinaryIO, encoding: str = 'gzip',
+                 threshold: int = DEFAULT_COMPRESS_THRESHOLD, close_binary: bool = False):
+        if encoding == 'zstd' and zstandard is None:
+            print("zstandard not installed, compressing with gzip", file=sys.stderr)
+            encoding = 'gzip'
+        self.encoding = encoding
+        self.threshold = threshold
+        self._binary = binary
+        self._close_binary = close_binary
+        self._pending: List[bytes] = []
+        self._pending_size = 0
+        self._compressor = None
+
+    @property
+    def compressed(self) -> bool:
+        return self._compressor is not None
+
+    def write(self, text: str):
+        data = text.encode('utf-8')
+        if self._compressor is not None:
+            self._binary.write(self._compressor.compress(data))
+            return
+        self._pending.append(data)
+        self._pending_size += len(data)
+        if self._pending_size > self.threshold:
+            self._start_compression()
+
+    def flush(self):
+        # Compressed data can only be flushed as a whole at close()
+        if self._compressor is None:
+            return
+        self._binary.flush()
+
+    def _start_compression(self):
+        if self.encoding == 'zstd':
+            self._compressor = zstandard.ZstdCompressor().compressobj()
+        else:
+            # wbits 31 selects the gzip container
+            self._compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        self._binary.write(f'{COMPRESSION_HEADER} encoding={self.encoding}\n'.encode('ascii'))
+        for data in self._pending:
+            self._binary.write(self._compressor.compress(data))
+        self._pending = []
+
+    def close(self):
+        if self._compressor is not None:
+            self._binary.write(self._compressor.flush())
+        else:
+            self._binary.write(b''.join(self._pending))
+            self._pending = []
+        self._binary.flush()
+        if self._close_binary:
+            self._binary.close()
+
+    def __enter__(self) -> 'CompressedOutput':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def open_result_output(output_path: Optional[str] = None, compression: Optional[str] = None,
+                       threshold: int = DEFAULT_COMPRESS_THRESHOLD):
+    """Open the file (or stdout) a JSON result is written to, compressing it if requested"""
+    if not compression:
+        if output_path:
+            return open(output_path, 'w', encoding='utf-8')
+        return nullcontext(sys.stdout)
+    if output_path:
+        return CompressedOutput(open(output_path, 'wb'), compression, threshold, close_binary=True)
+    sys.stdout.flush()
+    return CompressedOutput(sys.stdout.buffer, compression, threshold)
+
+class MediaIndex:
+    """Lookup of the media files bundled in an archive.
+
+    Built once from the archive listing. A reference is matched on its
+    relative path first and then on its bare file name, both ignoring case,
+    since documents usually cite media by file name only. When several
+    members share a name, the first in sorted order wins.
+    """
+
+    def __init__(self, member_names: List[str]):
+        self._by_path: Dict[str, str] = {}
+        self._by_name: Dict[str, str] = {}
+        for name in sorted(member_names):
+            key = name.lower()
+            self._by_path.setdefault(key, name)
+            self._by_name.setdefault(posixpath.basename(key), name)
+
+    def __len__(self) -> int:
+        return len(self._by_path)
+
+    def resolve(self, reference: str) -> Optional[str]:
+        """Return the archive member a media reference points to"""
+        key = posixpath.normpath(reference.strip().replace('\\', '/')).lower()
+        return self._by_path.get(key) or self._by_name.get(posixpath.basename(key))
+
+def _process_archive_member(archive_path: str, member: str, extract_images: bool,
+                            image_dir: Optional[str], fields: Optional[set]) -> ProcessingResult:
+    """Worker entry point: process one document read straight from the archive"""
+    # The DOCX reader needs random access, so the member is held in memory
+    # rather than unpacked to disk
+    with zipfile.ZipFile(archive_path) as archive:
+        data = archive.read(member)
+    return WordProcessor().process_docx_file(io.BytesIO(data), extract_images, image_dir, fields)
+
+class ImageCollector:
+    """Captures images while mammoth converts the document.
+
+    Every image is read once, when the document tree is walked, and written to
+    the content-addressed store (or kept as base64 without one). The HTML
+    conversion then looks the stored image up instead of reading it again.
+    Without a collector images are not read at all and the text carries no
+    [IMAGE: ...] markers for them.
+    """
+
+    def __init__(self, image_dir: Optional[str] = None):
+        self.image_dir = image_dir
+        self.images: List[ExtractedImage] = []
+        self._by_element: Dict[int, ExtractedImage] = {}
+        self._by_hash: Dict[str, ExtractedImage] = {}
+        # (CRC-32, size) as the package directory lists them, to match media parts
+        self._by_content: Dict[Tuple[int, int], ExtractedImage] = {}
+        if self.image_dir:
+            os.makedirs(self.image_dir, exist_ok=True)
+
+    def capture(self, image: 'documents.Image') -> ExtractedImage:
+        """Store an image element and return its (deduplicated) record"""
+        captured = self._by_element.get(id(image))
+        if captured is None:
+            captured = self._capture(image.open, image.content_type)
+            self._by_element[id(image)] = captured
+        return captured
+
+    def scan_package(self, docx_file: BinaryIO) -> List[str]:
+        """Match the captured images to their package parts and keep the rest
+
+        The media parts are matched on the CRC-32 and size the ZIP directory
+        already lists, so referenced images are not read a second time. Media
+        no body paragraph shows (headers, unused parts) are captured with
+        referenced set to False. Returns a warning per such part.
+        """
+        warnings = []
+        docx_file.seek(0)
+        with zipfile.ZipFile(docx_file) as package:
+            for info in package.infolist():
+                if info.is_dir() or not info.filename.startswith('word/media/'):
+                    continue
+                captured = self._by_content.get((info.CRC, info.file_size))
+                if captured is None:
+                    extension = posixpath.splitext(info.filename)[1].lower()
+                    captured = self._capture(lambda: package.open(info), MEDIA_CONTENT_TYPES.get(extension),
+                                             referenced=False)
+                    warnings.append(f"Image not referenced by the document body: {info.filename}")
+                if captured.original_path is None:
+                    captured.original_path = info.filename
+        return warnings
+
+    def _capture(self, open_image, content_type: Optional[str], referenced: bool = True) -> ExtractedImage:
+        if self.image_dir:
+            sha256, crc, size, temp_path = self._stream_to_store(open_image)
+        else:
+            with open_image() as image_file:
+                image_data = image_file.read()
+            sha256, crc, size, temp_path = (hashlib.sha256(image_data).hexdigest(), zlib.crc32(image_data),
+                                            len(image_data), None)
+
+        captured = self._by_hash.get(sha256)
+        if captured is None:
+            content_type = content_type or 'image/jpeg'
+            filename = sha256 + IMAGE_EXTENSIONS.get(content_type, '.bin')
+            captured = ExtractedImage(
+                filename=filename,
+                content_type=content_type,
+                size=size,
+                sha256=sha256,
+                referenced=referenced
+            )
+            if temp_path:
+                captured.path = os.path.abspath(os.path.join(self.image_dir, filename))
+                if os.path.exists(captured.path):
+                    os.remove(temp_path)  # stored by an earlier document
+                else:
+                    os.replace(temp_path, captured.path)
+            else:
+                captured.data = base64.b64encode(image_data).decode('utf-8')
+            self._by_hash[sha256] = captured
+            self.images.append(captured)
+        elif temp_path:
+            os.remove(temp_path)
+
+        self._by_content.setdefault((crc, size), captured)
+        return captured
+
+    def _stream_to_store(self, open_image) -> Tuple[str, int, int, str]:
+        digest = hashlib.sha256()
+        crc = 0
+        size = 0
+
+        fd, temp_path = tempfile.mkstemp(dir=self.image_dir, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as target, open_image() as source:
+                while True:
+                    chunk = source.read(IMAGE_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    crc = zlib.crc32(chunk, crc)
+                    target.write(chunk)
+                    size += len(chunk)
+        except Exception:
+            os.remove(temp_path)
+            raise
+
+        return digest.hexdigest(), crc, size, temp_path
+
+    def img_attributes(self, image: 'documents.Image') -> Dict[str, str]:
+        """mammoth convert_image callback reusing the captured image"""
+        captured = self.capture(image)
+        if captured.data is not None:
+            return {'src': f"data:{captured.content_type};base64,{captured.data}"}
+        return {'src': captured.filename}
+
+    def link_questions(self, questions: List['ParsedQuestion']):
+        """Record which questions reference each captured image"""
+        by_filename = {image.filename: image for image in self.images}
+        for question in questions:
+            # Group children belong to their parent's block
+            block_order = question.parent_order if question.parent_order is not None else question.order
+            for reference in question.media_references:
+                image = by_filename.get(reference)
+                if image is not None and block_order not in image.question_orders:
+                    image.question_orders.append(block_order)
+
 class WordProcessor:
     """Main class for processing Word documents"""
     
@@ -77,15 +494,24 @@ class WordProcessor:
             'group_end': '[</sg>]',
             'question_separator': '[<br>]',
             'placeholder_pattern': re.compile(r'\{<(\d+)>\}'),
+            # "{<1>} – {<3>}" in a passage stands for placeholders 1 to 3
+            'placeholder_range_separator': re.compile(r'^\s*[–-]\s*$'),
         }
         
-    def process_docx_file(self, file_path: str, extract_images: bool = True) -> ProcessingResult:
+    def process_docx_file(self, file_path: Union[str, BinaryIO], extract_images: bool = True,
+                          image_dir: Optional[str] = None,
+                          fields: Optional[set] = None) -> ProcessingResult:
         """
         Process a DOCX file and extract content and images
         
         Args:
-            file_path: Path to the DOCX file
+            file_path: Path to the DOCX file, or a seekable binary file object
             extract_images: Whether to extract images from the document
+            image_dir: Content-addressed store to write images to; when not
+                set, images are embedded in the result as base64
+            fields: Output fields the caller needs (see OUTPUT_FIELDS); the
+                HTML conversion and image extraction are skipped when their
+                fields are not requested. None means all fields.
             
         Returns:
             ProcessingResult containing all extracted data
@@ -102,13 +528,22 @@ class WordProcessor:
         )
         
         try:
-            if not os.path.exists(file_path):
+            if isinstance(file_path, str) and not os.path.exists(file_path):
                 result.errors.append(f"File not found: {file_path}")
                 return result
                 
+            def wants(field: str) -> bool:
+                return fields is None or field in fields
+
+            # Images are captured during the conversion itself; without
+            # extraction they are neither read nor marked in the text
+            image_collector = ImageCollector(image_dir) if extract_images and wants('images') else None
+
             # Extract text and HTML content
-            text_content, html_content, conversion_messages = self._extract_content(file_path)
-            result.text_content = text_content
+            text_content, html_content, conversion_messages, line_spans = self._extract_content(
+                file_path, include_html=wants('html_content'), image_collector=image_collector)
+            if wants('text_content'):
+                result.text_content = text_content
             result.html_content = html_content
             
             # Process conversion messages
@@ -118,17 +553,16 @@ class WordProcessor:
                 elif message.type == 'error':
                     result.errors.append(message.message)
             
-            # Extract images if requested
-            if extract_images:
-                images = self._extract_images(file_path)
-                result.images = images
-                
-            # Parse questions from text content
-            questions = self._parse_questions(text_content)
+            # Parse questions from text content and its formatting
+            questions = self._parse_questions(text_content, line_spans, result.warnings)
             result.questions = questions
+
+            if image_collector:
+                image_collector.link_questions(questions)
+                result.images = image_collector.images
             
             # Generate statistics
-            result.statistics = self._generate_statistics(questions, images)
+            result.statistics = self._generate_statistics(questions, result.images)
             
             result.success = True
             
@@ -137,8 +571,164 @@ class WordProcessor:
             
         return result
     
-    def _extract_content(self, file_path: str) -> Tuple[str, str, List[Any]]:
-        """Extract text and HTML content from DOCX file"""
+    def process_archive(self, archive_path: str, extract_images: bool = True,
+                        image_dir: Optional[str] = None, fields: Optional[set] = None,
+                        workers: int = DEFAULT_ARCHIVE_WORKERS,
+                        media_dir: Optional[str] = None) -> ArchiveResult:
+        """
+        Process every DOCX file in a ZIP archive
+
+        Documents are read member by member, without unpacking the archive,
+        and processed in a pool of worker processes. The remaining members are
+        indexed once as bundled media, and each document's [AUDIO: ...] and
+        [IMAGE: ...] references are resolved against that index.
+
+        Args:
+            archive_path: Path to the ZIP archive
+            extract_images: Whether to extract images embedded in the documents
+            image_dir: Content-addressed store to write embedded images to
+            fields: Output fields of each document result (see OUTPUT_FIELDS)
+            workers: Number of worker processes; 1 processes in this process
+            media_dir: Copy the referenced bundled media to this directory;
+                the media map then holds file paths instead of member names
+
+        Returns:
+            ArchiveResult with one ArchiveDocument per DOCX member
+        """
+        result = ArchiveResult(success=False, documents=[], errors=[], statistics={})
+
+        try:
+            with zipfile.ZipFile(archive_path) as archive:
+                member_names = [info.filename for info in archive.infolist()
+                                if not info.is_dir() and not info.filename.startswith(ARCHIVE_SKIP_PREFIXES)]
+            docx_names = [name for name in member_names if name.lower().endswith('.docx')]
+            # Skip the ~$ lock files Word leaves next to open documents
+            document_names = [name for name in docx_names if not posixpath.basename(name).startswith('~$')]
+            media_index = MediaIndex([name for name in member_names if name not in docx_names])
+        except (OSError, zipfile.BadZipFile) as e:
+            result.errors.append(f"Cannot read archive: {str(e)}")
+            return result
+
+        if not document_names:
+            result.errors.append("No DOCX documents found in archive")
+            return result
+
+        task_args = [(archive_path, name, extract_images, image_dir, fields) for name in document_names]
+        if workers <= 1 or len(document_names) == 1:
+            results = [self._archive_member_result(lambda args=args: _process_archive_member(*args))
+                       for args in task_args]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(_process_archive_member, *args) for args in task_args]
+                results = [self._archive_member_result(future.result) for future in futures]
+
+        for name, document_result in zip(document_names, results):
+            document = ArchiveDocument(name=name, result=document_result)
+            self._resolve_media(document, media_index)
+            result.documents.append(document)
+
+        if media_dir:
+            self._copy_media(archive_path, result.documents, media_dir)
+
+        result.statistics = self._archive_statistics(result.documents, len(media_index))
+        result.success = True
+        return result
+
+    def _archive_member_result(self, get_result) -> ProcessingResult:
+        """Result of a document task, or a failed result if the task itself raised"""
+        try:
+            return get_result()
+        except Exception as e:
+            return ProcessingResult(
+                success=False, text_content="", html_content="", questions=[], images=[],
+                errors=[f"Processing error: {str(e)}"], warnings=[],
+                statistics=self._generate_statistics([], []))
+
+    def _resolve_media(self, document: ArchiveDocument, media_index: MediaIndex):
+        """Map a document's media references to bundled archive members"""
+        for question in document.result.questions:
+            for reference in question.media_references:
+                # Markers of images embedded in the document itself are not bundled media
+                if (EMBEDDED_IMAGE_NAME.match(reference) or reference in document.media
+                        or reference in document.missing_media):
+                    continue
+                member = media_index.resolve(reference)
+                if member is None:
+                    document.missing_media.append(reference)
+                else:
+                    document.media[reference] = member
+
+    def _copy_media(self, archive_path: str, archive_documents: List[ArchiveDocument], media_dir: str):
+        """
+        Stream the referenced media members out of the archive
+
+        A member that cannot be copied (outside media_dir, unreadable, disk
+        errors) is reported as a warning of every document referencing it,
+        and its references map to None instead of a file path.
+        """
+        copied: Dict[str, Optional[str]] = {}
+        failures: Dict[str, str] = {}
+        media_root = os.path.abspath(media_dir)
+        with zipfile.ZipFile(archive_path) as archive:
+            for document in archive_documents:
+                for reference, member in document.media.items():
+                    if member not in copied:
+                        copied[member] = self._copy_member(archive, member, media_root, failures)
+                    if member in failures:
+                        document.result.warnings.append(failures[member])
+                    document.media[reference] = copied[member]
+
+    def _copy_member(self, archive: zipfile.ZipFile, member: str, media_root: str,
+                     failures: Dict[str, str]) -> Optional[str]:
+        """Copy one archive member under media_root; returns its path or None"""
+        # Member names come from the archive; keep them inside media_dir
+        target = os.path.abspath(os.path.join(media_root, *member.split('/')))
+        if os.path.commonpath([media_root, target]) != media_root:
+            failures[member] = f"Skipped media outside the archive root: {member}"
+            return None
+        try:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with archive.open(member) as source, open(target, 'wb') as destination:
+                shutil.copyfileobj(source, destination, IMAGE_CHUNK_SIZE)
+        except (OSError, zipfile.BadZipFile) as e:
+            failures[member] = f"Could not copy media {member}: {str(e)}"
+            try:
+                os.remove(target)  # drop a partial copy
+            except OSError:
+                pass
+            return None
+        return target
+
+    def _archive_statistics(self, archive_documents: List[ArchiveDocument], media_files: int) -> Dict[str, int]:
+        """Sum the document statistics and add the archive counters"""
+        stats = self._generate_statistics([], [])
+        for document in archive_documents:
+            for key, value in document.result.statistics.items():
+                stats[key] = stats.get(key, 0) + value
+        stats['total_documents'] = len(archive_documents)
+        stats['failed_documents'] = sum(1 for document in archive_documents if not document.result.success)
+        stats['bundled_media_files'] = media_files
+        stats['missing_media_references'] = sum(len(document.missing_media) for document in archive_documents)
+        return stats
+
+    def _extract_content(self, file_path: Union[str, BinaryIO], include_html: bool = True,
+                         image_collector: Optional[ImageCollector] = None
+                         ) -> Tuple[str, str, List[Any], List[List[TextSpan]]]:
+        """
+        Extract text and HTML content from DOCX file
+
+        Also returns the line model: for every line of the text content, the
+        spans of text with their bold, underline and highlight state.
+        """
+        line_spans = [[]]
+
+        if not include_html:
+            # Questions are parsed from the raw text alone
+            with self._open_docx(file_path) as docx_file:
+                text_result = mammoth.docx.read(docx_file).map(
+                    lambda document: self._document_text(document, image_collector, line_spans))
+                messages = text_result.messages + self._scan_package(docx_file, image_collector)
+            return text_result.value, '', messages, line_spans
         
         # Configure mammoth options for better formatting detection
         style_map = """
@@ -147,248 +737,569 @@ class WordProcessor:
         i => em
         """
         
-        # Extract raw text
-        with open(file_path, 'rb') as docx_file:
-            text_result = mammoth.extract_raw_text(docx_file)
-            text_content = text_result.value
-            
-        # Extract HTML with formatting
-        with open(file_path, 'rb') as docx_file:
+        # Read and convert the document once: the raw text is taken from the
+        # parsed document element on its way into the HTML conversion
+        raw_text = []
+
+        def capture_raw_text(document):
+            raw_text.append(self._document_text(document, image_collector, line_spans))
+            return document
+
+        convert_options = {}
+        if image_collector:
+            convert_options['convert_image'] = mammoth.images.img_element(image_collector.img_attributes)
+
+        with self._open_docx(file_path) as docx_file:
             html_result = mammoth.convert_to_html(
                 docx_file,
                 style_map=style_map,
                 include_embedded_style_map=True,
-                include_default_style_map=True
+                include_default_style_map=True,
+                transform_document=capture_raw_text,
+                **convert_options
             )
             html_content = html_result.value
+            messages = html_result.messages + self._scan_package(docx_file, image_collector)
+
+        text_content = raw_text[0] if raw_text else ''
             
-        return text_content, html_content, html_result.messages
+        return text_content, html_content, messages, line_spans
+
+    def _scan_package(self, docx_file: BinaryIO, image_collector: Optional[ImageCollector]) -> List[Any]:
+        """Conversion warnings for the package media no body paragraph shows"""
+        if image_collector is None:
+            return []
+        return [mammoth.results.warning(message) for message in image_collector.scan_package(docx_file)]
+
+    def _open_docx(self, file_path: Union[str, BinaryIO]):
+        """Open a DOCX path, or pass an already open file object through"""
+        if isinstance(file_path, str):
+            return open(file_path, 'rb')
+        return nullcontext(file_path)
+
+    def _document_text(self, element: Any, image_collector: Optional[ImageCollector] = None,
+                       line_spans: Optional[List[List[TextSpan]]] = None) -> str:
+        """Raw text of a mammoth document element.
+
+        Same output as mammoth.extract_raw_text, except that captured images
+        are written as [IMAGE: <filename>] markers where they appear, so they
+        end up in the media references of the question that contains them.
+        When line_spans is given, the formatted spans of every text line are
+        appended to it in the same walk.
+        """
+        parts = []
+        self._walk_document(element, image_collector, parts, line_spans, None)
+        return ''.join(parts)
+
+    def _walk_document(self, element: Any, image_collector: Optional[ImageCollector], parts: List[str],
+                       line_spans: Optional[List[List[TextSpan]]], run: Optional['documents.Run']):
+        if isinstance(element, documents.Text):
+            self._append_text(element.value, run, parts, line_spans)
+        elif isinstance(element, documents.Tab):
+            self._append_text('\t', run, parts, line_spans)
+        elif isinstance(element, documents.Image):
+            if image_collector is not None:
+                marker = f"[IMAGE: {image_collector.capture(element).filename}]"
+                self._append_text(marker, None, parts, line_spans)
+        else:
+            if isinstance(element, documents.Run):
+                run = element
+            for child in getattr(element, 'children', []):
+                self._walk_document(child, image_collector, parts, line_spans, run)
+            if isinstance(element, documents.Paragraph):
+                self._append_text('\n\n', None, parts, line_spans)
+
+    def _append_text(self, text: str, run: Optional['documents.Run'], parts: List[str],
+                     line_spans: Optional[List[List[TextSpan]]]):
+        parts.append(text)
+        if line_spans is None:
+            return
+
+        for i, piece in enumerate(text.split('\n')):
+            if i:
+                line_spans.append([])
+            if piece:
+                line_spans[-1].append(TextSpan(
+                    text=piece,
+                    bold=bool(run and run.is_bold),
+                    underline=bool(run and run.is_underline),
+                    highlight=bool(run and run.highlight)
+                ))
     
-    def _extract_images(self, file_path: str) -> List[ExtractedImage]:
-        """Extract images from DOCX file"""
-        images = []
-        
+    def stream_docx_file(self, file_path: str, output, extract_images: bool = False,
+                         image_dir: Optional[str] = None) -> bool:
+        """
+        Process a DOCX file and write the result as NDJSON while parsing
+
+        One compact ``{"record": "question", ...}`` line is written and flushed
+        per question as soon as its block is parsed, then one line per image
+        and a final ``{"record": "summary", ...}`` line with success, errors,
+        warnings and statistics. Nothing is accumulated besides the counters.
+
+        Args:
+            file_path: Path to the DOCX file
+            output: Text stream to write the records to
+            extract_images: Whether to extract images from the document
+            image_dir: Content-addressed store to write images to
+
+        Returns:
+            Whether processing succeeded
+        """
+        success = False
+        errors = []
+        warnings = []
+        statistics = self._generate_statistics([], [])
+
         try:
-            # DOCX files are ZIP archives
-            with zipfile.ZipFile(file_path, 'r') as docx_zip:
-                # Look for images in media folder
-                media_files = [f for f in docx_zip.namelist() if f.startswith('word/media/')]
-                
-                for media_file in media_files:
-                    try:
-                        # Read image data
-                        image_data = docx_zip.read(media_file)
-                        
-                        # Determine content type based on file extension
-                        file_ext = Path(media_file).suffix.lower()
-                        content_type_map = {
-                            '.png': 'image/png',
-                            '.jpg': 'image/jpeg',
-                            '.jpeg': 'image/jpeg',
-                            '.gif': 'image/gif',
-                            '.bmp': 'image/bmp',
-                            '.webp': 'image/webp'
-                        }
-                        content_type = content_type_map.get(file_ext, 'image/jpeg')
-                        
-                        # Create ExtractedImage object
-                        image = ExtractedImage(
-                            filename=Path(media_file).name,
-                            content_type=content_type,
-                            data=base64.b64encode(image_data).decode('utf-8'),
-                            size=len(image_data),
-                            original_path=media_file
-                        )
-                        
-                        images.append(image)
-                        
-                    except Exception as e:
-                        print(f"Error extracting image {media_file}: {e}")
-                        
+            if not os.path.exists(file_path):
+                errors.append(f"File not found: {file_path}")
+            else:
+                image_collector = ImageCollector(image_dir) if extract_images else None
+                text_content, _, conversion_messages, line_spans = self._extract_content(
+                    file_path, include_html=False, image_collector=image_collector)
+
+                for message in conversion_messages:
+                    if message.type == 'warning':
+                        warnings.append(message.message)
+                    elif message.type == 'error':
+                        errors.append(message.message)
+
+                for question in self._iter_questions(text_content, line_spans, warnings):
+                    if extract_images:
+                        image_collector.link_questions([question])
+                    self._count_question(statistics, question)
+                    self._write_record(output, 'question', question)
+
+                if extract_images:
+                    for image in image_collector.images:
+                        self._write_record(output, 'image', image)
+                    statistics['total_images'] = len(image_collector.images)
+
+                success = True
+
         except Exception as e:
-            print(f"Error opening DOCX file for image extraction: {e}")
-            
-        return images
-    
-    def _parse_questions(self, text_content: str) -> List[ParsedQuestion]:
+            errors.append(f"Processing error: {str(e)}")
+
+        self._write_record(output, 'summary', {
+            'success': success,
+            'errors': errors,
+            'warnings': warnings,
+            'statistics': statistics
+        })
+        return success
+
+    def _write_record(self, output, record: str, data: Any):
+        """Write one NDJSON record and flush it so the reader sees it at once"""
+        if isinstance(data, ParsedQuestion):
+            body = question_to_json(data)
+        elif isinstance(data, ExtractedImage):
+            body = image_to_json(data)
+        else:
+            body = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+        # Splice the record kind in front of the object's own fields
+        output.write(f'{{"record":{encode_basestring(record)},{body[1:]}\n')
+        output.flush()
+
+    def _parse_questions(self, text_content: str,
+                         line_spans: Optional[List[List[TextSpan]]] = None,
+                         warnings: Optional[List[str]] = None) -> List[ParsedQuestion]:
         """Parse questions from text content"""
-        questions = []
-        
+        return list(self._iter_questions(text_content, line_spans, warnings))
+
+    def _iter_questions(self, text_content: str, line_spans: Optional[List[List[TextSpan]]] = None,
+                        warnings: Optional[List[str]] = None):
+        """
+        Yield parsed questions block by block
+
+        line_spans is the line model from _extract_content. With it, correct
+        answers are detected from their formatting; without it (plain text
+        input) only inline markers such as <u> are recognized. Placeholder
+        mismatches in group blocks are appended to warnings when given.
+        """
+        if warnings is None:
+            warnings = []
         try:
-            # Clean and split text into blocks
-            blocks = self._split_into_question_blocks(text_content)
+            # Blocks are (start, end) line spans over a single list of lines
+            lines = self._split_lines(text_content)
+            spans = self._split_into_block_spans(lines)
+            if line_spans is not None and len(line_spans) != len(lines):
+                print("Line model does not match the text, ignoring formatting", file=sys.stderr)
+                line_spans = None
             
-            for i, block in enumerate(blocks):
-                if not block.strip():
-                    continue
-                    
+            for i, (start, end) in enumerate(spans):
                 try:
-                    if self.question_patterns['single_marker'] in block:
-                        question = self._parse_single_question(block, i + 1)
+                    block_type = self._block_type(lines, start, end)
+                    if block_type == 'single':
+                        question = self._parse_single_question(lines, start, end, i + 1, line_spans)
                         if question:
-                            questions.append(question)
-                    elif self.question_patterns['group_marker'] in block:
-                        group_questions = self._parse_group_question(block, i + 1)
-                        questions.extend(group_questions)
-                    elif self.question_patterns['fill_blank_marker'] in block:
-                        fill_blank_questions = self._parse_fill_blank_question(block, i + 1)
-                        questions.extend(fill_blank_questions)
+                            yield question
+                    elif block_type == 'group':
+                        yield from self._parse_group_question(lines, start, end, i + 1, line_spans, warnings)
+                    elif block_type == 'fill-in-blank':
+                        yield from self._parse_fill_blank_question(lines, start, end, i + 1, line_spans, warnings)
                         
                 except Exception as e:
-                    print(f"Error parsing question block {i + 1}: {e}")
+                    print(f"Error parsing question block {i + 1}: {e}", file=sys.stderr)
                     
         except Exception as e:
-            print(f"Error parsing questions: {e}")
-            
-        return questions
-    
-    def _split_into_question_blocks(self, text: str) -> List[str]:
-        """Split text into question blocks"""
-        # Clean text
+            print(f"Error parsing questions: {e}", file=sys.stderr)
+
+    def _split_lines(self, text: str) -> List[str]:
+        """Normalize line endings and strip every line"""
         text = text.replace('\r\n', '\n').replace('\r', '\n')
-        text = re.sub(r'\n{3,}', '\n\n', text).strip()
-        
-        blocks = []
-        lines = text.split('\n')
-        current_block = ''
+        return [line.strip() for line in text.split('\n')]
+
+    def _is_type_marker_line(self, line: str) -> bool:
+        return (self.question_patterns['single_marker'] in line or
+                self.question_patterns['group_marker'] in line or
+                self.question_patterns['fill_blank_marker'] in line)
+
+    def _split_into_block_spans(self, lines: List[str]) -> List[Tuple[int, int]]:
+        """Split lines into question blocks in one pass, as [start, end) spans"""
+        spans = []
+        start = 0
+        has_content = False
         in_group = False
         
-        for line in lines:
-            line = line.strip()
-            
+        for i, line in enumerate(lines):
             # Check for question type markers
-            if any(marker in line for marker in [
-                self.question_patterns['single_marker'],
-                self.question_patterns['group_marker'], 
-                self.question_patterns['fill_blank_marker']
-            ]):
-                if current_block.strip():
-                    blocks.append(current_block.strip())
-                    current_block = ''
-                current_block += line + '\n'
+            if self._is_type_marker_line(line):
+                if has_content:
+                    spans.append((start, i))
+                start = i
+                has_content = True
             elif line == self.question_patterns['group_start']:
                 in_group = True
-                current_block += line + '\n'
+                has_content = True
             elif line == self.question_patterns['group_end']:
-                current_block += line + '\n'
                 in_group = False
+                has_content = True
             elif line == '(KETTHUCNHOM)' or line == '(KETTHUCDIENKHUYET)':
-                current_block += line + '\n'
-                blocks.append(current_block.strip())
-                current_block = ''
+                spans.append((start, i + 1))
+                start = i + 1
+                has_content = False
             elif line == self.question_patterns['question_separator'] and not in_group:
-                if current_block.strip():
-                    blocks.append(current_block.strip())
-                    current_block = ''
-            else:
-                current_block += line + '\n'
+                if has_content:
+                    spans.append((start, i))
+                start = i + 1
+                has_content = False
+            elif line:
+                has_content = True
         
-        if current_block.strip():
-            blocks.append(current_block.strip())
+        if has_content:
+            spans.append((start, len(lines)))
             
-        return [block for block in blocks if block]
+        return spans
+
+    def _split_into_question_blocks(self, text: str) -> List[str]:
+        """Split text into question blocks"""
+        lines = self._split_lines(text)
+        return ['\n'.join(lines[start:end]).strip()
+                for start, end in self._split_into_block_spans(lines)]
+
+    def _block_type(self, lines: List[str], start: int, end: int) -> Optional[str]:
+        """Question type of a block, taken from its type marker"""
+        for index in range(start, end):
+            line = lines[index]
+            if self.question_patterns['single_marker'] in line:
+                return 'single'
+            if self.question_patterns['group_marker'] in line:
+                return 'group'
+            if self.question_patterns['fill_blank_marker'] in line:
+                return 'fill-in-blank'
+        return None
     
-    def _parse_single_question(self, block: str, order: int) -> Optional[ParsedQuestion]:
+    def _parse_single_question(self, lines: List[str], start: int, end: int, order: int,
+                               line_spans: Optional[List[List[TextSpan]]] = None) -> Optional[ParsedQuestion]:
         """Parse a single question block"""
         try:
-            lines = [line.strip() for line in block.split('\n') if line.strip()]
-            
-            content_lines = []
-            answer_lines = []
-            clo = None
-            in_answers = False
-            
-            for line in lines:
-                # Skip question type marker
-                if self.question_patterns['single_marker'] in line:
-                    continue
-                    
-                # Check if this is an answer line
-                if self.question_patterns['answer_pattern'].match(line):
-                    in_answers = True
-                    answer_lines.append(line)
-                elif in_answers:
-                    answer_lines.append(line)
-                else:
-                    # Extract CLO
-                    clo_match = self.question_patterns['clo_pattern'].search(line)
-                    if clo_match:
-                        clo = clo_match.group(1)
-                        clean_line = self.question_patterns['clo_pattern'].sub('', line).strip()
-                        if clean_line:
-                            content_lines.append(clean_line)
-                    else:
-                        content_lines.append(line)
-            
-            content = ' '.join(content_lines).strip()
-            answers = self._parse_answers(answer_lines)
-            media_refs = self._extract_media_references(content)
-            
-            return ParsedQuestion(
-                type='single',
-                content=content,
-                answers=answers,
-                clo=clo,
-                order=order,
-                media_references=media_refs
-            )
-            
+            return self._parse_question_lines(
+                lines, start, end, order, 'single', line_spans,
+                type_marker=self.question_patterns['single_marker'])
         except Exception as e:
-            print(f"Error parsing single question: {e}")
+            print(f"Error parsing single question: {e}", file=sys.stderr)
             return None
+
+    def _parse_question_lines(self, lines: List[str], start: int, end: int, order: int,
+                              question_type: str, line_spans: Optional[List[List[TextSpan]]] = None,
+                              type_marker: Optional[str] = None,
+                              child_pattern: Optional[re.Pattern] = None) -> ParsedQuestion:
+        """Parse question content and answers from a line span"""
+        content_lines = []
+        answer_lines = []
+        answer_spans = []
+        clo = None
+        placeholder_number = None
+        in_answers = False
+
+        for index in range(start, end):
+            line = lines[index]
+            if not line:
+                continue
+
+            # Skip question type marker
+            if type_marker and type_marker in line:
+                continue
+
+            # Child markers such as (NHOM – 2) give the placeholder number
+            if child_pattern:
+                child_match = child_pattern.search(line)
+                if child_match:
+                    placeholder_number = int(child_match.group(1))
+                    line = child_pattern.sub('', line).strip()
+                    if not line:
+                        continue
+                
+            # Check if this is an answer line
+            if self.question_patterns['answer_pattern'].match(line):
+                in_answers = True
+                answer_lines.append(line)
+                if line_spans is not None:
+                    answer_spans.append(line_spans[index])
+            elif in_answers:
+                answer_lines.append(line)
+                if line_spans is not None:
+                    answer_spans.append(line_spans[index])
+            else:
+                # Extract CLO
+                clo_match = self.question_patterns['clo_pattern'].search(line)
+                if clo_match:
+                    clo = clo_match.group(1)
+                    clean_line = self.question_patterns['clo_pattern'].sub('', line).strip()
+                    if clean_line:
+                        content_lines.append(clean_line)
+                else:
+                    content_lines.append(line)
+        
+        content = ' '.join(content_lines).strip()
+        answers = self._parse_answers(answer_lines, answer_spans if line_spans is not None else None)
+        media_refs = self._extract_media_references(content)
+        for answer in answers:
+            media_refs.extend(self._extract_media_references(answer.content))
+        
+        return ParsedQuestion(
+            type=question_type,
+            content=content,
+            answers=answers,
+            clo=clo,
+            order=order,
+            media_references=media_refs,
+            placeholder_number=placeholder_number
+        )
     
-    def _parse_group_question(self, block: str, order: int) -> List[ParsedQuestion]:
+    def _parse_group_question(self, lines: List[str], start: int, end: int, order: int,
+                              line_spans: Optional[List[List[TextSpan]]] = None,
+                              warnings: Optional[List[str]] = None) -> List[ParsedQuestion]:
         """Parse a group question block"""
-        # This is a simplified implementation
-        # In a full implementation, you would parse the group structure
-        return []
+        return self._parse_grouped_block(
+            lines, start, end, order, line_spans, 'group',
+            self.question_patterns['group_marker'],
+            self.question_patterns['group_child_pattern'], warnings)
     
-    def _parse_fill_blank_question(self, block: str, order: int) -> List[ParsedQuestion]:
+    def _parse_fill_blank_question(self, lines: List[str], start: int, end: int, order: int,
+                                   line_spans: Optional[List[List[TextSpan]]] = None,
+                                   warnings: Optional[List[str]] = None) -> List[ParsedQuestion]:
         """Parse a fill-in-blank question block"""
-        # This is a simplified implementation
-        # In a full implementation, you would parse the fill-in-blank structure
-        return []
+        return self._parse_grouped_block(
+            lines, start, end, order, line_spans, 'fill-in-blank',
+            self.question_patterns['fill_blank_marker'],
+            self.question_patterns['fill_blank_child_pattern'], warnings)
+
+    def _parse_grouped_block(self, lines: List[str], start: int, end: int, order: int,
+                             line_spans: Optional[List[List[TextSpan]]], child_type: str, type_marker: str,
+                             child_pattern: re.Pattern,
+                             warnings: Optional[List[str]] = None) -> List[ParsedQuestion]:
+        """
+        Parse a (NHOM) or (DIENKHUYET) block into a parent and its children
+
+        The shared passage sits between [<sg>] and [<egc>]; child questions
+        follow up to [</sg>], separated by [<br>] or started by a child
+        marker such as (NHOM – 1). Children keep their marker number as
+        placeholder_number, matching the {<n>} placeholders in the passage
+        (see _map_placeholders).
+        """
+        passage_lines = []
+        child_spans = []
+        clo = None
+        child_start = None
+        in_passage = False
+        stop = end
+
+        for index in range(start, end):
+            line = lines[index]
+
+            if line == self.question_patterns['group_end']:
+                stop = index
+                break
+            if line == self.question_patterns['group_start']:
+                in_passage = True
+                continue
+            if line == self.question_patterns['group_content_end']:
+                in_passage = False
+                child_start = index + 1
+                continue
+
+            if in_passage or child_start is None:
+                if not line or type_marker in line:
+                    continue
+                if child_pattern.search(line):
+                    # No passage markers: children start at the first child marker
+                    child_start = index
+                    continue
+                clo_match = self.question_patterns['clo_pattern'].search(line)
+                if clo_match:
+                    clo = clo_match.group(1)
+                    line = self.question_patterns['clo_pattern'].sub('', line).strip()
+                if line:
+                    passage_lines.append(line)
+                continue
+
+            if line == self.question_patterns['question_separator']:
+                child_spans.append((child_start, index))
+                child_start = index + 1
+            elif child_pattern.search(line) and index > child_start:
+                child_spans.append((child_start, index))
+                child_start = index
+
+        if child_start is not None:
+            child_spans.append((child_start, stop))
+
+        passage = '\n'.join(passage_lines)
+        children = []
+        for child_start, child_end in child_spans:
+            if not any(lines[i] for i in range(child_start, child_end)):
+                continue
+            child = self._parse_question_lines(
+                lines, child_start, child_end, len(children) + 1, child_type, line_spans,
+                child_pattern=child_pattern)
+            child.parent_order = order
+            if child.clo is None:
+                child.clo = clo
+            children.append(child)
+
+        self._map_placeholders(passage, children, order, warnings if warnings is not None else [])
+
+        parent = ParsedQuestion(
+            type='parent',
+            content=passage,
+            answers=[],
+            clo=clo,
+            order=order,
+            media_references=self._extract_media_references(passage),
+            child_count=len(children)
+        )
+        return [parent] + children
     
-    def _parse_answers(self, answer_lines: List[str]) -> List[ParsedAnswer]:
-        """Parse answer options from lines"""
-        answers = []
-        current_answer = ''
-        current_letter = ''
-        order = 0
+    def _passage_placeholders(self, passage: str) -> List[int]:
+        """Placeholder numbers of a passage in order, with ranges expanded"""
+        numbers: List[int] = []
+        previous = None
+        for match in self.question_patterns['placeholder_pattern'].finditer(passage):
+            number = int(match.group(1))
+            between = passage[previous.end():match.start()] if previous else ''
+            if previous and self.question_patterns['placeholder_range_separator'].match(between):
+                numbers.extend(range(int(previous.group(1)) + 1, number + 1))
+            else:
+                numbers.append(number)
+            previous = match
+        return list(dict.fromkeys(numbers))
+
+    def _map_placeholders(self, passage: str, children: List[ParsedQuestion], order: int,
+                          warnings: List[str]):
+        """
+        Match the children of a group block to the {<n>} placeholders of its passage
+
+        A child without a child marker takes the first placeholder no other
+        child claims. Unmarked children, placeholders without a child and
+        child numbers the passage does not contain are reported as warnings.
+        """
+        placeholders = self._passage_placeholders(passage)
+        marked = any(child.placeholder_number is not None for child in children)
+        if not placeholders and not marked:
+            return  # a plain shared passage, children are numbered by position
+
+        claimed = {child.placeholder_number for child in children}
+        unclaimed = [number for number in placeholders if number not in claimed]
+        for child in children:
+            if child.placeholder_number is None:
+                assigned = unclaimed.pop(0) if unclaimed else None
+                child.placeholder_number = assigned
+                target = f"placeholder {{<{assigned}>}}" if assigned is not None else "no placeholder"
+                warnings.append(f"Question block {order}: child {child.order} has no child marker, "
+                                f"matched to {target}")
+            elif placeholders and child.placeholder_number not in placeholders:
+                warnings.append(f"Question block {order}: child {child.order} is marked "
+                                f"{child.placeholder_number} but the passage has no "
+                                f"{{<{child.placeholder_number}>}} placeholder")
+
+        for number in unclaimed:
+            warnings.append(f"Question block {order}: placeholder {{<{number}>}} has no child question")
+
+    def _parse_answers(self, answer_lines: List[str],
+                       answer_spans: Optional[List[List[TextSpan]]] = None) -> List[ParsedAnswer]:
+        """
+        Parse answer options from lines
+
+        answer_spans holds the formatted spans of each answer line. When it is
+        given, correctness is decided from formatting; otherwise from inline
+        markers in the text.
+        """
+        options = []  # (letter, content parts, spans) per answer option
         
-        for line in answer_lines:
+        for i, line in enumerate(answer_lines):
+            spans = answer_spans[i] if answer_spans is not None else []
             answer_match = self.question_patterns['answer_pattern'].match(line)
             
             if answer_match:
-                # Save previous answer
-                if current_answer and current_letter:
-                    answers.append(ParsedAnswer(
-                        letter=current_letter,
-                        content=current_answer.strip(),
-                        is_correct=self._is_correct_answer(current_answer),
-                        order=order
-                    ))
-                    order += 1
-                
-                current_letter = answer_match.group(1)
-                current_answer = answer_match.group(2)
-            else:
-                current_answer += ' ' + line
+                options.append((answer_match.group(1), [answer_match.group(2)], list(spans)))
+            elif options:
+                options[-1][1].append(line)
+                options[-1][2].extend(spans)
         
-        # Save last answer
-        if current_answer and current_letter:
+        answers = []
+        kept_spans = []
+        for letter, parts, spans in options:
+            current_answer = ' '.join(parts)
+            if not current_answer:
+                continue
             answers.append(ParsedAnswer(
-                letter=current_letter,
+                letter=letter,
                 content=current_answer.strip(),
                 is_correct=self._is_correct_answer(current_answer),
-                order=order
+                order=len(answers)
             ))
+            kept_spans.append(spans)
+
+        if answer_spans is not None:
+            for answer, is_correct in zip(answers, self._correct_by_formatting(kept_spans)):
+                answer.is_correct = is_correct
         
         return answers
+
+    def _correct_by_formatting(self, answers_spans: List[List[TextSpan]]) -> List[bool]:
+        """
+        Decide which answers are correct from their formatting
+
+        Underlined or highlighted text marks a correct answer. Bold only counts
+        when no answer is underlined or highlighted and not every answer is
+        bold, since some documents bold all answer letters.
+        """
+        marked = []
+        bold = []
+        for spans in answers_spans:
+            visible = [span for span in spans if span.text.strip()]
+            marked.append(any(span.underline or span.highlight for span in visible))
+            bold.append(any(span.bold for span in visible))
+
+        if any(marked):
+            return marked
+        if any(bold) and not all(bold):
+            return bold
+        return [False] * len(answers_spans)
     
     def _is_correct_answer(self, content: str) -> bool:
-        """Check if answer content indicates it's the correct answer"""
-        # Check for underline, bold, or other formatting indicators
+        """Check if answer text carries an inline correct-answer marker"""
+        # Only plain-text input can carry these; documents use the line model
         indicators = ['<u>', '</u>', '<b>', '</b>', '<strong>', '</strong>', '_', '__']
         return any(indicator in content for indicator in indicators)
     
@@ -411,28 +1322,95 @@ class WordProcessor:
     def _generate_statistics(self, questions: List[ParsedQuestion], images: List[ExtractedImage]) -> Dict[str, int]:
         """Generate processing statistics"""
         stats = {
-            'total_questions': len(questions),
-            'single_questions': len([q for q in questions if q.type == 'single']),
-            'group_questions': len([q for q in questions if q.type == 'group']),
-            'fill_blank_questions': len([q for q in questions if q.type == 'fill-in-blank']),
+            'total_questions': 0,
+            'single_questions': 0,
+            'group_questions': 0,
+            'fill_blank_questions': 0,
             'total_images': len(images),
-            'questions_with_media': len([q for q in questions if q.media_references]),
-            'total_media_references': sum(len(q.media_references) for q in questions)
+            'questions_with_media': 0,
+            'total_media_references': 0
         }
+        for question in questions:
+            self._count_question(stats, question)
         return stats
 
+    def _count_question(self, stats: Dict[str, int], question: ParsedQuestion):
+        """Add one question to the running statistics"""
+        stats['total_questions'] += 1
+        if question.type == 'single':
+            stats['single_questions'] += 1
+        elif question.type == 'group':
+            stats['group_questions'] += 1
+        elif question.type == 'fill-in-blank':
+            stats['fill_blank_questions'] += 1
+        if question.media_references:
+            stats['questions_with_media'] += 1
+        stats['total_media_references'] += len(question.media_references)
+
 def main():
     """Main function for command line usage"""
     parser = argparse.ArgumentParser(description='Process Word documents with mammoth')
-    parser.add_argument('input_file', help='Path to input DOCX file')
+    parser.add_argument('input_file', help='Path to input DOCX file, or a ZIP archive of DOCX files and media')
     parser.add_argument('--output', '-o', help='Output JSON file path')
     parser.add_argument('--extract-images', action='store_true', help='Extract images from document')
+    parser.add_argument('--image-dir', help='Write extracted images to this content-addressed directory '
+                                            'instead of embedding them as base64')
+    parser.add_argument('--fields', help='Comma-separated output fields to build and write '
+                                         f'(default: all of {",".join(OUTPUT_FIELDS)})')
+    parser.add_argument('--ndjson', action='store_true',
+                        help='Stream one JSON record per question while parsing, then a summary record')
+    parser.add_argument('--workers', type=int, default=DEFAULT_ARCHIVE_WORKERS,
+                        help=f'Worker processes for ZIP input (default: {DEFAULT_ARCHIVE_WORKERS})')
+    parser.add_argument('--media-dir', help='For ZIP input, copy the referenced bundled media to this directory')
+    parser.add_argument('--compress', choices=COMPRESSION_ENCODINGS,
+                        help='Compress JSON output larger than --compress-threshold; compressed output '
+                             f'starts with a "{COMPRESSION_HEADER} encoding=<name>" line')
+    parser.add_argument('--compress-threshold', type=int, default=DEFAULT_COMPRESS_THRESHOLD,
+                        help=f'Output size in bytes above which --compress applies '
+                             f'(default: {DEFAULT_COMPRESS_THRESHOLD})')
     parser.add_argument('--verbose', '-v', action='store_true', help='Verbose output')
     
     args = parser.parse_args()
+    is_archive = args.input_file.lower().endswith('.zip')
+    if is_archive and args.ndjson:
+        parser.error("--ndjson is not supported for ZIP input")
+    if args.compress and args.ndjson:
+        parser.error("--compress is not supported with --ndjson")
+
+    fields = None
+    if args.fields:
+        fields = {field.strip() for field in args.fields.split(',') if field.strip()}
+        unknown = fields - set(OUTPUT_FIELDS)
+        if unknown:
+            parser.error(f"Unknown fields: {', '.join(sorted(unknown))}")
     
     processor = WordProcessor()
-    result = processor.process_docx_file(args.input_file, args.extract_images)
+
+    if args.ndjson:
+        # Success is reported in the summary record, as in the JSON output
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                processor.stream_docx_file(args.input_file, f, args.extract_images, args.image_dir)
+        else:
+            processor.stream_docx_file(args.input_file, sys.stdout, args.extract_images, args.image_dir)
+        return
+
+    if is_archive:
+        archive_result = processor.process_archive(args.input_file, args.extract_images, args.image_dir,
+                                                   fields, args.workers, args.media_dir)
+        if args.verbose:
+            print(f"Processing result: {archive_result.success}")
+            print(f"Documents: {archive_result.statistics.get('total_documents', 0)}")
+            print(f"Missing media references: {archive_result.statistics.get('missing_media_references', 0)}")
+        with open_result_output(args.output, args.compress, args.compress_threshold) as output:
+            write_archive_json(archive_result, output, fields)
+            if not args.output:
+                output.write('\n')
+        if args.output:
+            print(f"Results saved to {args.output}")
+        return
+
+    result = processor.process_docx_file(args.input_file, args.extract_images, args.image_dir, fields)
     
     if args.verbose:
         print(f"Processing result: {result.success}")
@@ -441,24 +1419,13 @@ def main():
         print(f"Errors: {len(result.errors)}")
         print(f"Warnings: {len(result.warnings)}")
     
-    # Convert result to JSON
-    output_data = {
-        'success': result.success,
-        'text_content': result.text_content,
-        'html_content': result.html_content,
-        'questions': [asdict(q) for q in result.questions],
-        'images': [asdict(img) for img in result.images],
-        'errors': result.errors,
-        'warnings': result.warnings,
-        'statistics': result.statistics
-    }
-    
+    # Serialize only the requested fields, straight from the result objects
+    with open_result_output(args.output, args.compress, args.compress_threshold) as output:
+        write_result_json(result, output, fields)
+        if not args.output:
+            output.write('\n')
     if args.output:
-        with open(args.output, 'w', encoding='utf-8') as f:
-            json.dump(output_data, f, ensure_ascii=False, indent=2)
         print(f"Results saved to {args.output}")
-    else:
-        print(json.dumps(output_data, ensure_ascii=False, indent=2))
 
 if __name__ == '__main__':
     main()
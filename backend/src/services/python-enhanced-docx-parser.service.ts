@@ -16,6 +16,8 @@ export interface PythonParsedQuestion {
     inGroup?: boolean;
     groupId?: string;
     groupContent?: string;
+    contentHtml?: string;
+    groupContentHtml?: string;
 }
 
 export interface PythonParsedAnswer {
@@ -23,6 +25,7 @@ export interface PythonParsedAnswer {
     content: string;
     isCorrect: boolean;
     order: number;
+    contentHtml?: string;
 }
 
 export interface PythonParsingResult {
@@ -72,6 +75,9 @@ export class PythonEnhancedDocxParserService {
             processImages?: boolean;
             extractStyles?: boolean;
             preserveLatex?: boolean;
+            // Adds contentHtml to the parse result; off until a preview shows it
+            emitHtml?: boolean;
+            mediaBaseUrl?: string;
             maxQuestions?: number;
         } = {}
     ): Promise<PythonParsingResult> {
@@ -79,6 +85,8 @@ export class PythonEnhancedDocxParserService {
             processImages = true,
             extractStyles = true,
             preserveLatex = true,
+            emitHtml = false,
+            mediaBaseUrl,
             maxQuestions = 100
         } = options;
 
@@ -111,6 +119,15 @@ export class PythonEnhancedDocxParserService {
                 args.push('--preserve-latex');
             }
 
+            // Sanitized HTML lets the preview pass questions straight through
+            if (emitHtml) {
+                args.push('--emit-html');
+            }
+
+            if (mediaBaseUrl) {
+                args.push('--media-base-url', mediaBaseUrl);
+            }
+
             // Execute Python script
             const result = await this.executePythonScript(args);
 
@@ -1,7 +1,11 @@
-import { Injectable, Logger, BadRequestException } from '@nestjs/common';
-import { spawn } from 'child_process';
+import { Injectable, Logger, BadRequestException, OnModuleDestroy } from '@nestjs/common';
+import { ChildProcess, spawn } from 'child_process';
+import { randomUUID } from 'crypto';
 import * as path from 'path';
 import * as fs from 'fs';
+import * as readline from 'readline';
+import { Readable } from 'stream';
+import { ExamWordExportService } from '../modules/exam-word-export/exam-word-export.service';
 
 export interface PythonExportOptions {
     examTitle: string;
@@ -11,6 +15,8 @@ export interface PythonExportOptions {
     academicYear: string;
     examDate: string;
     duration: string;
+    // Mã đề printed in the template header
+    examCode?: string;
     instructions: string;
     allowMaterials: boolean;
     showAnswers: boolean;
@@ -27,21 +33,109 @@ export interface PythonExportResult {
     message: string;
     file_path?: string;
     total_questions?: number;
+    // Served from the Python export cache
+    cached?: boolean;
+    // Bytes of the document
+    size?: number;
+    // Wall time per export phase (queue, pool_wait, connect, query, images,
+    // template, render, save, ...) and the total, in milliseconds
+    timings_ms?: Record<string, number>;
+    rows?: Record<string, number>;
+    // Peak resident memory of the Python server process over its lifetime,
+    // not of this export alone
+    process_peak_rss_mb?: number | null;
+    // How far this export raised that peak (0 when it stayed below it)
+    peak_rss_growth_mb?: number;
+    // Every export step, when the job asked for a trace
+    trace?: { phase: string; start_ms: number; ms: number; [detail: string]: unknown }[];
+}
+
+interface PendingExport {
+    resolve: (result: PythonExportResult, document?: Buffer) => void;
+    reject: (error: Error) => void;
+    timer: NodeJS.Timeout;
+}
+
+/**
+ * Reads consecutive documents of known sizes from one byte stream
+ */
+class DocumentStreamReader {
+    private chunks: Buffer[] = [];
+    private buffered = 0;
+    private readonly waiting: { size: number; resolve: (data: Buffer) => void; reject: (error: Error) => void }[] = [];
+
+    constructor(stream: Readable) {
+        stream.on('data', (chunk: Buffer) => {
+            this.chunks.push(chunk);
+            this.buffered += chunk.length;
+            this.drain();
+        });
+    }
+
+    /**
+     * Take the next size bytes; reads are served in the order they are made
+     */
+    read(size: number): Promise<Buffer> {
+        return new Promise((resolve, reject) => {
+            this.waiting.push({ size, resolve, reject });
+            this.drain();
+        });
+    }
+
+    fail(error: Error) {
+        for (const read of this.waiting.splice(0)) {
+            read.reject(error);
+        }
+    }
+
+    private drain() {
+        while (this.waiting.length > 0 && this.buffered >= this.waiting[0].size) {
+            const { size, resolve } = this.waiting.shift()!;
+            const data = Buffer.concat(this.chunks, this.buffered);
+            const rest = data.subarray(size);
+            this.chunks = rest.length > 0 ? [rest] : [];
+            this.buffered = rest.length;
+            resolve(data.subarray(0, size));
+        }
+    }
 }
 
 /**
  * Service for exporting exams to Word using Python
  * Author: Linh Dang Dev
+ *
+ * Exports run in one long-lived `exam_word_exporter.py --serve` process that
+ * keeps its imports loaded and its database connections pooled. Jobs are
+ * sent as JSON lines on its stdin and answered by id on its stdout. The
+ * documents come back over a separate pipe (fd 3), so nothing is written to
+ * disk for an export. Each job carries the exam as loaded through TypeORM,
+ * so the exporter does not query the database again.
  */
 @Injectable()
-export class PythonExamWordExportService {
+export class PythonExamWordExportService implements OnModuleDestroy {
     private readonly logger = new Logger(PythonExamWordExportService.name);
     private readonly pythonScriptPath: string;
     private readonly outputDir: string;
-
-    constructor() {
+    // Concurrent exports and pooled connections in the Python server
+    private readonly serverWorkers = 4;
+    private readonly jobTimeoutSeconds = 60;
+    // Rendered documents of unchanged exams are reused from here
+    private readonly cacheDir: string;
+    private readonly cacheMb = 500;
+    // Images referenced by question content are fetched once into here
+    private readonly mediaCacheDir: string;
+    // Exports slower than this are logged as warnings with their breakdown
+    private readonly slowExportMs = Number(process.env.EXPORT_SLOW_MS) || 10000;
+    // Ask the exporter for a trace of every step (verbose)
+    private readonly traceExports = process.env.EXPORT_TRACE === 'true';
+    private exportServer: ChildProcess | null = null;
+    private readonly pendingExports = new Map<string, PendingExport>();
+
+    constructor(private readonly examWordExportService: ExamWordExportService) {
         this.pythonScriptPath = path.join(process.cwd(), 'python', 'exam_word_exporter.py');
         this.outputDir = path.join(process.cwd(), 'exports');
+        this.cacheDir = path.join(this.outputDir, 'cache');
+        this.mediaCacheDir = path.join(this.outputDir, 'media-cache');
         
         // Ensure output directory exists
         if (!fs.existsSync(this.outputDir)) {
@@ -61,41 +155,24 @@ export class PythonExamWordExportService {
                 throw new BadRequestException('Exam ID and title are required');
             }
 
-            // Generate output filename
-            const timestamp = new Date().toISOString().replace(/[:.]/g, '-');
-            const filename = `exam_${examId}_${timestamp}.docx`;
-            const outputPath = path.join(this.outputDir, filename);
+            const snapshot = await this.loadExamSnapshot(examId);
 
-            // Prepare export options for Python
-            const pythonOptions = {
-                ...options,
-                outputPath: outputPath
-            };
+            // Run the export in the Python server
+            const { result, document } = await this.runExportJob(examId, options, snapshot);
 
-            // Run Python script
-            const result = await this.runPythonScript(examId, pythonOptions);
+            this.logExportTimings(examId, result);
 
             if (!result.success) {
                 throw new BadRequestException(`Python export failed: ${result.message}`);
             }
 
-            // Read the generated file
-            if (!fs.existsSync(result.file_path!)) {
-                throw new BadRequestException('Generated file not found');
+            if (!document) {
+                throw new BadRequestException('Python export returned no document');
             }
 
-            const buffer = fs.readFileSync(result.file_path!);
-
-            // Clean up the temporary file
-            try {
-                fs.unlinkSync(result.file_path!);
-                this.logger.log(`Cleaned up temporary file: ${result.file_path}`);
-            } catch (cleanupError) {
-                this.logger.warn(`Failed to cleanup file: ${cleanupError.message}`);
-            }
-
-            this.logger.log(`Python export completed successfully for exam: ${examId}`);
-            return buffer;
+            this.logger.log(`Python export completed successfully for exam: ${examId}` +
+                (result.cached ? ' (cached)' : ''));
+            return document;
 
         } catch (error) {
             this.logger.error(`Python export error: ${error.message}`, error.stack);
@@ -104,76 +181,203 @@ export class PythonExamWordExportService {
     }
 
     /**
-     * Run Python script and return result
+     * Exam structure handed to the exporter instead of it querying the database
+     */
+    private async loadExamSnapshot(examId: string): Promise<any> {
+        const { exam, questions } = await this.examWordExportService.getExamForWordExport(examId);
+        return {
+            exam: {
+                MaDeThi: exam.MaDeThi,
+                TenDeThi: exam.TenDeThi,
+                NgayTao: exam.NgayTao,
+                DaDuyet: exam.DaDuyet,
+                TenMonHoc: exam.MonHoc?.TenMonHoc
+            },
+            // Questions deleted since the exam was built are left out, as the join does in SQL
+            questions: questions.filter(question => question.MaCauHoi).map(question => ({
+                MaCauHoi: question.MaCauHoi,
+                NoiDung: question.NoiDung,
+                MaCLO: question.MaCLO,
+                CapDo: question.CapDo,
+                MaCauHoiCha: question.MaCauHoiCha,
+                HoanVi: question.HoanVi,
+                order: question.order,
+                CauTraLoi: (question.CauTraLoi || []).map(answer => ({
+                    MaCauTraLoi: answer.MaCauTraLoi,
+                    NoiDung: answer.NoiDung,
+                    LaDapAn: answer.LaDapAn,
+                    ThuTu: answer.ThuTu,
+                    HoanVi: answer.HoanVi
+                }))
+            }))
+        };
+    }
+
+    /**
+     * Log where the time of an export went; slow exports are logged as warnings
      */
-    private async runPythonScript(examId: string, options: any): Promise<PythonExportResult> {
+    private logExportTimings(examId: string, result: PythonExportResult) {
+        const timings = result.timings_ms;
+        if (!timings) {
+            return;
+        }
+
+        const phases = Object.entries(timings)
+            .map(([phase, ms]) => `${phase}=${Math.round(ms)}ms`)
+            .join(' ');
+        const rows = Object.entries(result.rows || {})
+            .map(([name, count]) => `${name}=${count}`)
+            .join(' ');
+        const summary = `exam ${examId}: ${phases}; ${rows}; ` +
+            `size=${result.size ?? '-'}B process_peak_rss=${result.process_peak_rss_mb ?? '-'}MB ` +
+            `(+${result.peak_rss_growth_mb ?? '-'}MB)`;
+
+        // The exporter's total does not include waiting for a worker or connection
+        const totalMs = (timings.total ?? 0) + (timings.queue ?? 0) + (timings.pool_wait ?? 0);
+        if (totalMs >= this.slowExportMs) {
+            this.logger.warn(`Slow Python export, ${summary}`);
+        } else {
+            this.logger.log(`Python export timings, ${summary}`);
+        }
+        if (result.trace) {
+            this.logger.debug(`Python export trace for exam ${examId}: ${JSON.stringify(result.trace)}`);
+        }
+    }
+
+    /**
+     * Send an export job to the Python server and wait for its result
+     */
+    private runExportJob(examId: string, options: any, snapshot: any): Promise<{ result: PythonExportResult; document?: Buffer }> {
         return new Promise((resolve, reject) => {
+            let server: ChildProcess;
             try {
-                // Prepare arguments
-                const optionsJson = JSON.stringify(options);
-                const args = [this.pythonScriptPath, examId, optionsJson];
-
-                this.logger.log(`Running Python script: python3 ${args.join(' ')}`);
-
-                // Spawn Python process
-                const pythonProcess = spawn('python3', args, {
-                    stdio: ['pipe', 'pipe', 'pipe'],
-                    cwd: process.cwd()
-                });
-
-                let stdout = '';
-                let stderr = '';
-
-                // Collect output
-                pythonProcess.stdout.on('data', (data) => {
-                    stdout += data.toString();
-                });
-
-                pythonProcess.stderr.on('data', (data) => {
-                    stderr += data.toString();
-                });
-
-                // Handle process completion
-                pythonProcess.on('close', (code) => {
-                    this.logger.log(`Python process exited with code: ${code}`);
-                    
-                    if (code !== 0) {
-                        this.logger.error(`Python script failed with code ${code}`);
-                        this.logger.error(`STDERR: ${stderr}`);
-                        reject(new Error(`Python script failed: ${stderr || 'Unknown error'}`));
-                        return;
-                    }
-
-                    try {
-                        // Parse JSON result from stdout
-                        const result = JSON.parse(stdout.trim());
-                        resolve(result);
-                    } catch (parseError) {
-                        this.logger.error(`Failed to parse Python output: ${parseError.message}`);
-                        this.logger.error(`STDOUT: ${stdout}`);
-                        this.logger.error(`STDERR: ${stderr}`);
-                        reject(new Error(`Failed to parse Python output: ${parseError.message}`));
-                    }
-                });
-
-                // Handle process errors
-                pythonProcess.on('error', (error) => {
-                    this.logger.error(`Python process error: ${error.message}`);
-                    reject(new Error(`Failed to start Python process: ${error.message}`));
-                });
-
-                // Set timeout
-                setTimeout(() => {
-                    if (!pythonProcess.killed) {
-                        pythonProcess.kill();
-                        reject(new Error('Python script timeout'));
-                    }
-                }, 60000); // 60 seconds timeout
-
+                server = this.getExportServer();
             } catch (error) {
                 reject(error);
+                return;
+            }
+
+            const id = randomUUID();
+            // Python answers timed-out jobs itself; this only covers a stuck server
+            const timer = setTimeout(() => {
+                this.pendingExports.delete(id);
+                reject(new Error('Python export timeout'));
+            }, (this.jobTimeoutSeconds + 5) * 1000);
+
+            this.pendingExports.set(id, {
+                resolve: (result, document) => resolve({ result, document }),
+                reject,
+                timer
+            });
+
+            // The document is streamed back instead of saved to a file
+            const job = {
+                id,
+                exam_id: examId,
+                options,
+                snapshot,
+                stream: true,
+                trace: this.traceExports,
+                timeout: this.jobTimeoutSeconds
+            };
+            server.stdin!.write(JSON.stringify(job) + '\n');
+        });
+    }
+
+    /**
+     * Start the Python export server, or return the one already running
+     */
+    private getExportServer(): ChildProcess {
+        if (this.exportServer) {
+            return this.exportServer;
+        }
+
+        const args = [
+            this.pythonScriptPath,
+            '--serve',
+            '--workers', String(this.serverWorkers),
+            '--job-timeout', String(this.jobTimeoutSeconds),
+            '--cache-dir', this.cacheDir,
+            '--cache-mb', String(this.cacheMb),
+            '--media-cache-dir', this.mediaCacheDir,
+            '--docx-fd', '3'
+        ];
+        this.logger.log(`Starting Python export server: python3 ${args.join(' ')}`);
+
+        const server = spawn('python3', args, {
+            stdio: ['pipe', 'pipe', 'pipe', 'pipe'],
+            cwd: process.cwd()
+        });
+        this.exportServer = server;
+        const documentReader = new DocumentStreamReader(server.stdio[3] as Readable);
+
+        readline.createInterface({ input: server.stdout! }).on('line', (line) => {
+            let response: PythonExportResult & { id?: string };
+            try {
+                response = JSON.parse(line);
+            } catch (parseError) {
+                this.logger.error(`Failed to parse Python output: ${line}`);
+                return;
+            }
+
+            // Documents arrive on fd 3 in the same order as their result lines,
+            // so a streamed document is always read off the pipe, even when
+            // its job already timed out here; otherwise the next job would get
+            // its bytes
+            const document = response.success && response.size !== undefined && !response.file_path
+                ? documentReader.read(response.size)
+                : null;
+
+            const pending = response.id ? this.pendingExports.get(response.id) : undefined;
+            if (!pending) {
+                this.logger.warn(`Python export result without a waiting job: ${line}`);
+                document?.catch(() => undefined);
+                return;
+            }
+            clearTimeout(pending.timer);
+            this.pendingExports.delete(response.id!);
+
+            if (document) {
+                document.then((data) => pending.resolve(response, data), pending.reject);
+            } else {
+                pending.resolve(response);
+            }
+        });
+
+        // The server logs to stderr
+        readline.createInterface({ input: server.stderr! }).on('line', (line) => {
+            this.logger.debug(`[exporter] ${line}`);
+        });
+
+        const fail = (error: Error) => {
+            if (this.exportServer === server) {
+                this.exportServer = null;
+            }
+            documentReader.fail(error);
+            for (const [id, pending] of this.pendingExports) {
+                clearTimeout(pending.timer);
+                pending.reject(error);
+                this.pendingExports.delete(id);
             }
+        };
+
+        server.on('exit', (code) => {
+            this.logger.warn(`Python export server exited with code: ${code}`);
+            fail(new Error(`Python export server exited with code ${code}`));
         });
+
+        server.on('error', (error) => {
+            this.logger.error(`Python export server error: ${error.message}`);
+            fail(new Error(`Failed to start Python process: ${error.message}`));
+        });
+
+        return server;
+    }
+
+    onModuleDestroy() {
+        // Closing stdin lets the server finish running jobs and exit
+        this.exportServer?.stdin?.end();
+        this.exportServer = null;
     }
 
     /**
@@ -207,7 +411,7 @@ export class PythonExamWordExportService {
      */
     async checkPythonEnvironment(): Promise<boolean> {
         return new Promise((resolve) => {
-            const pythonProcess = spawn('python3', ['-c', 'import docx, pyodbc; print("OK")'], {
+            const pythonProcess = spawn('python3', ['-c', 'import docx; print("OK")'], {
                 stdio: ['pipe', 'pipe', 'pipe']
             });
 
@@ -240,7 +444,7 @@ export class PythonExamWordExportService {
         return new Promise((resolve) => {
             this.logger.log('Installing Python packages...');
             
-            const installProcess = spawn('pip3', ['install', 'python-docx', 'pyodbc'], {
+            const installProcess = spawn('pip3', ['install', 'python-docx'], {
                 stdio: ['pipe', 'pipe', 'pipe']
             });
 
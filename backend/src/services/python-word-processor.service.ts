@@ -1,16 +1,37 @@
 import { Injectable, Logger } from '@nestjs/common';
 import { spawn } from 'child_process';
-import { promises as fs } from 'fs';
+import { createReadStream, promises as fs, ReadStream } from 'fs';
 import * as path from 'path';
+import { promisify } from 'util';
+import * as zlib from 'zlib';
 import { v4 as uuidv4 } from 'uuid';
 import { MulterFile } from '../interfaces/multer-file.interface';
 
+export interface PythonExtractedImage {
+    // <sha256><ext>, as in the [IMAGE: ...] markers of the question content
+    filename: string;
+    content_type: string;
+    size: number;
+    sha256: string;
+    // Part name inside the DOCX package, e.g. word/media/image1.png
+    original_path: string | null;
+    // Base64 image data; null when the image was extracted to disk
+    data: string | null;
+    // Stored image file; read it through openImage with the result's image_set
+    path: string | null;
+    question_orders: number[];
+    // False for package media no question shows (headers, unused parts)
+    referenced: boolean;
+}
+
 export interface PythonProcessingResult {
     success: boolean;
     text_content: string;
     html_content: string;
     questions: any[];
-    images: any[];
+    images: PythonExtractedImage[];
+    // Directory of the extracted images, see openImage and releaseImages
+    image_set: string | null;
     errors: string[];
     warnings: string[];
     statistics: {
@@ -24,12 +45,57 @@ export interface PythonProcessingResult {
     };
 }
 
+export interface PythonStreamSummary {
+    success: boolean;
+    errors: string[];
+    warnings: string[];
+    statistics: PythonProcessingResult['statistics'];
+}
+
+export interface PythonArchiveDocument {
+    name: string;
+    result: PythonProcessingResult;
+    // Media reference -> extracted file path under the result's media_set;
+    // null when it could not be copied
+    media: Record<string, string | null>;
+    missing_media: string[];
+}
+
+export interface PythonArchiveResult {
+    success: boolean;
+    documents: PythonArchiveDocument[];
+    // Directory of the images extracted from every document
+    image_set: string | null;
+    // Directory of the media copied out of the archive, see releaseArchive
+    media_set: string | null;
+    errors: string[];
+    statistics: Record<string, number>;
+}
+
+// Header line word_processor.py writes in front of compressed output
+const COMPRESSION_HEADER = 'WPJSON/1';
+
+// Image file names are the SHA-256 of the content plus an extension
+const IMAGE_FILENAME_PATTERN = /^[0-9a-f]{64}\.[a-z]+$/;
+const IMAGE_SET_PATTERN = /^[0-9a-f-]{36}$/;
+
+const gunzip = promisify(zlib.gunzip);
+
 @Injectable()
 export class PythonWordProcessorService {
     private readonly logger = new Logger(PythonWordProcessorService.name);
     private readonly scriptsDir = path.join(process.cwd(), 'scripts');
     private readonly tempDir = path.join(process.cwd(), 'temp');
+    // Extracted images go to a directory per upload (an image set) under this
+    // one, kept until releaseImages is called or imageSetTtlMs has passed
+    private readonly imageDir = path.join(this.tempDir, 'media');
+    private readonly imageSetTtlMs = 60 * 60 * 1000;
+    // Audio/image files bundled in uploaded ZIP archives, a directory per
+    // upload kept like the image sets
+    private readonly archiveMediaDir = path.join(this.tempDir, 'archive-media');
     private readonly pythonScript = path.join(this.scriptsDir, 'word_processor.py');
+    // Results larger than this are gzip-compressed by Python
+    private readonly compressThreshold = 1024 * 1024;
 
     constructor() {
         this.ensureDirectories();
@@ -38,6 +104,7 @@ export class PythonWordProcessorService {
     private async ensureDirectories(): Promise<void> {
         try {
             await fs.mkdir(this.tempDir, { recursive: true });
+            await fs.mkdir(this.imageDir, { recursive: true });
         } catch (error) {
             this.logger.error('Error creating temp directory', error);
         }
@@ -48,16 +115,26 @@ export class PythonWordProcessorService {
         options: {
             extractImages?: boolean;
             verbose?: boolean;
+            // Output fields to build; text/HTML content is skipped by default
+            fields?: Array<'text_content' | 'html_content' | 'questions' | 'images' | 'statistics'>;
         } = {}
     ): Promise<PythonProcessingResult> {
-        const { extractImages = true, verbose = false } = options;
+        const {
+            extractImages = true,
+            verbose = false,
+            fields = ['questions', 'images', 'statistics']
+        } = options;
         
         // Save uploaded file to temp directory
         const tempFileName = `${uuidv4()}_${file.originalname}`;
         const tempFilePath = path.join(this.tempDir, tempFileName);
         const outputFilePath = path.join(this.tempDir, `${uuidv4()}_output.json`);
+        const imageSet = uuidv4();
+        const uploadImageDir = path.join(this.imageDir, imageSet);
 
         try {
+            await this.removeExpiredImageSets();
+
             // Write file to disk
             await fs.writeFile(tempFilePath, file.buffer);
             this.logger.log(`Saved file to: ${tempFilePath}`);
@@ -66,11 +143,18 @@ export class PythonWordProcessorService {
             const args = [
                 this.pythonScript,
                 tempFilePath,
-                '--output', outputFilePath
+                '--output', outputFilePath,
+                '--compress', 'gzip',
+                '--compress-threshold', String(this.compressThreshold)
             ];
 
             if (extractImages) {
-                args.push('--extract-images');
+                // Images go to disk; the JSON only carries hash, size and path
+                args.push('--extract-images', '--image-dir', uploadImageDir);
+            }
+
+            if (fields.length > 0) {
+                args.push('--fields', fields.join(','));
             }
 
             if (verbose) {
@@ -84,8 +168,9 @@ export class PythonWordProcessorService {
                 throw new Error(`Python script failed: ${result.error}`);
             }
 
-            // Read output file
+            // Read output file; the images stay on disk for openImage
             const outputData = await this.readOutputFile(outputFilePath);
+            outputData.image_set = extractImages ? imageSet : null;
 
             // Cleanup temp files
             await this.cleanupTempFiles([tempFilePath, outputFilePath]);
@@ -97,6 +182,7 @@ export class PythonWordProcessorService {
             
             // Cleanup on error
             await this.cleanupTempFiles([tempFilePath, outputFilePath]);
+            await this.removeDirectory(uploadImageDir);
             
             return {
                 success: false,
@@ -104,6 +190,7 @@ export class PythonWordProcessorService {
                 html_content: '',
                 questions: [],
                 images: [],
+                image_set: null,
                 errors: [error.message],
                 warnings: [],
                 statistics: {
@@ -119,6 +206,177 @@ export class PythonWordProcessorService {
         }
     }
 
+    /**
+     * Process a Word document in NDJSON mode, handing each question to
+     * onQuestion as soon as Python has parsed it instead of waiting for the
+     * whole result.
+     *
+     * Only the question parsing is streamed: mammoth converts the whole
+     * document before the first record is written, so the time to the first
+     * question still includes the full conversion. Reading stops while
+     * records are being handled, so a slow consumer makes Python wait on the
+     * pipe instead of buffering the output here.
+     */
+    async streamWordDocument(
+        file: MulterFile,
+        onQuestion: (question: any) => Promise<void> | void,
+        options: {
+            extractImages?: boolean;
+            // The image file at image.path is removed once the stream ends
+            onImage?: (image: PythonExtractedImage) => Promise<void> | void;
+        } = {}
+    ): Promise<PythonStreamSummary> {
+        const { extractImages = true, onImage } = options;
+        const tempFilePath = path.join(this.tempDir, `${uuidv4()}_${file.originalname}`);
+        const uploadImageDir = path.join(this.imageDir, uuidv4());
+
+        try {
+            await fs.writeFile(tempFilePath, file.buffer);
+
+            const args = [this.pythonScript, tempFilePath, '--ndjson'];
+            if (extractImages) {
+                args.push('--extract-images', '--image-dir', uploadImageDir);
+            }
+
+            return await new Promise<PythonStreamSummary>((resolve, reject) => {
+                const pythonProcess = spawn('python3', args, {
+                    cwd: process.cwd(),
+                    stdio: ['pipe', 'pipe', 'pipe']
+                });
+
+                let pending = '';
+                let stderr = '';
+                let summary: PythonStreamSummary | null = null;
+                // Records are handled one at a time, in the order Python wrote them
+                let handled: Promise<void> = Promise.resolve();
+
+                const handleLine = async (line: string) => {
+                    if (!line.trim()) return;
+                    const { record, ...data } = JSON.parse(line);
+                    if (record === 'question') {
+                        await onQuestion(data);
+                    } else if (record === 'image' && onImage) {
+                        await onImage(data);
+                    } else if (record === 'summary') {
+                        summary = data as PythonStreamSummary;
+                    }
+                };
+
+                // Decode as a stream so characters split across chunks stay whole
+                pythonProcess.stdout.setEncoding('utf8');
+                pythonProcess.stdout.on('data', (data: string) => {
+                    pending += data;
+                    const lines = pending.split('\n');
+                    pending = lines.pop() ?? '';
+                    for (const line of lines) {
+                        handled = handled.then(() => handleLine(line));
+                    }
+                    // Resume reading once these records are handled; a failed
+                    // handler stops Python instead of leaving it blocked
+                    pythonProcess.stdout.pause();
+                    handled.then(
+                        () => pythonProcess.stdout.resume(),
+                        () => pythonProcess.kill()
+                    );
+                });
+
+                pythonProcess.stderr.on('data', (data) => {
+                    stderr += data.toString();
+                });
+
+                pythonProcess.on('close', (code) => {
+                    handled = handled.then(() => handleLine(pending));
+                    handled.then(() => {
+                        if (code !== 0 || !summary) {
+                            reject(new Error(stderr || `Process exited with code ${code}`));
+                        } else {
+                            resolve(summary);
+                        }
+                    }, reject);
+                });
+
+                pythonProcess.on('error', reject);
+            });
+        } finally {
+            await this.cleanupTempFiles([tempFilePath]);
+            await this.removeDirectory(uploadImageDir);
+        }
+    }
+
+    /**
+     * Process a ZIP archive of Word documents and their bundled media.
+     * Python processes the documents in a worker pool and resolves every
+     * [AUDIO: ...]/[IMAGE: ...] reference against the archive; references
+     * it cannot find are listed per document in missing_media.
+     *
+     * The caller owns the copied media and extracted images: call
+     * releaseArchive when done with them, otherwise they are removed after
+     * imageSetTtlMs.
+     */
+    async processWordArchive(
+        file: MulterFile,
+        options: {
+            extractImages?: boolean;
+            workers?: number;
+            fields?: Array<'text_content' | 'html_content' | 'questions' | 'images' | 'statistics'>;
+        } = {}
+    ): Promise<PythonArchiveResult> {
+        const {
+            extractImages = true,
+            workers,
+            fields = ['questions', 'images', 'statistics']
+        } = options;
+
+        const requestId = uuidv4();
+        const tempFilePath = path.join(this.tempDir, `${requestId}_archive.zip`);
+        const outputFilePath = path.join(this.tempDir, `${requestId}_output.json`);
+        const uploadImageDir = path.join(this.imageDir, requestId);
+        const uploadMediaDir = path.join(this.archiveMediaDir, requestId);
+
+        try {
+            await this.removeExpiredImageSets();
+            await fs.writeFile(tempFilePath, file.buffer);
+
+            const args = [
+                this.pythonScript,
+                tempFilePath,
+                '--output', outputFilePath,
+                '--media-dir', uploadMediaDir,
+                '--compress', 'gzip',
+                '--compress-threshold', String(this.compressThreshold)
+            ];
+            if (extractImages) {
+                args.push('--extract-images', '--image-dir', uploadImageDir);
+            }
+            if (fields.length > 0) {
+                args.push('--fields', fields.join(','));
+            }
+            if (workers) {
+                args.push('--workers', String(workers));
+            }
+
+            const result = await this.executePythonScript(args);
+            if (!result.success) {
+                throw new Error(`Python script failed: ${result.error}`);
+            }
+
+            const archiveResult = JSON.parse(await this.readOutputText(outputFilePath)) as PythonArchiveResult;
+            archiveResult.image_set = extractImages ? requestId : null;
+            archiveResult.media_set = requestId;
+            return archiveResult;
+        } catch (error) {
+            this.logger.error('Error processing Word archive with Python', error);
+            await this.removeDirectory(uploadImageDir);
+            await this.removeDirectory(uploadMediaDir);
+            return {
+                success: false, documents: [], image_set: null, media_set: null,
+                errors: [error.message], statistics: {}
+            };
+        } finally {
+            await this.cleanupTempFiles([tempFilePath, outputFilePath]);
+        }
+    }
+
     private async executePythonScript(args: string[]): Promise<{ success: boolean; error?: string }> {
         return new Promise((resolve) => {
             const pythonProcess = spawn('python3', args, {
@@ -157,8 +415,7 @@ export class PythonWordProcessorService {
 
     private async readOutputFile(filePath: string): Promise<PythonProcessingResult> {
         try {
-            const fileContent = await fs.readFile(filePath, 'utf-8');
-            const data = JSON.parse(fileContent);
+            const data = JSON.parse(await this.readOutputText(filePath));
             
             // Validate the structure
             if (!data || typeof data !== 'object') {
@@ -171,6 +428,7 @@ export class PythonWordProcessorService {
                 html_content: data.html_content || '',
                 questions: data.questions || [],
                 images: data.images || [],
+                image_set: null,
                 errors: data.errors || [],
                 warnings: data.warnings || [],
                 statistics: {
@@ -190,6 +448,95 @@ export class PythonWordProcessorService {
         }
     }
 
+    /**
+     * Read a Python output file, decompressing it when it starts with the
+     * compression header line ("WPJSON/1 encoding=<name>").
+     */
+    private async readOutputText(filePath: string): Promise<string> {
+        const content = await fs.readFile(filePath);
+        if (!content.subarray(0, COMPRESSION_HEADER.length).equals(Buffer.from(COMPRESSION_HEADER))) {
+            return content.toString('utf-8');
+        }
+
+        const headerEnd = content.indexOf(0x0a);
+        const header = content.subarray(0, headerEnd).toString('ascii');
+        const encoding = /encoding=(\w+)/.exec(header)?.[1];
+        const body = content.subarray(headerEnd + 1);
+
+        if (encoding === 'gzip') {
+            return (await gunzip(body)).toString('utf-8');
+        }
+        // zlib only ships zstd in recent Node releases
+        const zstdDecompress = (zlib as any).zstdDecompress;
+        if (encoding === 'zstd' && typeof zstdDecompress === 'function') {
+            return (await promisify(zstdDecompress)(body) as Buffer).toString('utf-8');
+        }
+        throw new Error(`Unsupported output encoding: ${encoding}`);
+    }
+
+    /**
+     * Open a stored image of a processing result, e.g. to pipe it into an
+     * upload or an HTTP response. Images are read from disk only here, so a
+     * result with many images does not hold their content in memory.
+     */
+    openImage(imageSet: string, filename: string): ReadStream {
+        if (!IMAGE_SET_PATTERN.test(imageSet) || !IMAGE_FILENAME_PATTERN.test(filename)) {
+            throw new Error(`Invalid image reference: ${imageSet}/${filename}`);
+        }
+        return createReadStream(path.join(this.imageDir, imageSet, filename));
+    }
+
+    /**
+     * Remove the images of a processing result once the caller is done with
+     * them. Sets that are never released are removed after imageSetTtlMs.
+     */
+    async releaseImages(imageSet: string | null): Promise<void> {
+        if (imageSet && IMAGE_SET_PATTERN.test(imageSet)) {
+            await this.removeDirectory(path.join(this.imageDir, imageSet));
+        }
+    }
+
+    /**
+     * Remove the extracted images and the copied media of an archive result
+     * once the caller is done with the files its media map points to.
+     */
+    async releaseArchive(result: PythonArchiveResult): Promise<void> {
+        await this.releaseImages(result.image_set);
+        if (result.media_set && IMAGE_SET_PATTERN.test(result.media_set)) {
+            await this.removeDirectory(path.join(this.archiveMediaDir, result.media_set));
+        }
+    }
+
+    private async removeExpiredImageSets(): Promise<void> {
+        const expiredBefore = Date.now() - this.imageSetTtlMs;
+        for (const parent of [this.imageDir, this.archiveMediaDir]) {
+            let entries: string[];
+            try {
+                entries = await fs.readdir(parent);
+            } catch (error) {
+                continue;
+            }
+            for (const entry of entries) {
+                try {
+                    const stats = await fs.stat(path.join(parent, entry));
+                    if (stats.isDirectory() && stats.mtimeMs < expiredBefore) {
+                        await this.removeDirectory(path.join(parent, entry));
+                    }
+                } catch (error) {
+                    // Removed by a concurrent sweep or release
+                }
+            }
+        }
+    }
+
+    private async removeDirectory(dirPath: string): Promise<void> {
+        try {
+            await fs.rm(dirPath, { recursive: true, force: true });
+        } catch (error) {
+            this.logger.warn(`Failed to remove temp directory ${dirPath}:`, error.message);
+        }
+    }
+
     private async cleanupTempFiles(filePaths: string[]): Promise<void> {
         for (const filePath of filePaths) {
             try {
@@ -1,11 +1,15 @@
 #!/usr/bin/env python3
 import argparse
+import html
 import json
 import os
 import re
 import sys
 import uuid
-from typing import Dict, List, Optional, Tuple, Union
+import zipfile
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 import logging
 
 logging.basicConfig(level=logging.INFO,
@@ -18,22 +22,196 @@ try:
     from docx.oxml.text.paragraph import CT_P
     from docx.text.paragraph import Paragraph
     from docx.text.run import Run
+    from docx.styles.styles import Styles
+    from docx.oxml.ns import qn
+    from lxml import etree
+    try:
+        from docx.oxml.parser import element_class_lookup
+    except ImportError:  # python-docx < 1.0
+        from docx.oxml import element_class_lookup
 except ImportError:
     logger.error("python-docx not installed. Run: pip install python-docx")
     sys.exit(1)
 
+if TYPE_CHECKING:
+    from latex_svg_cache import LatexSvgCache
+
 
 def uuid_gen():
     return str(uuid.uuid4())
 
 
+# Structural markers that never belong in rendered question HTML
+HTML_MARKER_PATTERN = re.compile(
+    r"\[<sg>\]|\[<egc>\]|\[</sg>\]|\(\s*<\s*\d+\s*>\s*\)")
+CLO_MARKER_PATTERN = re.compile(r"\(CLO\d+\)")
+ANSWER_PREFIX_PATTERN = re.compile(r"^\s*[A-D][\.|\)]?\s")
+MEDIA_MARKER_PATTERN = re.compile(r"\[(AUDIO|IMAGE):\s*([^\]]+)\]", re.IGNORECASE)
+
+
+def _cut_segments(segments: List[Dict], start: int, end: int) -> List[Dict]:
+    """Remove characters [start, end) of the joined segment text"""
+    result = []
+    pos = 0
+    for seg in segments:
+        seg_start, seg_end = pos, pos + len(seg["text"])
+        pos = seg_end
+        if seg_end <= start or seg_start >= end:
+            result.append(seg)
+            continue
+        kept = seg["text"][:max(start - seg_start, 0)] + \
+            seg["text"][max(end - seg_start, 0):]
+        if kept and seg["kind"] == "text":
+            result.append(dict(seg, text=kept))
+    return result
+
+
+def _remove_pattern(segments: List[Dict], pattern) -> List[Dict]:
+    text = "".join(seg["text"] for seg in segments)
+    for match in reversed(list(pattern.finditer(text))):
+        segments = _cut_segments(segments, match.start(), match.end())
+    return segments
+
+
+def _extract_media(segments: List[Dict]) -> List[Dict]:
+    """Turn media markers into media segments, also when Word split them across runs"""
+    text = "".join(seg["text"] for seg in segments)
+    for match in reversed(list(MEDIA_MARKER_PATTERN.finditer(text))):
+        media = {"text": match.group(0), "kind": "media",
+                 "media_type": match.group(1).upper(), "filename": match.group(2).strip()}
+        segments = _cut_segments(segments, match.start(), len(text)) + [media] + \
+            _cut_segments(segments, 0, match.end())
+    return segments
+
+
+def _oxml_parser() -> etree.XMLParser:
+    """Create a parser that builds python-docx element classes.
+
+    lxml parsers must not be shared between threads, so every worker gets
+    its own instance configured like python-docx's module-level parser.
+    """
+    parser = etree.XMLParser(remove_blank_text=True, resolve_entities=False)
+    parser.set_element_class_lookup(element_class_lookup)
+    return parser
+
+
+class DocxPackageLoader:
+    """Load a DOCX package, parsing the styles part concurrently with the body.
+
+    styles.xml is decompressed and parsed on a background thread (zlib and
+    lxml both release the GIL) while ``iter_body_paragraphs`` streams
+    word/document.xml on the calling thread. The body only blocks on the
+    styles when a run first references a character style. No other part is
+    read: the parser works from the body text and run formatting alone.
+    """
+
+    STYLES_PART = 'word/styles.xml'
+    DOCUMENT_PART = 'word/document.xml'
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, docx_path: str):
+        self.docx_path = docx_path
+        self._zip = zipfile.ZipFile(docx_path)
+        self._executor = ThreadPoolExecutor(max_workers=1,
+                                            thread_name_prefix='docx-styles')
+        self._styles = self._executor.submit(self._load_styles)
+        # Run.style resolves styles through ``paragraph.part``
+        self.part = self
+
+    def _load_styles(self) -> Optional[Styles]:
+        if self.STYLES_PART not in self._zip.namelist():
+            return None
+        # A separate handle so decompression does not share the body's file position
+        with zipfile.ZipFile(self.docx_path) as docx_zip:
+            blob = docx_zip.read(self.STYLES_PART)
+        return Styles(etree.fromstring(blob, _oxml_parser()))
+
+    @property
+    def styles(self) -> Optional[Styles]:
+        return self._styles.result()
+
+    def get_style(self, style_id, style_type):
+        """Mirror ``DocumentPart.get_style`` for runs built by this loader"""
+        styles = self.styles
+        if styles is None:
+            return None
+        return styles.get_by_id(style_id, style_type)
+
+    def iter_body_paragraphs(self):
+        """Yield top-level body paragraphs as soon as each one is parsed"""
+        parser = etree.XMLPullParser(events=('end',), tag=qn('w:p'),
+                                     remove_blank_text=True,
+                                     resolve_entities=False)
+        parser.set_element_class_lookup(element_class_lookup)
+        body_tag = qn('w:body')
+
+        with self._zip.open(self.DOCUMENT_PART) as body_stream:
+            while True:
+                chunk = body_stream.read(self.CHUNK_SIZE)
+                if chunk:
+                    parser.feed(chunk)
+                else:
+                    parser.close()
+                for _, element in parser.read_events():
+                    # Table cells also hold w:p; Document.paragraphs skips them
+                    if element.getparent().tag == body_tag:
+                        yield Paragraph(element, self)
+                if not chunk:
+                    break
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self._zip.close()
+
+
 class DocxParser:
-    def __init__(self, docx_path: str, process_images: bool = False, extract_styles: bool = False, preserve_latex: bool = False):
+    def __init__(self, docx_path: str, process_images: bool = False, extract_styles: bool = False, preserve_latex: bool = False,
+                 latex_cache: Optional['LatexSvgCache'] = None, emit_html: bool = False,
+                 media_base_url: Optional[str] = None):
         self.docx_path = docx_path
         self.process_images = process_images
         self.extract_styles = extract_styles
         self.preserve_latex = preserve_latex
-        self.document = self._load_document()
+        self.latex_cache = latex_cache
+        self.emit_html = emit_html
+        self.media_base_url = media_base_url
+        # Opened now so auxiliary parts load while the caller gets ready
+        self._package = self._load_package()
+        self._document = None
+
+    @property
+    def package(self) -> DocxPackageLoader:
+        """Open package, reopened when a previous parse closed it"""
+        if self._package is None:
+            self._package = self._load_package()
+        return self._package
+
+    def close(self):
+        """Close the package; a later parse_questions() opens it again"""
+        if self._package is not None:
+            self._package.close()
+            self._package = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _load_package(self) -> DocxPackageLoader:
+        """Open the package and start loading auxiliary parts in the background"""
+        try:
+            return DocxPackageLoader(self.docx_path)
+        except Exception as e:
+            logger.error(f"Error loading document: {e}")
+            raise
+
+    @property
+    def document(self) -> Document:
+        """Full python-docx document, loaded on first access only"""
+        if self._document is None:
+            self._document = self._load_document()
+        return self._document
 
     def _load_document(self) -> Document:
         """Load the document using python-docx"""
@@ -144,6 +322,67 @@ class DocxParser:
             "latex_expressions": latex_expressions if latex_expressions else None
         }
 
+    def _paragraph_html(self, paragraph: Dict, is_answer: bool = False) -> str:
+        """Render sanitized HTML for a paragraph from its decoded runs.
+
+        All text is escaped and only <strong>, <em>, <u>, LaTeX spans and media
+        tags are emitted, so the result can be displayed without further
+        sanitizing. Markers removed from the plain text are removed here too.
+        """
+        segments = [{"text": run["text"], "kind": "text", "run": run}
+                    for run in paragraph.get("runs") or [] if run["text"]]
+        segments.extend({"text": latex, "kind": "latex"}
+                        for latex in paragraph.get("latex_expressions") or [])
+
+        segments = _remove_pattern(segments, HTML_MARKER_PATTERN)
+        text = "".join(seg["text"] for seg in segments)
+        if is_answer:
+            prefix = ANSWER_PREFIX_PATTERN.match(text)
+            if prefix:
+                segments = _cut_segments(segments, 0, prefix.end())
+        else:
+            segments = _remove_pattern(segments, CLO_MARKER_PATTERN)
+
+        # Trim surrounding whitespace the same way the plain text is stripped
+        text = "".join(seg["text"] for seg in segments)
+        segments = _cut_segments(segments, 0, len(text) - len(text.lstrip()))
+        text = "".join(seg["text"] for seg in segments)
+        segments = _cut_segments(segments, len(text.rstrip()), len(text))
+
+        segments = _extract_media(segments)
+        return "".join(self._segment_html(seg) for seg in segments)
+
+    def _segment_html(self, segment: Dict) -> str:
+        if segment["kind"] == "latex":
+            from latex_svg_cache import expression_key, normalize_expression
+            formula = html.escape(normalize_expression(segment["text"]))
+            if self.latex_cache is not None:
+                key = expression_key(segment["text"])
+                return f'<span class="katex-formula" data-latex-key="{key}">{formula}</span>'
+            return f'<span class="katex-formula">{formula}</span>'
+        if segment["kind"] == "media":
+            return self._media_html(segment["media_type"], segment["filename"])
+
+        content = html.escape(segment["text"])
+
+        run = segment["run"]
+        if run.get("underline"):
+            content = f"<u>{content}</u>"
+        if run.get("italic"):
+            content = f"<em>{content}</em>"
+        if run.get("bold"):
+            content = f"<strong>{content}</strong>"
+        return content
+
+    def _media_html(self, media_type: str, filename: str) -> str:
+        name = html.escape(filename)
+        src = ""
+        if self.media_base_url:
+            src = f' src="{html.escape(self.media_base_url.rstrip("/") + "/" + quote(filename))}"'
+        if media_type == "AUDIO":
+            return f'<audio controls class="question-media" data-media="{name}"{src}></audio>'
+        return f'<img class="question-media" data-media="{name}" alt="{name}"{src}>'
+
     def _is_answer_correct(self, paragraph: Dict) -> bool:
         """Enhanced detection if the answer is marked as correct (underlined or formatted)"""
         if not paragraph.get("runs"):
@@ -183,6 +422,7 @@ class DocxParser:
 
         # Process question content and answers
         content_parts = []
+        content_html_parts = []
         current_answers = []
         in_question_content = True
         has_latex = False
@@ -207,12 +447,15 @@ class DocxParser:
                 # Check if this answer is correct (underlined)
                 is_correct = self._is_answer_correct(p)
 
-                current_answers.append({
+                answer = {
                     "id": uuid_gen(),
                     "content": answer_text,
                     "isCorrect": is_correct,
                     "order": len(current_answers)
-                })
+                }
+                if self.emit_html:
+                    answer["contentHtml"] = self._paragraph_html(p, is_answer=True)
+                current_answers.append(answer)
             elif in_question_content:
                 # If it's the question content, add to content parts
                 # Remove CLO marker if present
@@ -221,9 +464,14 @@ class DocxParser:
 
                 if text:
                     content_parts.append(text)
+                    if self.emit_html:
+                        content_html_parts.append(self._paragraph_html(p))
 
         # Set question content and answers
         question["content"] = " ".join(content_parts).strip()
+        if self.emit_html:
+            question["contentHtml"] = "<br>".join(
+                part for part in content_html_parts if part)
         question["answers"] = current_answers
 
         # Set question type based on number of correct answers
@@ -333,6 +581,9 @@ class DocxParser:
             group_content_text = " ".join(
                 [b["text"] for b in group_content_blocks]).strip()
             group_question["groupContent"] = group_content_text
+            if self.emit_html:
+                group_question["groupContentHtml"] = "<br>".join(
+                    part for part in (self._paragraph_html(b) for b in group_content_blocks) if part)
 
         # Process child questions
         for child_block in child_question_blocks:
@@ -384,20 +635,58 @@ class DocxParser:
 
         return has_latex
 
+    def _attach_latex_svg(self, question: Dict):
+        """Reference pre-rendered SVGs for the question's LaTeX expressions"""
+        if question.get("has_latex"):
+            from latex_svg_cache import find_latex_expressions
+            texts = [question.get("content", ""), question.get("groupContent", "")]
+            texts.extend(a.get("content", "") for a in question.get("answers", []))
+
+            rendered = []
+            seen = set()
+            for text in texts:
+                for expression in find_latex_expressions(text):
+                    if expression in seen:
+                        continue
+                    seen.add(expression)
+                    svg_path = self.latex_cache.get(expression)
+                    if svg_path:
+                        rendered.append({
+                            "expression": expression,
+                            "key": os.path.basename(svg_path)[:-4],
+                            "path": svg_path
+                        })
+            if rendered:
+                question["latex_svg"] = rendered
+
+        for child in question.get("childQuestions", []):
+            self._attach_latex_svg(child)
+
     def parse_questions(self) -> List[Dict]:
         """Parse all questions from the document"""
-        questions = []
+        questions = list(self.iter_questions())
+
+        logger.info(f"Successfully parsed {len(questions)} questions")
+        if self.latex_cache is not None:
+            logger.info(
+                f"LaTeX SVG cache: {self.latex_cache.hits} hits, {self.latex_cache.misses} renders")
+        return questions
+
+    def iter_questions(self) -> Iterator[Dict]:
+        """Yield each question as soon as its block has been read from the body"""
+        try:
+            yield from self._questions_from_paragraphs(self.package.iter_body_paragraphs())
+        finally:
+            self.close()
 
-        # Extract all paragraphs with formatting
-        all_paragraphs = []
-        for paragraph in self.document.paragraphs:
-            formatted_paragraph = self._get_paragraph_text_with_formatting(
-                paragraph)
-            if formatted_paragraph["text"].strip():  # Skip empty paragraphs
-                all_paragraphs.append(formatted_paragraph)
+    def _questions_from_paragraphs(self, paragraphs: Iterable[Paragraph]) -> Iterator[Dict]:
+        # Paragraphs are formatted one at a time while the styles may still be loading
+        formatted_paragraphs = (self._get_paragraph_text_with_formatting(paragraph)
+                                for paragraph in paragraphs)
 
-        # Detect question blocks
-        question_blocks = self._detect_questions_by_pattern(all_paragraphs)
+        # Detect question blocks, skipping empty paragraphs
+        question_blocks = self._detect_questions_by_pattern(
+            p for p in formatted_paragraphs if p["text"].strip())
 
         # Process each question block
         for block in question_blocks:
@@ -416,10 +705,9 @@ class DocxParser:
             if question["content"] or (question.get("childQuestions") and question["childQuestions"]):
                 # Post-process LaTeX expressions
                 self._post_process_latex(question)
-                questions.append(question)
-
-        logger.info(f"Successfully parsed {len(questions)} questions")
-        return questions
+                if self.latex_cache is not None:
+                    self._attach_latex_svg(question)
+                yield question
 
     def _extract_images(self, docx_path: str) -> Dict[str, str]:
         """Extract images from the DOCX file (not implemented yet)"""
@@ -427,9 +715,12 @@ class DocxParser:
         _ = docx_path  # Suppress unused parameter warning
         return {}
 
-    def _detect_questions_by_pattern(self, paragraphs: List[Dict]) -> List[List[Dict]]:
-        """Detect question blocks by looking for question patterns and separators"""
-        question_blocks = []
+    def _detect_questions_by_pattern(self, paragraphs: Iterable[Dict]) -> Iterator[List[Dict]]:
+        """Detect question blocks by looking for question patterns and separators
+
+        Blocks are yielded as soon as the next one starts, so questions can be
+        parsed while the rest of the body is still being read.
+        """
         current_block = []
 
         for p in paragraphs:
@@ -444,7 +735,7 @@ class DocxParser:
 
             # If we have a separator and a non-empty current block, save it
             if is_separator and current_block:
-                question_blocks.append(current_block)
+                yield current_block
                 current_block = []
                 continue
 
@@ -462,7 +753,7 @@ class DocxParser:
             )
 
             if is_question_start and current_block:
-                question_blocks.append(current_block)
+                yield current_block
                 current_block = []
 
             # Add paragraph to current block
@@ -470,9 +761,7 @@ class DocxParser:
 
         # Don't forget the last block
         if current_block:
-            question_blocks.append(current_block)
-
-        return question_blocks
+            yield current_block
 
 
 def main():
@@ -486,6 +775,14 @@ def main():
                         help='Extract detailed style information')
     parser.add_argument('--preserve-latex', action='store_true',
                         help='Preserve LaTeX math expressions')
+    parser.add_argument('--latex-svg-cache', metavar='DIR',
+                        help='Pre-render LaTeX expressions to SVG in this cache directory (requires --preserve-latex)')
+    parser.add_argument('--latex-svg-cache-mb', type=int, default=50,
+                        help='Maximum size of the LaTeX SVG cache in MB (default: 50)')
+    parser.add_argument('--emit-html', action='store_true',
+                        help='Add sanitized contentHtml to questions and answers')
+    parser.add_argument('--media-base-url',
+                        help='Base URL used as src for [IMAGE: ...] and [AUDIO: ...] media in HTML')
 
     args = parser.parse_args()
 
@@ -494,11 +791,20 @@ def main():
         sys.exit(1)
 
     try:
+        latex_cache = None
+        if args.latex_svg_cache:
+            from latex_svg_cache import LatexSvgCache
+            latex_cache = LatexSvgCache(
+                args.latex_svg_cache, max_bytes=args.latex_svg_cache_mb * 1024 * 1024)
+
         docx_parser = DocxParser(
             args.input_file,
             process_images=args.process_images,
             extract_styles=args.extract_styles,
-            preserve_latex=args.preserve_latex
+            preserve_latex=args.preserve_latex,
+            latex_cache=latex_cache,
+            emit_html=args.emit_html,
+            media_base_url=args.media_base_url
         )
         questions = docx_parser.parse_questions()
 
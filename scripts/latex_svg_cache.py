@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Offline LaTeX to SVG renderer with a bounded on-disk cache
+Author: Linh Dang Dev
+
+Formulas are rendered locally with matplotlib mathtext (no network) and stored
+as <sha256>.svg files, so an expression that appears in many questions is only
+rendered once. The cache directory is kept under a byte budget by evicting the
+least recently used files.
+"""
+
+import hashlib
+import io
+import logging
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+logger = logging.getLogger('latex_svg_cache')
+
+# matplotlib is slow to import, so it is loaded on the first render
+_math_to_image = None
+
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+
+# Expressions remembered as unrenderable; the least recently seen are forgotten
+MAX_FAILED = 10000
+
+# Inline $...$ expressions and \begin{env}...\end{env} blocks
+LATEX_PATTERN = re.compile(
+    r'\$[^$]+\$|\\begin\{(\w+\*?)\}.*?\\end\{\1\}', re.DOTALL)
+
+
+def _renderer():
+    """Return matplotlib's math_to_image, or None when matplotlib is not installed"""
+    global _math_to_image
+    if _math_to_image is None:
+        try:
+            from matplotlib.mathtext import math_to_image
+        except ImportError:
+            math_to_image = False
+        _math_to_image = math_to_image
+    return _math_to_image or None
+
+
+def find_latex_expressions(text: str) -> List[str]:
+    """Return LaTeX expressions found in text, in order of appearance"""
+    if not text:
+        return []
+    return [match.group(0) for match in LATEX_PATTERN.finditer(text)]
+
+
+def normalize_expression(expression: str) -> str:
+    """Strip delimiters and collapse whitespace so equal formulas share a key"""
+    body = expression.strip()
+    if len(body) >= 2 and body.startswith('$') and body.endswith('$'):
+        body = body.strip('$')
+    return ' '.join(body.split())
+
+
+def expression_key(expression: str) -> str:
+    return hashlib.sha256(normalize_expression(expression).encode('utf-8')).hexdigest()
+
+
+class LatexSvgCache:
+    """Content-addressed SVG cache for LaTeX expressions"""
+
+    def __init__(self, cache_dir: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._failed: 'OrderedDict[str, None]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._sizes = self._scan()
+
+    @property
+    def available(self) -> bool:
+        return _renderer() is not None
+
+    def _scan(self) -> Dict[str, int]:
+        sizes = {}
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and entry.name.endswith('.svg'):
+                sizes[entry.name[:-4]] = entry.stat().st_size
+        return sizes
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.svg")
+
+    def get(self, expression: str) -> Optional[str]:
+        """Return the cached SVG path for an expression, rendering it if needed"""
+        key = expression_key(expression)
+        path = self.path_for(key)
+
+        with self._lock:
+            if key in self._sizes:
+                self.hits += 1
+                try:
+                    os.utime(path)  # mark as recently used for eviction
+                    return path
+                except FileNotFoundError:
+                    del self._sizes[key]
+            if key in self._failed:
+                self._failed.move_to_end(key)
+                return None
+            self.misses += 1
+
+        svg = self.render(expression)
+
+        with self._lock:
+            if svg is None:
+                self._failed[key] = None
+                if len(self._failed) > MAX_FAILED:
+                    self._failed.popitem(last=False)
+                return None
+            self._write(path, svg)
+            self._sizes[key] = len(svg)
+            self._evict(keep=key)
+        return path
+
+    def render(self, expression: str) -> Optional[bytes]:
+        """Render an expression to SVG bytes, or None if mathtext cannot"""
+        math_to_image = _renderer()
+        if math_to_image is None:
+            logger.warning("matplotlib not installed, LaTeX will not be pre-rendered")
+            return None
+
+        buffer = io.BytesIO()
+        try:
+            math_to_image(f"${normalize_expression(expression)}$", buffer, format='svg')
+        except Exception as e:
+            # mathtext covers a subset of LaTeX; the browser still renders the rest
+            logger.warning(f"Could not render LaTeX {expression!r}: {e}")
+            return None
+        return buffer.getvalue()
+
+    def _write(self, path: str, svg: bytes):
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(svg)
+        os.replace(temp_path, path)
+
+    def _evict(self, keep: str):
+        total = sum(self._sizes.values())
+        if total <= self.max_bytes:
+            return
+
+        by_age = []
+        for key in self._sizes:
+            if key == keep:
+                continue
+            try:
+                by_age.append((os.path.getmtime(self.path_for(key)), key))
+            except FileNotFoundError:
+                by_age.append((0, key))
+        by_age.sort()
+
+        for _, key in by_age:
+            if total <= self.max_bytes:
+                break
+            total -= self._sizes.pop(key)
+            try:
+                os.remove(self.path_for(key))
+            except FileNotFoundError:
+                pass
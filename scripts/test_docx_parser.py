@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Tests for the DOCX question parser
+Author: Linh Dang Dev
+
+Builds sample documents with python-docx and checks the streamed parse
+against the python-docx paragraph path and the sanitized HTML output.
+"""
+
+import sys
+import os
+import tempfile
+
+# Add the scripts directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import docx
+from docx.enum.style import WD_STYLE_TYPE
+
+from docx_parser import DocxParser
+
+SAMPLE_DOCX = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir,
+                           'template', 'Test_CauHoiDon.docx')
+
+
+def _write_sample_docx(path):
+    """Questions with formatted, styled, LaTeX and media runs, and a table to skip"""
+    document = docx.Document()
+    answer_style = document.styles.add_style('Dap an', WD_STYLE_TYPE.CHARACTER)
+
+    def paragraph(*runs):
+        p = document.add_paragraph()
+        for run in runs:
+            text, formats = (run, '') if isinstance(run, str) else run
+            r = p.add_run(text)
+            r.bold = 'b' in formats or None
+            r.italic = 'i' in formats or None
+            r.underline = 'u' in formats or None
+            if 's' in formats:
+                r.style = answer_style
+
+    paragraph('(CLO1) Biểu thức ', ('<script>alert(1)</script>', 'b'), ' & giá trị ', '$a<', 'b$', '?')
+    paragraph('A. ', ('x < y', 'u'))
+    paragraph(('B. ', 's'), 'y > z')
+    # Word often splits a marker over runs after editing
+    paragraph('C. [IMA', ('GE: hình 1.png]', 'i'))
+    paragraph('D. ', ('Không', 'ub'))
+    document.add_table(rows=1, cols=1).cell(0, 0).text = 'A. Trong bảng'
+    paragraph('[<br>]')
+    paragraph('(CLO2) Nghe [AUDIO: bai 1.mp3] và trả lời')
+    paragraph('A. Một')
+    paragraph(('B. Hai', 'u'))
+    paragraph('[<br>]')
+    paragraph('[<sg>] Đoạn văn <b>chung</b>')
+    paragraph('[<egc>]')
+    paragraph('(<1>) Câu con')
+    paragraph(('A. Đúng', 'u'))
+    paragraph('B. Sai')
+    paragraph('[</sg>]')
+    document.save(path)
+
+
+def _without_ids(value):
+    """Parse output with the random ids left out, for comparing two parses"""
+    if isinstance(value, dict):
+        return {key: _without_ids(item) for key, item in value.items() if key not in ('id', 'groupId')}
+    if isinstance(value, list):
+        return [_without_ids(item) for item in value]
+    return value
+
+
+def _baseline_questions(parser):
+    """Questions parsed from python-docx's Document.paragraphs, as before the streamed loader"""
+    return list(parser._questions_from_paragraphs(parser.document.paragraphs))
+
+
+def test_streamed_parse_matches_python_docx():
+    """Test that the streamed package gives the same questions as python-docx"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'sample.docx')
+        _write_sample_docx(path)
+        paths = [path] + ([SAMPLE_DOCX] if os.path.exists(SAMPLE_DOCX) else [])
+
+        for docx_path in paths:
+            for options in ({}, {'preserve_latex': True, 'emit_html': True}):
+                parser = DocxParser(docx_path, **options)
+                streamed = parser.parse_questions()
+                baseline = _baseline_questions(parser)
+                print(f"{os.path.basename(docx_path)} {options}: {len(streamed)} questions")
+                assert streamed and _without_ids(streamed) == _without_ids(baseline)
+
+
+def test_parse_again_and_iterate():
+    """Test that a parser can parse twice and yields questions one by one"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'sample.docx')
+        _write_sample_docx(path)
+
+        with DocxParser(path) as parser:
+            first = parser.parse_questions()
+            assert parser._package is None
+            assert _without_ids(parser.parse_questions()) == _without_ids(first)
+
+            questions = parser.iter_questions()
+            assert next(questions)['clo'] == 'CLO1'
+            assert parser._package is not None
+            questions.close()
+            assert parser._package is None
+
+        assert [question['type'] for question in first] == ['multi-choice', 'single-choice', 'group']
+        assert [answer['isCorrect'] for answer in first[0]['answers']] == [True, False, False, True]
+        # The answer-like paragraph in the table is not part of any question
+        assert all('Trong bảng' not in answer['content'] for answer in first[0]['answers'])
+
+
+def test_html_escapes_content():
+    """Test that contentHtml escapes text and keeps only the allowed formatting tags"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'sample.docx')
+        _write_sample_docx(path)
+        question = DocxParser(path, preserve_latex=True, emit_html=True).parse_questions()[0]
+
+    assert question['content'].startswith('Biểu thức <script>')
+    html = question['contentHtml']
+    print(f"Question HTML: {html}")
+    assert '<script>' not in html and '(CLO1)' not in html
+    assert html.startswith('Biểu thức <strong>&lt;script&gt;alert(1)&lt;/script&gt;</strong> &amp; giá trị')
+    assert '<span class="katex-formula">a&lt;b</span>' in html
+
+    answers = [answer['contentHtml'] for answer in question['answers']]
+    assert answers[0] == '<u>x &lt; y</u>'
+    assert answers[1] == 'y &gt; z'
+    assert answers[3] == '<strong><u>Không</u></strong>'
+
+
+def test_html_media_and_markers():
+    """Test media tags for markers split across runs and structural markers left out"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'sample.docx')
+        _write_sample_docx(path)
+        questions = DocxParser(path, emit_html=True,
+                               media_base_url='https://cdn.example/media/').parse_questions()
+        without_base = DocxParser(path, emit_html=True).parse_questions()
+        plain = DocxParser(path).parse_questions()
+
+    image = questions[0]['answers'][2]
+    assert image['content'] == '[IMAGE: hình 1.png]'
+    assert image['contentHtml'] == ('<img class="question-media" data-media="hình 1.png" alt="hình 1.png" '
+                                    'src="https://cdn.example/media/h%C3%ACnh%201.png">')
+    assert without_base[0]['answers'][2]['contentHtml'] == \
+        '<img class="question-media" data-media="hình 1.png" alt="hình 1.png">'
+
+    audio = questions[1]['contentHtml']
+    assert audio == ('Nghe <audio controls class="question-media" data-media="bai 1.mp3" '
+                     'src="https://cdn.example/media/bai%201.mp3"></audio> và trả lời')
+
+    group = questions[2]
+    assert group['groupContentHtml'] == 'Đoạn văn &lt;b&gt;chung&lt;/b&gt;'
+    assert '[<sg>]' not in group['groupContentHtml']
+
+    # HTML is only added when asked for
+    assert all('contentHtml' not in question for question in plain)
+    assert 'groupContentHtml' not in plain[2]
+
+
+def main():
+    """Main test function"""
+    print("=== DOCX Parser Test ===\n")
+
+    print("1. Testing streamed parse against python-docx...")
+    test_streamed_parse_matches_python_docx()
+
+    print("\n" + "="*50)
+    print("2. Testing repeated and incremental parsing...")
+    test_parse_again_and_iterate()
+
+    print("\n" + "="*50)
+    print("3. Testing HTML escaping...")
+    test_html_escapes_content()
+
+    print("\n" + "="*50)
+    print("4. Testing HTML media and markers...")
+    test_html_media_and_markers()
+
+    print("\n" + "="*50)
+    print("Test completed successfully!")
+
+
+if __name__ == '__main__':
+    main()
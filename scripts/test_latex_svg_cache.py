@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Tests for the LaTeX SVG cache
+Author: Linh Dang Dev
+
+Most tests replace the renderer so they do not need matplotlib.
+"""
+
+import sys
+import os
+import tempfile
+
+# Add the scripts directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import latex_svg_cache
+from latex_svg_cache import LatexSvgCache, expression_key, find_latex_expressions
+
+
+class CountingCache(LatexSvgCache):
+    """Cache whose renderer records each call; expressions containing 'bad' fail"""
+
+    def __init__(self, cache_dir, **kwargs):
+        super().__init__(cache_dir, **kwargs)
+        self.rendered = []
+
+    def render(self, expression):
+        self.rendered.append(expression)
+        if 'bad' in expression:
+            return None
+        return f"<svg>{expression_key(expression)}</svg>".encode('utf-8')
+
+
+def test_expressions_and_keys():
+    """Test finding expressions and keying equal formulas the same"""
+    text = r'Tính $x^2 + 1$ và \begin{matrix}a & b\end{matrix} rồi $ y $'
+    assert find_latex_expressions(text) == ['$x^2 + 1$', r'\begin{matrix}a & b\end{matrix}', '$ y $']
+    assert find_latex_expressions(None) == []
+    assert expression_key('$x^2  +\n1$') == expression_key('x^2 + 1')
+    assert expression_key('$x$') != expression_key('$y$')
+
+
+def test_hits_and_misses():
+    """Test that an expression is rendered once and found again after a restart"""
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = CountingCache(cache_dir)
+        path = cache.get('$x^2$')
+        assert path == os.path.join(cache_dir, f"{expression_key('x^2')}.svg")
+        assert cache.get(' $x^2$ ') == path
+        assert (cache.hits, cache.misses, cache.rendered) == (1, 1, ['$x^2$'])
+
+        # Failures are remembered and not rendered again
+        assert cache.get('$bad$') is None and cache.get('$bad$') is None
+        assert cache.rendered == ['$x^2$', '$bad$'] and cache.misses == 2
+
+        reopened = CountingCache(cache_dir)
+        assert reopened.get('$x^2$') == path
+        assert reopened.rendered == [] and reopened.hits == 1
+
+        # A file removed behind the cache's back is rendered again
+        os.remove(path)
+        assert reopened.get('$x^2$') == path and os.path.exists(path)
+        assert reopened.rendered == ['$x^2$']
+
+
+def test_failed_expressions_are_bounded():
+    """Test that the failed set forgets the least recently seen expression"""
+    max_failed = latex_svg_cache.MAX_FAILED
+    latex_svg_cache.MAX_FAILED = 3
+    try:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = CountingCache(cache_dir)
+            for i in range(3):
+                cache.get(f"$bad {i}$")
+            cache.get('$bad 0$')  # seen again, so no longer the oldest
+            cache.get('$bad 3$')
+            assert len(cache._failed) == 3
+
+            cache.rendered.clear()
+            cache.get('$bad 0$')
+            cache.get('$bad 1$')
+            assert cache.rendered == ['$bad 1$']
+    finally:
+        latex_svg_cache.MAX_FAILED = max_failed
+
+
+def test_eviction_keeps_recently_used():
+    """Test that the byte budget evicts the least recently used SVG"""
+    with tempfile.TemporaryDirectory() as cache_dir:
+        size = len(CountingCache(cache_dir).render('$a$'))
+        cache = CountingCache(cache_dir, max_bytes=2 * size)
+        first = cache.get('$a$')
+        second = cache.get('$b$')
+        os.utime(first, (1, 1))
+        os.utime(second, (2, 2))
+        cache.get('$a$')  # now the most recent
+
+        cache.get('$c$')
+        assert os.path.exists(first) and not os.path.exists(second)
+        assert sum(cache._sizes.values()) <= cache.max_bytes
+
+
+def test_matplotlib_render():
+    """Test a real render when matplotlib is installed"""
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = LatexSvgCache(cache_dir)
+        if not cache.available:
+            print("matplotlib not installed, skipping")
+            return
+        path = cache.get(r'$\frac{a}{b}$')
+        with open(path, 'rb') as f:
+            assert b'<svg' in f.read()
+        assert cache.get(r'$\notacommand{$') is None
+
+
+def main():
+    """Main test function"""
+    print("=== LaTeX SVG Cache Test ===\n")
+
+    print("1. Testing expressions and keys...")
+    test_expressions_and_keys()
+
+    print("\n" + "="*50)
+    print("2. Testing hits and misses...")
+    test_hits_and_misses()
+
+    print("\n" + "="*50)
+    print("3. Testing the failed expression bound...")
+    test_failed_expressions_are_bounded()
+
+    print("\n" + "="*50)
+    print("4. Testing eviction...")
+    test_eviction_keeps_recently_used()
+
+    print("\n" + "="*50)
+    print("5. Testing a matplotlib render...")
+    test_matplotlib_render()
+
+    print("\n" + "="*50)
+    print("Test completed successfully!")
+
+
+if __name__ == '__main__':
+    main()